@@ -3,6 +3,8 @@ import logging
 from json import loads as json_loads
 from json import dumps as json_dumps
 from ros.app import AsyncioExecutor
+from ros.config import Config
+from ros.retention import Reaper
 from ros.workflow import Workflow
 from ros.util import LoggingUtil
 from sanic import Sanic
@@ -22,6 +24,11 @@ app = Sanic(__name__)
 app.blueprint(openapi_blueprint)
 app.blueprint(swagger_blueprint)
 
+@app.listener('before_server_start')
+async def start_reaper(app, loop):
+    """ Reclaim expired workflow results in the background. """
+    app.reaper = Reaper.from_config (Config ()).start ()
+
 """ Configure API metadata. """
 app.config.API_VERSION = '1.0.0'
 app.config.API_TITLE = 'Ros API'
@@ -42,13 +49,17 @@ async def executeWorkflow(request):
     logger.debug(f"Received workflow execution request.")
 
     """ Build an async executor passing the workflow and its arguments. """
-    executor = AsyncioExecutor (
-        workflow=Workflow (
-            spec=workflow_spec,
-            inputs=request.json['args']))
+    workflow = Workflow (
+        spec=workflow_spec,
+        inputs=request.json['args'],
+        pin=request.json.get('pin', False))
+    executor = AsyncioExecutor (workflow=workflow)
 
     """ Execute the workflow coroutine asynchronously and return results when available. """
-    return json(await executor.execute ())
+    try:
+        return json(await executor.execute ())
+    finally:
+        workflow.close ()
 
 def workaround_sanic_openapi_naming_issue ():
     """
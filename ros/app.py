@@ -10,7 +10,10 @@ import time
 import yaml
 from types import SimpleNamespace
 from ros.client import Client
+from ros.config import Config
+from ros.executor import OperatorExecutor
 from ros.router import Router
+from ros.workflow import DependencyTracker
 from ros.workflow import Workflow
 from ros.lib.ndex import NDEx
 from ros.tasks import exec_operator
@@ -41,24 +44,34 @@ def model2json(model):
         "spec" : model.spec,
         "inputs" : model.inputs,
         "dependencies" : model.dependencies,
+        "dependents" : model.dependents,
+        "in_degree" : model.in_degree,
         "topsort" : model.topsort,
         "running" : {},
         "failed" : {},
         "done" : {}
     }
 
-async def call_op (workflow, router, job_name, op_node):
-    logger.debug (f"     call_op: {job_name}")
+def route_op (workflow, router, job_name, op_node):
+    """ Invoke the operator and store its result. Both block, so this runs in an executor pool. """
     return workflow.set_result (
         job_name,
         router.route (workflow, job_name, op_node, op_node['code'], op_node['args']))
+
+async def call_op (workflow, router, job_name, op_node):
+    logger.debug (f"     call_op: {job_name}")
+    pool = router.get_pool (op_node['code'])
+    if pool == OperatorExecutor.PROCESS:
+        """ Routing needs the workflow so it stays in a thread; the router hands the operator to the process pool. """
+        pool = OperatorExecutor.THREAD
+    return await OperatorExecutor.get ().run (pool, route_op, workflow, router, job_name, op_node)
     
 async def exec_async (workflow, job_name):
     result = None
     op_node = workflow.get_step (job_name)
     if op_node:
         logger.debug (f"    -exec: {job_name}")
-        router = Router (workflow)
+        router = workflow.get_router ()
         '''
         result = workflow.set_result (
             job_name,
@@ -70,69 +83,143 @@ async def exec_async (workflow, job_name):
 class AsyncioExecutor:
     """ Execute the workflow concurrently using Python async. """
     
-    def __init__(self, workflow):
-        """ Manage workflow execution. """
+    def __init__(self, workflow, run_job=exec_async, max_concurrency=None):
+        """
+        Manage workflow execution. run_job is the coroutine used to execute a single job.
+        max_concurrency caps the number of jobs running at once. It defaults to the executor
+        configuration's max_concurrent_jobs where zero means unlimited.
+        """
         self.workflow = workflow
+        self.run_job = run_job
+        if max_concurrency is None:
+            max_concurrency = int(Config ().get ('executor', {}).get ('max_concurrent_jobs', 0))
+        self.max_concurrency = max_concurrency if max_concurrency > 0 else None
+        self.stats = {}
         
+    def free_slots (self):
+        """ Number of jobs that may be launched now, or None if unlimited. """
+        if self.max_concurrency is None:
+            return None
+        return max (0, self.max_concurrency - len(self.workflow.execution.running))
+
+    async def run_or_reuse (self, job_name):
+        """
+        Adopt a result from an earlier incremental run if there is one, otherwise run the job.
+        Reuse reads the cache and writes the graph store, so like an operator it runs in the thread pool.
+        Returns whether the result was reused.
+        """
+        if await OperatorExecutor.get ().run (OperatorExecutor.THREAD, self.workflow.reuse_result, job_name):
+            return True
+        await self.run_job (self.workflow, job_name)
+        return False
+
+    def launch_ready (self, tracker, started):
+        """ Launch ready jobs into free slots. """
+        execution = self.workflow.execution
+        for j in tracker.pop_ready (limit=self.free_slots ()):
+            logger.debug (f"   launch:{j}, done:{[ d for d in execution.done.keys ()]}")
+            started[j] = time.time ()
+            execution.running[j] = asyncio.ensure_future (self.run_or_reuse (j))
+
     async def execute (self):
-        """ A workflow execution coroutine. """
-        while len(self.workflow.topsort) > len(self.workflow.execution.done):
+        """
+        A workflow execution coroutine.
+        Every ready job is launched at once, up to the concurrency limit. The scheduler then sleeps until
+        any running job finishes, records its result, and launches whatever that completion made ready.
+        When ready jobs exceed free slots, those with the longest estimated remaining critical path go first.
+        """
+        execution = self.workflow.execution
+        tracker = DependencyTracker (
+            dependents = self.workflow.dependents,
+            in_degree = self.workflow.in_degree,
+            order = self.workflow.topsort,
+            priority = Workflow.critical_path (
+                dependents = self.workflow.dependents,
+                topsort = self.workflow.topsort,
+                costs = self.workflow.estimate_costs ()))
+        start_time = time.time ()
+        started = {}
+        busy_time = 0
+        max_concurrency = 0
+        while len(execution.done) < len(self.workflow.topsort):
             logger.debug ("scheduler")
-            topsort = self.workflow.topsort.copy ()
-            pending = topsort.copy ()
-            for j in topsort:
-                
-                if j in self.workflow.execution.done or j in self.workflow.execution.running:
-                    """ If running or done, it doesn't need further scheduling. """
-                    continue
-                
-                dependencies = self.workflow.dependencies[j]
-                logger.debug (f"   this:{j}, done:{[ d for d in self.workflow.execution.done.keys ()]} deps:{dependencies}")                
-                if len(dependencies) == 0 or all ([ d in self.workflow.execution.done for d in dependencies ]):
-                    """ Has no dependencies or they're all completed. Execute this task. Use Python async for concurrency. """
-                    task = asyncio.ensure_future (exec_async (self.workflow, j))
-                    self.workflow.execution.running[j] = task
-                    pending.remove (j)
-                    await task
+            self.launch_ready (tracker, started)
+            if len(execution.done) == len(self.workflow.topsort):
+                break
+            if len(execution.running) == 0:
+                raise ValueError (f"Unable to schedule remaining jobs. done: {[ d for d in execution.done.keys ()]}")
+            max_concurrency = max (max_concurrency, len(execution.running))
 
-            completed = []
-            for job_name, promise in self.workflow.execution.running.items ():
-                logger.debug (f"running job: {job_name} done:{promise.done()}")
-                if promise.done ():
-                    completed.append (job_name)
-                    if promise.exception ():
-                        completed.append (job_name)
-                        self.workflow.execution.failed[job_name] = promise.get ()
-                        raise promise.exception ()
-                    else:
-                        self.workflow.execution.done[job_name] = self.workflow.get_result (job_name)
-            for c in completed:
+            """ Wake up as soon as any job completes. """
+            finished, pending = await asyncio.wait (
+                execution.running.values (),
+                return_when=asyncio.FIRST_COMPLETED)
+            for job_name, task in list(execution.running.items ()):
+                if not task in finished:
+                    continue
                 logger.debug (f"removing {job_name} from running.")
-                del self.workflow.execution.running[c]
-            time.sleep (1)
-        return self.workflow.execution.done['return']
+                del execution.running[job_name]
+                elapsed = time.time () - started[job_name]
+                busy_time = busy_time + elapsed
+                if task.exception ():
+                    execution.failed[job_name] = task.exception ()
+                    for other in execution.running.values ():
+                        other.cancel ()
+                    raise task.exception ()
+                execution.done[job_name] = self.workflow.get_result (job_name)
+                if task.result ():
+                    logger.debug (f"   reused:{job_name}")
+                    execution.skipped.append (job_name)
+                elif not job_name in execution.cached:
+                    """ Only operator invocations inform latency. A cache hit says nothing about the operator's cost. """
+                    self.workflow.record_latency (job_name, elapsed)
+                tracker.complete (job_name)
+
+        """ Persist this run's latency observations in one batch, off the event loop. """
+        await asyncio.get_event_loop ().run_in_executor (None, self.workflow.save_latencies)
+
+        """ Report achieved parallelism: total job time over elapsed time. """
+        wall_time = time.time () - start_time
+        self.stats = {
+            "jobs"            : len(execution.done),
+            "skipped"         : len(execution.skipped),
+            "cached"          : len(execution.cached),
+            "wall_time"       : wall_time,
+            "busy_time"       : busy_time,
+            "max_concurrency" : max_concurrency,
+            "parallelism"     : busy_time / wall_time if wall_time > 0 else 1.0
+        }
+        logger.info (f"executed {self.stats['jobs']} jobs in {wall_time:.2f}s; "
+                     f"parallelism: {self.stats['parallelism']:.2f} max concurrency: {max_concurrency}")
+        return execution.done['return']
 
 class CeleryDAGExecutor:
-    def __init__(self, spec):
-        self.spec = spec        
+    def __init__(self, spec, run_job=run_job, max_concurrency=None):
+        """
+        Execute a workflow via Celery. run_job starts a single job, either recording its result in the
+        model's done map or its pending promise in the running map. max_concurrency caps the number of
+        jobs running at once and defaults as for AsyncioExecutor.
+        """
+        self.spec = spec
+        self.run_job = run_job
+        if max_concurrency is None:
+            max_concurrency = int(Config ().get ('executor', {}).get ('max_concurrent_jobs', 0))
+        self.max_concurrency = max_concurrency if max_concurrency > 0 else None
     def execute (self):
         ''' Dispatch a task to create the DAG for this workflow. '''
         model_dict = self.spec.json () #calc_dag(self.spec, inputs=self.inputs)
         model = json2model (model_dict)
-        total_jobs = len(model.topsort)
-        ''' Iterate over topologically sorted job names. '''
-        while len(model.topsort) > 0:
-            for j in model.topsort:
+        tracker = DependencyTracker (
+            dependents = model.dependents,
+            in_degree = model.in_degree,
+            order = model.topsort)
+        ''' Run jobs as their dependencies complete. '''
+        while len(model.topsort) > 0 or len(model.running) > 0:
+            slots = None if self.max_concurrency is None else max (0, self.max_concurrency - len(model.running))
+            for j in tracker.pop_ready (limit=slots):
+                self.run_job (j, model)
                 if j in model.done:
-                    break
-                dependencies = model.dependencies[j]
-                if len(dependencies) == 0:
-                    ''' Jobs with no dependencies can be run w/o further delay. '''
-                    run_job (j, model, asynchronous=False)
-                else:
-                    ''' Iff all of this jobs dependencies are complete, run it. '''
-                    if all ([ d in model.done for d in dependencies ]):
-                        run_job (j, model, asynchronous=False)
+                    tracker.complete (j)
             completed = []
             ''' Manage our list of asynchronous jobs. '''
             for job_name, promise in model.running.items ():
@@ -140,14 +227,15 @@ class CeleryDAGExecutor:
                 if promise.ready ():
                     completed.append (job_name)
                     model.done[job_name] = promise.get ()
-                    sink = model.get("workflow",{}).get(c,{})
-                    sink['result'] = model.done[c]
+                    tracker.complete (job_name)
                 elif promise.failed ():
                     completed.append (job_name)
                     model.failed[job_name] = promise.get ()
             for c in completed:
-                logger.debug (f"removing {job_name} from running.")
+                logger.debug (f"removing {c} from running.")
                 del model.running[c]
+            if len(model.running) == 0 and len(tracker.ready) == 0:
+                break
         return model.done['return']
 
 def start_task_queue ():
@@ -174,6 +262,7 @@ def main ():
     arg_parser.add_argument('-l', '--libpath', help="A directory containing workflow modules.", action='append', default=["."])
     arg_parser.add_argument('-n', '--ndex', help="Name of the graph to publish to NDEx. Requires valid ~/.ndex credential file.")
     arg_parser.add_argument('--validate', help="Validate inputs and outputs", action="store_true")
+    arg_parser.add_argument('--incremental', help="Reuse results of unchanged jobs from previous runs.", action="store_true")
     args = arg_parser.parse_args ()
 
     LoggingUtil.setup_logging ()
@@ -196,14 +285,19 @@ def main ():
         executor = AsyncioExecutor (
             workflow=Workflow.get_workflow (workflow=args.workflow,
                                             inputs=wf_args,
-                                            library_path=args.libpath))
+                                            library_path=args.libpath,
+                                            incremental=args.incremental))
         tasks = [
             asyncio.ensure_future (executor.execute ())
         ]
         loop = asyncio.get_event_loop()
         loop.run_until_complete(asyncio.wait(tasks))
+        executor.workflow.close ()
         
         response = tasks[0].result ()
+        if args.incremental:
+            skipped = executor.workflow.execution.skipped
+            print (f"Skipped {len(skipped)} unchanged jobs: {', '.join(skipped)}", file=sys.stderr)
         
     if args.ndex:
         """ Output to NDEx. """
@@ -0,0 +1,523 @@
+import argparse
+import concurrent.futures
+import multiprocessing
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+import networkx as nx
+from types import SimpleNamespace
+from ros.cache import JSONCacheSerializer
+from ros.compact import CompactGraph
+from ros.cache import PickleCacheSerializer
+from ros.config import Config
+from ros.connections import ConnectionPools
+from ros.framework import Operator
+from ros.graph import GraphAccumulator
+from ros.graph import TranslatorGraphTools
+from jsonpath_rw import parse
+from ros.util import JSONKit
+from ros.util import KGS_EDGES
+from ros.util import KGS_NODES
+from ros.util import compile_jsonpath
+from ros.graph import stream_graph
+from ros.router import OperatorRegistry
+from ros.router import Router
+from ros.util import Interner
+from ros.workflow import DependencyTracker
+from ros.workflow import Workflow
+
+"""
+Benchmarks for performance sensitive parts of the engine.
+
+  PYTHONPATH=$PWD/.. python benchmark.py scheduler --jobs 10000
+  PYTHONPATH=$PWD/.. python benchmark.py router --jobs 1000
+  PYTHONPATH=$PWD/.. python benchmark.py merge --answers 100000 --skip-baseline
+  PYTHONPATH=$PWD/.. python benchmark.py stream --answers 200000
+  PYTHONPATH=$PWD/.. python benchmark.py serializer --graph test_graph.json
+  PYTHONPATH=$PWD/.. python benchmark.py dedup --max-nodes 1000000
+  PYTHONPATH=$PWD/.. python benchmark.py jsonpath --answers 100000
+  PYTHONPATH=$PWD/.. python benchmark.py compose --answers 2000
+  PYTHONPATH=$PWD/.. python benchmark.py compact --answers 100000
+  PYTHONPATH=$PWD/.. python benchmark.py intern --jobs 20 --answers 20000
+"""
+
+logger = logging.getLogger("benchmark")
+logger.setLevel(logging.WARNING)
+
+def timed (f, *args, **kwargs):
+    """ Call f returning its result and elapsed seconds. """
+    start = time.perf_counter ()
+    result = f (*args, **kwargs)
+    return result, time.perf_counter () - start
+
+def report (name, values):
+    print (f"{name}: {json.dumps (values)}")
+
+def synthetic_dag (jobs, width, fan_in=2, seed=0):
+    """
+    Generate a layered DAG of the given number of jobs.
+    Each job depends on up to fan_in jobs of the previous layer. A final return job depends on the last layer.
+    """
+    rand = random.Random (seed)
+    dependencies = {}
+    previous = []
+    layer = []
+    for index in range (jobs - 1):
+        job_name = f"job_{index}"
+        dependencies[job_name] = rand.sample (previous, min(fan_in, len(previous)))
+        layer.append (job_name)
+        if len(layer) == width:
+            previous, layer = layer, []
+    dependencies["return"] = layer if len(layer) > 0 else previous
+    return dependencies
+
+def rescan_schedule (dependencies, topsort, per_completion=False):
+    """
+    Scheduling by rescanning every job each pass.
+    By default a pass completes all runnable jobs. With per_completion, the scheduler wakes once per finished job.
+    """
+    done = {}
+    while len(done) < len(topsort):
+        running = [ j for j in topsort
+                    if not j in done and all ([ d in done for d in dependencies[j] ]) ]
+        for j in running[:1] if per_completion else running:
+            done[j] = True
+    return len(done)
+
+def tracker_schedule (dependencies, topsort):
+    """ Event driven scheduling with in-degree counters. """
+    dependents, in_degree = Workflow.reverse_dependencies (dependencies)
+    tracker = DependencyTracker (dependents, in_degree, order=topsort)
+    done = 0
+    ready = tracker.pop_ready ()
+    while len(ready) > 0:
+        for j in ready:
+            tracker.complete (j)
+            done = done + 1
+        ready = tracker.pop_ready ()
+    return done
+
+def bench_scheduler (args):
+    """ Compare full rescans with in-degree tracking on a wide synthetic DAG. """
+    dependencies = synthetic_dag (jobs=args.jobs, width=args.width)
+    topsort = [ j for j in dependencies.keys () ]
+    edges = sum ([ len(d) for d in dependencies.values () ])
+    scheduled, tracker_time = timed (tracker_schedule, dependencies, topsort)
+    assert scheduled == len(topsort)
+    scheduled, rescan_time = timed (rescan_schedule, dependencies, topsort, args.per_completion)
+    assert scheduled == len(topsort)
+    report ("scheduler", {
+        "jobs"    : len(topsort),
+        "edges"   : edges,
+        "rescan"  : round (rescan_time, 4),
+        "tracker" : round (tracker_time, 4),
+        "speedup" : round (rescan_time / tracker_time, 1)
+    })
+
+class BenchmarkOperator (Operator):
+    """ A trivial operator standing in for a knowledge source library. """
+    def __init__(self):
+        super ().__init__ (name=type(self).__name__.lower ())
+    def invoke (self, event):
+        return event.node
+
+""" A handful of distinct operator libraries. """
+BENCHMARK_LIBRARIES = 8
+for index in range (BENCHMARK_LIBRARIES):
+    globals ()[f"BenchmarkOperator{index}"] = type (f"BenchmarkOperator{index}", (BenchmarkOperator,), {})
+
+class BenchmarkPlugin:
+    """ A plugin providing the benchmark operator libraries. """
+    name = "benchmark"
+    def workflows (self):
+        return []
+    def libraries (self):
+        return [ f"ros.benchmark.BenchmarkOperator{index}" for index in range (BENCHMARK_LIBRARIES) ]
+
+def bench_router (args):
+    """ Per job routing overhead: building plugin operators for each job versus a registry lookup. """
+    plugin_config = [ { "name" : "benchmark", "driver" : "ros.benchmark.BenchmarkPlugin" } ]
+    workflow = SimpleNamespace (
+        config = Config ({
+            "plugins" : plugin_config,
+            "redis"   : { "host" : "localhost", "port" : 6379 }
+        }),
+        spec = {
+            "templates" : {
+                "naming" : { "code" : "benchmarkoperator0", "args" : {} }
+            }
+        },
+        pools = ConnectionPools ())
+    op = "benchmarkoperator3"
+
+    def construct_per_job ():
+        """ The prior behaviour: instantiate every plugin library and build a router for each job. """
+        for i in range (args.jobs):
+            router = Router (workflow, registry=OperatorRegistry (plugin_config))
+            router.r[op], router.get_pool (op)
+
+    def lookup_per_job ():
+        """ Build the router once per workflow; each job looks up its operator. """
+        router = Router (workflow, registry=OperatorRegistry.get_instance (plugin_config))
+        for i in range (args.jobs):
+            router.r[op], router.get_pool (op)
+
+    ignore, before = timed (construct_per_job)
+    ignore, after = timed (lookup_per_job)
+    report ("router", {
+        "jobs"          : args.jobs,
+        "before_us_job" : round (1e6 * before / args.jobs, 2),
+        "after_us_job"  : round (1e6 * after / args.jobs, 2),
+        "speedup"       : round (before / after, 1)
+    })
+
+def synthetic_answers (answers, vocabulary, seed=0):
+    """ A gamma style response: each answer links a drug to a disease through a gene drawn from a shared vocabulary. """
+    rand = random.Random (seed)
+    def node (kind):
+        identifier = f"{kind}:{rand.randrange (vocabulary)}"
+        return { "id" : identifier, "type" : kind, "name" : identifier }
+    result = []
+    for index in range (answers):
+        drug, gene, disease = node ("chemical_substance"), node ("gene"), node ("disease")
+        result.append ({
+            "nodes" : [ drug, gene, disease ],
+            "edges" : [
+                { "source_id" : drug["id"], "target_id" : gene["id"], "type" : "targets" },
+                { "source_id" : gene["id"], "target_id" : disease["id"], "type" : "gene_associated_with_condition" }
+            ]
+        })
+    return { "answers" : result }
+
+def concatenate_answers (response):
+    """ The prior merge: rebuild the node and edge lists for every answer, keeping duplicates. """
+    nodes = []
+    edges = []
+    for answer in response['answers']:
+        nodes = nodes + answer['nodes']
+        edges = edges + answer['edges']
+    return nodes, edges
+
+def accumulate_answers (response):
+    accumulator = GraphAccumulator ()
+    accumulator.add_response (response)
+    return list(accumulator.nodes.values ()), accumulator.edges
+
+def measured (f, *args):
+    """ Call f returning its result, elapsed seconds, and peak traced memory in megabytes. """
+    tracemalloc.start ()
+    result, elapsed = timed (f, *args)
+    current, peak = tracemalloc.get_traced_memory ()
+    tracemalloc.stop ()
+    return result, elapsed, round (peak / 2**20, 2)
+
+def bench_merge (args):
+    """ Merge time and peak memory for a large MaQ response. """
+    response = synthetic_answers (args.answers, args.vocabulary)
+    values = { "answers" : args.answers }
+    (nodes, edges), elapsed, peak = measured (accumulate_answers, response)
+    values.update ({ "accumulator" : round (elapsed, 4), "accumulator_mb" : peak, "nodes" : len(nodes) })
+    if not args.skip_baseline:
+        (nodes, edges), elapsed, peak = measured (concatenate_answers, response)
+        values.update ({ "concatenate" : round (elapsed, 4), "concatenate_mb" : peak, "concatenate_nodes" : len(nodes) })
+    report ("merge", values)
+
+def load_response (path):
+    """ The prior path: parse the whole body, then merge it. """
+    with open (path, "rb") as stream:
+        response = json.load (stream)
+    accumulator = GraphAccumulator ()
+    accumulator.add_response (response)
+    return len(accumulator.nodes), len(accumulator.edges)
+
+def stream_response (path):
+    """ Parse incrementally, merging each node and edge as it's read. """
+    accumulator = GraphAccumulator ()
+    with open (path, "rb") as stream:
+        accumulator.add_records (stream_graph (stream))
+    return len(accumulator.nodes), len(accumulator.edges)
+
+def bench_stream (args):
+    """ Peak memory and time to merge a large response: whole body parsing versus streaming. """
+    with tempfile.NamedTemporaryFile (suffix=".json", delete=False) as stream:
+        stream.write (json.dumps (synthetic_answers (args.answers, args.vocabulary)).encode ("utf-8"))
+        path = stream.name
+    try:
+        size = round (os.path.getsize (path) / 2**20, 2)
+        """ Tracing allocations slows the streaming parser disproportionately, so time untraced runs. """
+        loaded, load_time = timed (load_response, path)
+        streamed, stream_time = timed (stream_response, path)
+        assert loaded == streamed
+        ignore, ignore_time, load_peak = measured (load_response, path)
+        ignore, ignore_time, stream_peak = measured (stream_response, path)
+        report ("stream", {
+            "answers"   : args.answers,
+            "input_mb"  : size,
+            "nodes"     : streamed[0],
+            "edges"     : streamed[1],
+            "load"      : round (load_time, 3),
+            "load_mb"   : load_peak,
+            "stream"    : round (stream_time, 3),
+            "stream_mb" : stream_peak
+        })
+    finally:
+        os.remove (path)
+
+class LegacySerializer:
+    """ The prior cache path: pretty printed JSON text, pickled. """
+    def dumps (self, obj):
+        return PickleCacheSerializer ().dumps (json.dumps (obj, indent=2))
+    def loads (self, data):
+        return json.loads (PickleCacheSerializer ().loads (data))
+
+def bench_serializer (args):
+    """ Encode and decode time and stored bytes for a cached graph. """
+    with open (args.graph, "r") as stream:
+        graph = json.load (stream)
+    serializers = { "legacy" : LegacySerializer () }
+    for codec in [ "json", "msgpack" ]:
+        for compression in [ "none", "zlib", "zstd", "lz4" ]:
+            try:
+                serializers[f"{codec}+{compression}"] = JSONCacheSerializer (codec=codec, compression=compression)
+            except ValueError:
+                logger.info (f"skipping {codec}+{compression}: not installed")
+    for name, serializer in serializers.items ():
+        data = serializer.dumps (graph)
+        assert serializer.loads (data) == graph
+        ignore, encode = timed (lambda: [ serializer.dumps (graph) for i in range (args.rounds) ])
+        ignore, decode = timed (lambda: [ serializer.loads (data) for i in range (args.rounds) ])
+        report ("serializer", {
+            "serializer" : name,
+            "bytes"      : len(data),
+            "encode_ms"  : round (1000 * encode / args.rounds, 3),
+            "decode_ms"  : round (1000 * decode / args.rounds, 3)
+        })
+
+def synthetic_nodes (count, duplication, seed=0):
+    """ Nodes with count / duplication distinct ids, each occurrence carrying a different attribute. """
+    rand = random.Random (seed)
+    ids = max (1, count // duplication)
+    return [
+        { "id" : f"gene:{rand.randrange (ids)}", "type" : "gene", f"source_{rand.randrange (4)}" : index }
+        for index in range (count)
+    ]
+
+def quadratic_dedup (nodes):
+    """ The prior dedup: scan every node for each node. """
+    tools = TranslatorGraphTools ()
+    seen = {}
+    return [ nn for nn in [ tools.coalesce_node (n, nodes, seen) for n in nodes ] if nn is not None ]
+
+def bench_dedup (args):
+    """ Node dedup time as node counts grow by factors of ten. """
+    tools = TranslatorGraphTools ()
+    count = args.min_nodes
+    while count <= args.max_nodes:
+        values = { "nodes" : count }
+        deduped, elapsed = timed (tools.dedup_nodes, synthetic_nodes (count, args.duplication))
+        values.update ({ "distinct" : len(deduped), "dedup" : round (elapsed, 4) })
+        if count <= args.baseline_max:
+            baseline, elapsed = timed (quadratic_dedup, synthetic_nodes (count, args.duplication))
+            assert baseline == deduped
+            values["quadratic"] = round (elapsed, 4)
+        report ("dedup", values)
+        count = count * 10
+
+def synthetic_kgs (answers, vocabulary, seed=0):
+    """ A result_list style answer set with one result graph per answer. """
+    return [
+        {
+            "result_list" : [
+                { "result_graph" : { "node_list" : answer["nodes"], "edge_list" : answer["edges"] } }
+                for answer in synthetic_answers (answers, vocabulary, seed)["answers"]
+            ]
+        }
+    ]
+
+def bench_jsonpath (args):
+    """ Node and edge list extraction: parsing per call, compiled once, and the hand written fast path. """
+    graph = synthetic_kgs (args.answers, args.vocabulary)
+    jsonkit = JSONKit ()
+    approaches = {
+        "parse"    : lambda query: [ match.value for match in parse (query).find (graph) ],
+        "compiled" : lambda query: [ match.value for match in compile_jsonpath (query).find (graph) ],
+        "fast"     : lambda query: jsonkit.find (query, graph)
+    }
+    values = { "answers" : args.answers }
+    expected = None
+    for name, extract in approaches.items ():
+        (nodes, edges), elapsed = timed (lambda: (extract (KGS_NODES), extract (KGS_EDGES)))
+        if expected is None:
+            expected = (nodes, edges)
+        assert (nodes, edges) == expected
+        values[name] = round (elapsed, 4)
+    values.update ({ "nodes" : len(expected[0]), "edges" : len(expected[1]) })
+    ignore, values["parse_only"] = timed (lambda: [ parse (KGS_NODES) for i in range (100) ])
+    values["parse_only"] = round (values["parse_only"] / 100, 5)
+    report ("jsonpath", values)
+
+def compose_answers (answers):
+    """ The prior fold: compose the growing graph with each answer's graph, copying it every time. """
+    tools = TranslatorGraphTools ()
+    result = nx.MultiDiGraph ()
+    for answer in answers:
+        result = nx.compose (result, tools.to_nx (answer))
+    return result
+
+def bench_compose (args):
+    """ Folding many answer graphs into one NetworkX graph. """
+    tools = TranslatorGraphTools ()
+    answers = [
+        tools.kgs (nodes = answer["nodes"], edges = answer["edges"])
+        for answer in synthetic_answers (args.answers, args.vocabulary)["answers"]
+    ]
+    built, build_time = timed (tools.answer_set_to_nx, answers)
+    values = { "answers" : args.answers, "nodes" : built.number_of_nodes (), "edges" : built.number_of_edges (),
+               "builder" : round (build_time, 4) }
+    if not args.skip_baseline:
+        composed, compose_time = timed (compose_answers, answers)
+        assert composed.number_of_edges () == built.number_of_edges ()
+        values["compose"] = round (compose_time, 4)
+    report ("compose", values)
+
+def retained (f, *args):
+    """ Call f returning its result and the megabytes still allocated once it returns. """
+    tracemalloc.start ()
+    result = f (*args)
+    current, peak = tracemalloc.get_traced_memory ()
+    tracemalloc.stop ()
+    return result, round (current / 2**20, 2)
+
+def bench_compact (args):
+    """ Memory held by an answer set as KGS dicts, as a NetworkX graph, and as a compact graph, and filter time. """
+    tools = TranslatorGraphTools ()
+    text = json.dumps (synthetic_kgs (args.answers, args.vocabulary))
+    graph, kgs_mb = retained (json.loads, text)
+    nx_graph, nx_mb = retained (lambda: tools.to_nx (json.loads (text)))
+    compact, compact_mb = retained (lambda: CompactGraph.from_kgs (json.loads (text)))
+    del nx_graph
+
+    edges = list(compact.edges ())
+    types = { n['id'] : n['type'] for n in compact.nodes () }
+    selected, loop_time = timed (lambda: [
+        e for e in edges if e['type'] == "targets" and types[e['target_id']] == "gene"
+    ])
+    mask, vector_time = timed (compact.edge_mask, [ "targets" ], None, [ "gene" ])
+    assert int(mask.sum ()) == len(selected)
+    report ("compact", {
+        "answers"    : args.answers,
+        "nodes"      : compact.number_of_nodes (),
+        "edges"      : compact.number_of_edges (),
+        "kgs_mb"     : kgs_mb,
+        "nx_mb"      : nx_mb,
+        "compact_mb" : compact_mb,
+        "filter_dicts"      : round (loop_time, 4),
+        "filter_vectorized" : round (vector_time, 4)
+    })
+
+def rss_mb ():
+    """ Resident set size of this process in megabytes. """
+    with open ("/proc/self/statm", "r") as stream:
+        pages = int(stream.read ().split ()[1])
+    return pages * os.sysconf ("SC_PAGE_SIZE") / 2**20
+
+def workflow_rss (jobs, answers, vocabulary, intern):
+    """
+    Hold the results of a multi job workflow as Workflow does: each job's result is loaded from the cache
+    and built into a NetworkX graph. Jobs draw on a shared vocabulary, as jobs in one workflow do.
+    Returns the megabytes of resident memory the results add.
+    """
+    Interner.get_instance ().enabled = intern
+    serializer = JSONCacheSerializer (intern=intern)
+    tools = TranslatorGraphTools ()
+    cached = [ serializer.dumps (synthetic_kgs (answers, vocabulary, seed=job)) for job in range (jobs) ]
+    baseline = rss_mb ()
+    results = []
+    for data in cached:
+        value = serializer.loads (data)
+        results.append ((value, tools.to_nx (value)))
+    return round (rss_mb () - baseline, 1)
+
+def bench_intern (args):
+    """ Resident memory of a multi job workflow's results with and without interning, each in a fresh process. """
+    values = { "jobs" : args.jobs, "answers" : args.answers }
+    context = multiprocessing.get_context ("spawn")
+    for intern in [ False, True ]:
+        with concurrent.futures.ProcessPoolExecutor (max_workers=1, mp_context=context) as executor:
+            rss = executor.submit (workflow_rss, args.jobs, args.answers, args.vocabulary, intern).result ()
+        values["interned_mb" if intern else "plain_mb"] = rss
+    report ("intern", values)
+
+def main ():
+    arg_parser = argparse.ArgumentParser(
+        description='Ros Benchmarks',
+        formatter_class=lambda prog: argparse.ArgumentDefaultsHelpFormatter(prog, max_help_position=60))
+    subparsers = arg_parser.add_subparsers (dest="benchmark")
+
+    scheduler = subparsers.add_parser ("scheduler", help="Job scheduling overhead on a synthetic DAG.")
+    scheduler.add_argument('--jobs', help="Number of jobs.", type=int, default=10000)
+    scheduler.add_argument('--width', help="Jobs per layer.", type=int, default=500)
+    scheduler.add_argument('--per-completion', help="Rescan once per completed job.", action="store_true")
+    scheduler.set_defaults (func=bench_scheduler)
+
+    router = subparsers.add_parser ("router", help="Per job operator routing overhead.")
+    router.add_argument('--jobs', help="Number of jobs.", type=int, default=1000)
+    router.set_defaults (func=bench_router)
+
+    merge = subparsers.add_parser ("merge", help="Merging MaQ answers into one graph.")
+    merge.add_argument('--answers', help="Number of answers.", type=int, default=20000)
+    merge.add_argument('--vocabulary', help="Distinct identifiers per node type.", type=int, default=5000)
+    merge.add_argument('--skip-baseline', help="Don't run the quadratic baseline.", action="store_true")
+    merge.set_defaults (func=bench_merge)
+
+    stream = subparsers.add_parser ("stream", help="Streaming a large knowledge source response.")
+    stream.add_argument('--answers', help="Number of answers.", type=int, default=200000)
+    stream.add_argument('--vocabulary', help="Distinct identifiers per node type.", type=int, default=5000)
+    stream.set_defaults (func=bench_stream)
+
+    serializer = subparsers.add_parser ("serializer", help="Cache serializer speed and size.")
+    serializer.add_argument('--graph', help="A knowledge graph JSON file.", default="test_graph.json")
+    serializer.add_argument('--rounds', help="Encodes and decodes to time.", type=int, default=50)
+    serializer.set_defaults (func=bench_serializer)
+
+    dedup = subparsers.add_parser ("dedup", help="Deduplicating answer graph nodes.")
+    dedup.add_argument('--min-nodes', help="Smallest node count.", type=int, default=1000)
+    dedup.add_argument('--max-nodes', help="Largest node count.", type=int, default=1000000)
+    dedup.add_argument('--duplication', help="Average occurrences of each id.", type=int, default=4)
+    dedup.add_argument('--baseline-max', help="Largest node count to run the quadratic baseline on.", type=int, default=10000)
+    dedup.set_defaults (func=bench_dedup)
+
+    jsonpath = subparsers.add_parser ("jsonpath", help="Extracting node and edge lists from answer sets.")
+    jsonpath.add_argument('--answers', help="Number of answers.", type=int, default=100000)
+    jsonpath.add_argument('--vocabulary', help="Distinct identifiers per node type.", type=int, default=5000)
+    jsonpath.set_defaults (func=bench_jsonpath)
+
+    compose = subparsers.add_parser ("compose", help="Folding answer graphs into one NetworkX graph.")
+    compose.add_argument('--answers', help="Number of answers.", type=int, default=2000)
+    compose.add_argument('--vocabulary', help="Distinct identifiers per node type.", type=int, default=5000)
+    compose.add_argument('--skip-baseline', help="Don't run the quadratic baseline.", action="store_true")
+    compose.set_defaults (func=bench_compose)
+
+    compact = subparsers.add_parser ("compact", help="Memory and filtering of a compact knowledge graph.")
+    compact.add_argument('--answers', help="Number of answers.", type=int, default=100000)
+    compact.add_argument('--vocabulary', help="Distinct identifiers per node type.", type=int, default=50000)
+    compact.set_defaults (func=bench_compact)
+
+    intern = subparsers.add_parser ("intern", help="Resident memory of workflow results with string interning.")
+    intern.add_argument('--jobs', help="Number of jobs.", type=int, default=20)
+    intern.add_argument('--answers', help="Answers per job.", type=int, default=20000)
+    intern.add_argument('--vocabulary', help="Distinct identifiers per node type.", type=int, default=5000)
+    intern.set_defaults (func=bench_intern)
+
+    args = arg_parser.parse_args ()
+    if not hasattr (args, "func"):
+        arg_parser.print_help ()
+        return
+    args.func (args)
+
+if __name__ == '__main__':
+    main ()
@@ -3,15 +3,47 @@ import logging
 import operator
 import os
 import pickle
+import re
 import requests
 import redis
+import tempfile
+import threading
+import time
 import traceback
+import zlib
+from collections import OrderedDict
+from ros.util import Interner
 from ros.util import LoggingUtil
-from lru import LRU
+
+""" Optional faster codecs and compressors. The standard library is the fallback for each. """
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
 
 logger = logging.getLogger("util")
 logger.setLevel(logging.WARNING)
 
+def glob_escape (text):
+    """ Escape text for use in a Redis match pattern. """
+    return re.sub (r"([*?\[\]\\])", r"\\\1", text)
+
 class CacheSerializer:
     """ Generic serializer. """
     def __init__(self):
@@ -27,72 +59,652 @@ class PickleCacheSerializer(CacheSerializer):
         return pickle.loads (str)
 
 class JSONCacheSerializer(CacheSerializer):
-    pass # would be nice
+    """
+    Serialize JSON compatible values once, in their native structure.
+
+    Values are encoded as msgpack if it's installed, otherwise as compact JSON using the fastest available
+    library. Encodings larger than the threshold are compressed with zstd or lz4 if installed, otherwise zlib.
+    A two byte header names the codec and compression, so any serializer can read what another wrote.
+    Entries written by the pickle serializer are still readable.
+    """
+
+    JSON = b"j"
+    MSGPACK = b"m"
+    NONE = b"-"
+    ZLIB = b"z"
+    ZSTD = b"s"
+    LZ4 = b"l"
+
+    def __init__(self, codec="auto", compression="auto", threshold=4096, level=3, intern=False):
+        """
+        :codec: json, msgpack, or auto to prefer msgpack.
+        :compression: none, zlib, zstd, lz4, or auto to prefer zstd, then lz4, then zlib.
+        :threshold: Encodings at least this many bytes are compressed.
+        :level: Compression level.
+        :intern: Share CURIE and type strings of decoded values through the process wide Interner.
+            Off by default: it more than doubles decoding time, and results are interned anyway when
+            GraphBuilder or GraphAccumulator merge them.
+        """
+        if codec == "auto":
+            codec = "msgpack" if msgpack else "json"
+        if compression == "auto":
+            compression = "zstd" if zstandard else "lz4" if lz4 else "zlib"
+        if codec == "msgpack" and not msgpack:
+            raise ValueError ("The msgpack codec requires the msgpack package.")
+        if compression == "zstd" and not zstandard or compression == "lz4" and not lz4:
+            raise ValueError (f"The {compression} compression requires its package.")
+        self.codec = JSONCacheSerializer.MSGPACK if codec == "msgpack" else JSONCacheSerializer.JSON
+        self.compression = {
+            "none" : JSONCacheSerializer.NONE,
+            "zlib" : JSONCacheSerializer.ZLIB,
+            "zstd" : JSONCacheSerializer.ZSTD,
+            "lz4"  : JSONCacheSerializer.LZ4
+        }[compression]
+        self.threshold = threshold
+        self.level = level
+        self.intern = intern
+
+    @staticmethod
+    def from_config (config):
+        """ Create a serializer from the cache.serializer configuration section. """
+        cache_config = config.get ('cache', {}).get ('serializer', {})
+        return JSONCacheSerializer (
+            codec = cache_config.get ('codec', 'auto'),
+            compression = cache_config.get ('compression', 'auto'),
+            threshold = int(cache_config.get ('threshold', 4096)),
+            level = int(cache_config.get ('level', 3)),
+            intern = str(cache_config.get ('intern', False)).lower () not in [ 'false', '0', 'no' ])
+
+    def encode (self, obj):
+        if self.codec == JSONCacheSerializer.MSGPACK:
+            return msgpack.packb (obj, use_bin_type=True)
+        if orjson:
+            return orjson.dumps (obj)
+        if ujson:
+            return ujson.dumps (obj, ensure_ascii=False).encode ("utf-8")
+        return json.dumps (obj, separators=(',', ':'), ensure_ascii=False).encode ("utf-8")
+
+    def decode (self, codec, data):
+        if codec == JSONCacheSerializer.MSGPACK:
+            return msgpack.unpackb (data, raw=False)
+        if orjson:
+            return orjson.loads (data)
+        if ujson:
+            return ujson.loads (data)
+        return json.loads (data)
+
+    def compress (self, data):
+        if self.compression == JSONCacheSerializer.ZSTD:
+            return zstandard.ZstdCompressor (level=self.level).compress (data)
+        if self.compression == JSONCacheSerializer.LZ4:
+            return lz4.frame.compress (data)
+        return zlib.compress (data, self.level)
+
+    def decompress (self, compression, data):
+        if compression == JSONCacheSerializer.ZSTD:
+            return zstandard.ZstdDecompressor ().decompress (data)
+        if compression == JSONCacheSerializer.LZ4:
+            return lz4.frame.decompress (data)
+        if compression == JSONCacheSerializer.ZLIB:
+            return zlib.decompress (data)
+        return data
+
+    def dumps (self, obj):
+        data = self.encode (obj)
+        compression = JSONCacheSerializer.NONE
+        if self.compression != JSONCacheSerializer.NONE and len(data) >= self.threshold:
+            compression = self.compression
+            data = self.compress (data)
+        return self.codec + compression + data
+
+    def loads (self, data):
+        if data[:1] == b"\x80":
+            """ Written by the pickle serializer. """
+            return pickle.loads (data)
+        data = memoryview (data)
+        codec, compression = bytes(data[:1]), bytes(data[1:2])
+        value = self.decode (codec, self.decompress (compression, data[2:]))
+        return Interner.get_instance ().intern_json (value) if self.intern else value
+
+class MemoryTier:
+    """
+    In process cache of serialized values bounded by total bytes.
+    The least recently used values are evicted until new ones fit. Values too large to be worth holding
+    in memory aren't admitted. One tier is shared by every cache in the process so the bound holds per worker.
+    """
+
+    _instance = None
+    _lock = threading.Lock ()
+
+    def __init__(self, max_bytes=256 * 2**20, max_item_bytes=None):
+        """
+        :max_bytes: Upper bound on the total size of held values.
+        :max_item_bytes: Largest value admitted. Defaults to a quarter of max_bytes.
+        """
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes if max_item_bytes else max_bytes // 4
+        self.lock = threading.Lock ()
+        self.items = OrderedDict ()
+        self.bytes = 0
+        self.stats = { "hits" : 0, "misses" : 0, "writes" : 0, "evictions" : 0, "rejected" : 0 }
+
+    @staticmethod
+    def get_instance (max_bytes=256 * 2**20, max_item_bytes=None):
+        """ Get the process wide memory tier, sizing it on first use. """
+        if MemoryTier._instance is None:
+            with MemoryTier._lock:
+                if MemoryTier._instance is None:
+                    MemoryTier._instance = MemoryTier (max_bytes, max_item_bytes)
+        return MemoryTier._instance
+
+    def get (self, key, ttl=None):
+        with self.lock:
+            item = self.items.get (key, None)
+            if item is not None and item[1] is not None and item[1] < time.time ():
+                self._remove (key)
+                item = None
+            if item is None:
+                self.stats["misses"] = self.stats["misses"] + 1
+                return None
+            self.items.move_to_end (key)
+            self.stats["hits"] = self.stats["hits"] + 1
+            return item[0]
+
+    def put (self, key, data, expires=None):
+        """ Hold a value. Returns the (key, data, expires) items evicted to make room. """
+        evicted = []
+        with self.lock:
+            self._remove (key)
+            if len(data) > self.max_item_bytes:
+                self.stats["rejected"] = self.stats["rejected"] + 1
+                return evicted
+            self.items[key] = (data, expires)
+            self.bytes = self.bytes + len(data)
+            self.stats["writes"] = self.stats["writes"] + 1
+            while self.bytes > self.max_bytes:
+                old_key, (old_data, old_expires) = self.items.popitem (last=False)
+                self.bytes = self.bytes - len(old_data)
+                self.stats["evictions"] = self.stats["evictions"] + 1
+                evicted.append ((old_key, old_data, old_expires))
+        return evicted
+
+    def _remove (self, key):
+        item = self.items.pop (key, None)
+        if item is not None:
+            self.bytes = self.bytes - len(item[0])
+
+    def delete (self, key):
+        with self.lock:
+            self._remove (key)
+
+    def delete_prefix (self, prefix, keep=()):
+        """ Drop keys starting with prefix, except those starting with any of keep. Returns the number dropped. """
+        with self.lock:
+            keys = [ k for k in self.items.keys () if k.startswith (prefix) and not k.startswith (tuple(keep)) ]
+            for key in keys:
+                self._remove (key)
+        return len(keys)
+
+    def reap (self, prefix=""):
+        """ Drop expired values under prefix. Returns the number of keys and bytes reclaimed. """
+        reclaimed = { "keys" : 0, "bytes" : 0 }
+        now = time.time ()
+        with self.lock:
+            expired = [
+                k for k, (data, expires) in self.items.items ()
+                if expires is not None and expires < now and k.startswith (prefix)
+            ]
+            for key in expired:
+                reclaimed["bytes"] = reclaimed["bytes"] + len(self.items[key][0])
+                self._remove (key)
+        reclaimed["keys"] = len(expired)
+        return reclaimed
+
+    def report (self):
+        with self.lock:
+            return { **self.stats, "entries" : len(self.items), "bytes" : self.bytes, "max_bytes" : self.max_bytes }
+
+class RedisTier:
+    """ Serialized values in Redis, which expires them itself. """
+    def __init__(self, client):
+        self.redis = client
+        self.lazy_free = True
+        self.stats = { "hits" : 0, "misses" : 0, "writes" : 0 }
+
+    def get (self, key, ttl=None):
+        data = self.redis.get (key)
+        self.stats["hits" if data is not None else "misses"] += 1
+        return data
+
+    def put (self, key, data, ttl=None):
+        self.redis.set (key, data, ex=int(ttl) if ttl else None)
+        self.stats["writes"] += 1
+
+    def get_many (self, keys, ttl=None):
+        """ Fetch several values in one round trip. """
+        values = self.redis.mget (keys) if len(keys) > 0 else []
+        for data in values:
+            self.stats["hits" if data is not None else "misses"] += 1
+        return dict(zip (keys, values))
+
+    def put_many (self, items, ttl=None):
+        """ Write several values in one pipelined round trip. """
+        pipeline = self.redis.pipeline (transaction=False)
+        for key, data in items.items ():
+            pipeline.set (key, data, ex=int(ttl) if ttl else None)
+        pipeline.execute ()
+        self.stats["writes"] += len(items)
+
+    def counter (self, key):
+        return int(self.redis.get (key) or 0)
+
+    def incr (self, key):
+        return int(self.redis.incr (key))
+
+    def unlink (self, keys):
+        """
+        Delete keys, returning the number deleted. UNLINK frees their memory off the server's main thread.
+        Servers before Redis 4 don't have it, so they fall back to DEL. The client is driven with
+        execute_command because the pinned redis-py has no unlink method.
+        """
+        if self.lazy_free:
+            try:
+                return self.redis.execute_command ("UNLINK", *keys)
+            except redis.exceptions.ResponseError as e:
+                logger.info (f"UNLINK unavailable, deleting with DEL: {e}")
+                self.lazy_free = False
+        return self.redis.delete (*keys)
+
+    def delete_prefix (self, prefix, keep=(), batch=500):
+        """
+        Delete keys starting with prefix, except those starting with any of keep. Returns the number deleted.
+        SCAN walks the keyspace a batch at a time and keys are unlinked a batch at a time,
+        so other clients are never blocked for long.
+        """
+        deleted = 0
+        keys = []
+        for key in self.redis.scan_iter (match=glob_escape (prefix) + "*", count=batch):
+            if not key.decode ("utf-8").startswith (tuple(keep)):
+                keys.append (key)
+            if len(keys) >= batch:
+                deleted = deleted + self.unlink (keys)
+                keys = []
+        if len(keys) > 0:
+            deleted = deleted + self.unlink (keys)
+        return deleted
+
+    def reap (self, prefix, ttl_for, batch=500):
+        """
+        Reclaim results under prefix written without a ttl. ttl_for gives the seconds to keep a key, less prefix.
+        Keys idle longer than that are deleted. The rest are given the time they have left.
+        Returns the number of keys and bytes reclaimed, and the number given a ttl.
+        """
+        reclaimed = { "keys" : 0, "bytes" : 0, "expiring" : 0 }
+        keys = []
+        for key in self.redis.scan_iter (match=glob_escape (prefix) + "*.res", count=batch):
+            keys.append (key)
+            if len(keys) >= batch:
+                self._reap_batch (keys, prefix, ttl_for, reclaimed)
+                keys = []
+        if len(keys) > 0:
+            self._reap_batch (keys, prefix, ttl_for, reclaimed)
+        return reclaimed
+
+    def _reap_batch (self, keys, prefix, ttl_for, reclaimed):
+        pipeline = self.redis.pipeline (transaction=False)
+        for key in keys:
+            pipeline.ttl (key)
+            pipeline.object ("idletime", key)
+            pipeline.strlen (key)
+        replies = pipeline.execute ()
+        expired = []
+        for index, key in enumerate (keys):
+            remaining, idle, size = replies[index * 3 : index * 3 + 3]
+            ttl = ttl_for (key.decode ("utf-8")[len(prefix):])
+            if remaining != -1 or ttl is None:
+                continue
+            if idle is not None and idle >= ttl:
+                expired.append (key)
+                reclaimed["bytes"] = reclaimed["bytes"] + size
+            else:
+                pipeline.expire (key, ttl - (idle or 0))
+                reclaimed["expiring"] = reclaimed["expiring"] + 1
+        pipeline.execute ()
+        if len(expired) > 0:
+            self.unlink (expired)
+        reclaimed["keys"] = reclaimed["keys"] + len(expired)
+
+    def report (self):
+        return dict(self.stats)
+
+class DiskTier:
+    """ Serialized values in local files. A ttl passed to get bounds the age of a file. """
+    def __init__(self, path):
+        self.path = path
+        if not os.path.exists (self.path):
+            os.makedirs (self.path)
+        self.stats = { "hits" : 0, "misses" : 0, "writes" : 0, "expired" : 0 }
+
+    def get (self, key, ttl=None):
+        path = os.path.join (self.path, key)
+        data = None
+        if os.path.exists (path):
+            if ttl and os.path.getmtime (path) + ttl < time.time ():
+                self.stats["expired"] += 1
+            else:
+                with open(path, 'rb') as stream:
+                    data = stream.read ()
+        self.stats["hits" if data is not None else "misses"] += 1
+        return data
+
+    def put (self, key, data, ttl=None):
+        self._write (key, data)
+        self.stats["writes"] += 1
+
+    def _write (self, key, data):
+        """ Write a file atomically, so concurrent readers see the old contents or the new, never part of them. """
+        descriptor, temp_path = tempfile.mkstemp (dir=self.path, prefix=".tmp-")
+        try:
+            with os.fdopen (descriptor, 'wb') as stream:
+                stream.write (data)
+            os.replace (temp_path, os.path.join (self.path, key))
+        except:
+            os.remove (temp_path)
+            raise
+
+    def remaining (self, key, ttl):
+        """ Seconds before the file under key is older than ttl. """
+        return ttl - (time.time () - os.path.getmtime (os.path.join (self.path, key)))
+
+    def get_many (self, keys, ttl=None):
+        return { key : self.get (key, ttl) for key in keys }
+
+    def put_many (self, items, ttl=None):
+        for key, data in items.items ():
+            self.put (key, data, ttl)
+
+    def counter (self, key):
+        path = os.path.join (self.path, key)
+        if not os.path.exists (path):
+            return 0
+        with open(path, 'r') as stream:
+            return int(stream.read ())
+
+    def incr (self, key):
+        value = self.counter (key) + 1
+        self._write (key, str(value).encode ("utf-8"))
+        return value
+
+    def delete_prefix (self, prefix, keep=(), batch=500):
+        """ Delete files named with prefix, except those starting with any of keep. Returns the number deleted. """
+        deleted = 0
+        with os.scandir (self.path) as entries:
+            for entry in entries:
+                if entry.name.startswith (prefix) and not entry.name.startswith (tuple(keep)):
+                    os.remove (entry.path)
+                    deleted = deleted + 1
+        return deleted
+
+    def reap (self, prefix, ttl_for):
+        """ Delete result files under prefix older than ttl_for gives for their key. Returns the number of keys and bytes reclaimed. """
+        reclaimed = { "keys" : 0, "bytes" : 0 }
+        now = time.time ()
+        with os.scandir (self.path) as entries:
+            for entry in entries:
+                if not (entry.name.startswith (prefix) and entry.name.endswith (".res")):
+                    continue
+                ttl = ttl_for (entry.name[len(prefix):])
+                stat = entry.stat ()
+                if ttl is not None and stat.st_mtime + ttl < now:
+                    os.remove (entry.path)
+                    reclaimed["keys"] = reclaimed["keys"] + 1
+                    reclaimed["bytes"] = reclaimed["bytes"] + stat.st_size
+        return reclaimed
+
+    def report (self):
+        return dict(self.stats)
 
 class Cache:
-    """ Cache objects by configurable means. """
+    """
+    Cache objects in tiers: a byte bounded memory tier, then Redis, then local disk.
+
+    Reads check each tier in turn. With promote, a value found in a lower tier is copied into the tiers above it.
+    Writes go to memory and Redis. Disk is written always, never, or as a fallback when Redis is unavailable.
+    With demote, values evicted from memory are written to disk.
+
+    With a namespace, keys live under a generation number shared through the first lower tier.
+    Flushing increments the generation, which invalidates every key at once. Keys from earlier
+    generations are left to expire and can be deleted incrementally with reclaim.
+    """
     def __init__(self, cache_path="cache",
-                 serializer=PickleCacheSerializer,
+                 serializer=JSONCacheSerializer,
                  redis_host="localhost", redis_port=6379, redis_db=0,
-                 enabled=True, prefix=''):
+                 enabled=True, prefix='', pools=None,
+                 memory=None, disk_write="fallback", promote=True, demote=False,
+                 namespace=None, generation_refresh=1.0, promote_ttl=86400):
         
-        """ Connect to cache. """
+        """
+        Connect to cache. If connection pools are supplied, share their Redis connections.
+        The serializer may be a class or an instance. Every tier, including memory, holds serialized values,
+        so callers never share mutable results.
+        :memory: The memory tier. Defaults to the process wide tier.
+        :disk_write: always, never, or fallback to write disk only without Redis.
+        :promote: Copy values read from a lower tier into the tiers above it.
+        :promote_ttl: Seconds promoted copies are kept when a read gives no ttl. The value stays in the
+            tier it came from, so it's promoted again if read after its copies expire. None keeps them indefinitely.
+        :demote: Write values evicted from memory to disk.
+        :namespace: Version keys under a generation so flush is constant time.
+        :generation_refresh: Seconds between checks for a generation incremented by another process.
+        """
         self.enabled = enabled
         self.prefix = prefix
-        try:
-            self.redis = redis.StrictRedis(host=redis_host, port=redis_port, db=redis_db)
-            self.redis.get ('x')
-            logger.info(f"Cache connected to redis at {redis_host}:{redis_port}/{redis_db}")
-        except:
-            self.redis = None
-            #logger.debug (traceback.format_exc ())
-            logger.error(f"Failed to connect to redis at {redis_host}:{redis_port}/{redis_db}.")
-            print (f"Failed to connect to redis at {redis_host}:{redis_port}/{redis_db}.")
+        self.namespace = namespace
+        self.generation = None
+        self.generation_read = 0
+        self.generation_refresh = generation_refresh
+        if pools:
+            self.redis = pools.redis (host=redis_host, port=redis_port, db=redis_db)
+        else:
+            try:
+                self.redis = redis.StrictRedis(host=redis_host, port=redis_port, db=redis_db)
+                self.redis.get ('x')
+                logger.info(f"Cache connected to redis at {redis_host}:{redis_port}/{redis_db}")
+            except:
+                self.redis = None
+                #logger.debug (traceback.format_exc ())
+                logger.error(f"Failed to connect to redis at {redis_host}:{redis_port}/{redis_db}.")
+                print (f"Failed to connect to redis at {redis_host}:{redis_port}/{redis_db}.")
         self.cache_path = cache_path
-        if not os.path.exists (self.cache_path):
-            os.makedirs (self.cache_path)
-        self.cache = LRU (1000) 
-        self.serializer = serializer ()
-        
-    def get(self, key):
-        """ Get a cached item by key. """
+        self.memory = memory if memory else MemoryTier.get_instance ()
+        self.redis_tier = RedisTier (self.redis) if self.redis else None
+        self.disk = DiskTier (cache_path) if disk_write != "never" or demote else None
+        self.disk_write = disk_write == "always" or (disk_write == "fallback" and self.redis is None)
+        self.promote = promote
+        self.promote_ttl = promote_ttl
+        self.demote = demote and self.disk is not None
+        self.serializer = serializer () if isinstance (serializer, type) else serializer
+
+    @staticmethod
+    def from_config (config, serializer=None, pools=None):
+        """ Create a cache with tiers configured in the cache section. """
+        cache_config = config.get ('cache', {})
+        memory_config = cache_config.get ('memory', {})
+        disk_config = cache_config.get ('disk', {})
+        flag = lambda value: str(value).lower () not in [ 'false', '0', 'no' ]
+        max_item_bytes = memory_config.get ('max_item_bytes', None)
+        return Cache (
+            cache_path = os.path.expanduser (disk_config.get ('path', 'cache')),
+            serializer = serializer if serializer else JSONCacheSerializer.from_config (config),
+            redis_host = config['REDIS_HOST'],
+            redis_port = config['REDIS_PORT'],
+            pools = pools,
+            memory = MemoryTier.get_instance (
+                max_bytes = int(memory_config.get ('max_bytes', 256 * 2**20)),
+                max_item_bytes = int(max_item_bytes) if max_item_bytes else None),
+            disk_write = disk_config.get ('write', 'fallback'),
+            promote = flag (cache_config.get ('promote', True)),
+            demote = flag (cache_config.get ('demote', False)),
+            namespace = cache_config.get ('namespace', None),
+            generation_refresh = float(cache_config.get ('generation_refresh', 1.0)),
+            promote_ttl = int(cache_config.get ('promote_ttl', 86400)) or None)
+
+    def _tiers (self):
+        """ The tiers below memory, fastest first. """
+        return [ t for t in [ self.redis_tier, self.disk ] if t is not None ]
+
+    def generation_key (self):
+        return f"{self.prefix}{self.namespace}:generation"
+
+    def key_prefix (self):
+        """ The prefix of every key in the current generation. """
+        if not self.namespace:
+            return self.prefix
+        now = time.time ()
+        if self.generation is None or now - self.generation_read > self.generation_refresh:
+            tiers = self._tiers ()
+            if len(tiers) > 0:
+                self.generation = tiers[0].counter (self.generation_key ())
+            elif self.generation is None:
+                self.generation = 0
+            self.generation_read = now
+        return f"{self.prefix}{self.namespace}:{self.generation}:"
+
+    def _promotion_ttl (self, tier, key, ttl):
+        """ Seconds a value promoted from tier lives in the tiers above: what's left of ttl, or promote_ttl. """
+        if ttl and tier is self.disk:
+            return max (1, tier.remaining (key, ttl))
+        return ttl if ttl else self.promote_ttl
+
+    def _remember (self, key, data, expires):
+        """ Hold a value in memory, demoting whatever it evicts. """
+        for old_key, old_data, old_expires in self.memory.put (key, data, expires):
+            if self.demote:
+                self.disk.put (old_key, old_data)
+
+    def get(self, key, ttl=None):
+        """
+        Get a cached item by key.
+        Redis expires items itself. For the memory and disk tiers, ttl bounds the age of an item in seconds.
+        """
         #if any(map(lambda v : v in key.lower(), [ "go:", "mondo:", "hp:" ])):
         #    return None
-        key = self.prefix + key
-        result = None
+        key = self.key_prefix () + key
+        data = None
         if self.enabled:
-            if key in self.cache:
-                result = self.cache[key]
-            elif self.redis:
-                rec = self.redis.get (key)
-                result = self.serializer.loads (rec) if rec is not None else None
-                self.cache[key] = result
-            else:
-                path = os.path.join (self.cache_path, key)
-                if os.path.exists (path):
-                    with open(path, 'rb') as stream:
-                        result = self.serializer.loads (stream.read ())
-                        self.cache[key] = result
-        return result
+            data = self.memory.get (key)
+            if data is None:
+                tiers = self._tiers ()
+                for index, tier in enumerate (tiers):
+                    data = tier.get (key, ttl)
+                    if data is not None:
+                        if self.promote:
+                            promote_ttl = self._promotion_ttl (tier, key, ttl)
+                            for upper in tiers[:index]:
+                                upper.put (key, data, promote_ttl)
+                            self._remember (key, data, time.time () + promote_ttl if promote_ttl else None)
+                        break
+        return self.serializer.loads (data) if data is not None else None
     
-    def set(self, key, value):
-        """ Add an item to the cache. """
-        key = self.prefix + key
-        if self.enabled:
-            if self.redis:
-                if value is not None:
-                    self.redis.set (key, self.serializer.dumps (value))
-                    self.cache[key] = value
+    def set(self, key, value, ttl=None):
+        """ Add an item to the cache. If ttl is given, the item expires after that many seconds. """
+        key = self.key_prefix () + key
+        if self.enabled and value is not None:
+            data = self.serializer.dumps (value)
+            self._remember (key, data, time.time () + ttl if ttl else None)
+            if self.redis_tier:
+                self.redis_tier.put (key, data, ttl)
+            if self.disk_write:
+                self.disk.put (key, data)
+
+    def get_many(self, keys, ttl=None):
+        """
+        Get several cached items, returning a dict of the keys found.
+        Each tier below memory is asked once for everything still missing, so Redis costs one MGET.
+        Found values are promoted in bulk.
+        """
+        result = {}
+        if not self.enabled:
+            return result
+        prefix = self.key_prefix ()
+        missing = []
+        for key in keys:
+            data = self.memory.get (prefix + key)
+            if data is None:
+                missing.append (prefix + key)
             else:
-                path = os.path.join (self.cache_path, key)
-                with open(path, 'wb') as stream:
-                    stream.write (self.serializer.dumps (value))
-                self.cache[key] = value
+                result[key] = data
+        tiers = self._tiers ()
+        for index, tier in enumerate (tiers):
+            if len(missing) == 0:
+                break
+            found = { k : v for k, v in tier.get_many (missing, ttl).items () if v is not None }
+            if self.promote and len(found) > 0:
+                """ Copies promoted together share the shortest remaining lifetime among them. """
+                promote_ttl = min ([ self._promotion_ttl (tier, k, ttl) or 0 for k in found ]) or None
+                for upper in tiers[:index]:
+                    upper.put_many (found, promote_ttl)
+                for k, data in found.items ():
+                    self._remember (k, data, time.time () + promote_ttl if promote_ttl else None)
+            for k, data in found.items ():
+                result[k[len(prefix):]] = data
+            missing = [ k for k in missing if not k in found ]
+        return { key : self.serializer.loads (data) for key, data in result.items () }
+
+    def set_many(self, values, ttl=None):
+        """ Add several items, writing Redis in one pipelined round trip. """
+        if not self.enabled:
+            return
+        prefix = self.key_prefix ()
+        items = {
+            prefix + key : self.serializer.dumps (value)
+            for key, value in values.items () if value is not None
+        }
+        expires = time.time () + ttl if ttl else None
+        for key, data in items.items ():
+            self._remember (key, data, expires)
+        if self.redis_tier and len(items) > 0:
+            self.redis_tier.put_many (items, ttl)
+        if self.disk_write:
+            self.disk.put_many (items, ttl)
+
+    def stats(self):
+        """ Hit, miss, write, and eviction counts by tier. """
+        return {
+            "memory" : self.memory.report (),
+            "redis"  : self.redis_tier.report () if self.redis_tier else None,
+            "disk"   : self.disk.report () if self.disk else None
+        }
 
     def flush(self):
-        if self.prefix:
-            keys = self.redis.keys(f'{self.prefix}*')
-            if keys:
-                self.redis.delete(*keys)
+        """
+        Invalidate every cached item.
+        With a namespace this increments the generation, a single write however many keys are cached.
+        Otherwise keys under the prefix are deleted incrementally. Without a prefix there is nothing
+        to tell our keys from others in the database, so this refuses rather than clearing it.
+        """
+        if self.namespace:
+            old_prefix = self.key_prefix ()
+            tiers = self._tiers ()
+            if len(tiers) > 0:
+                self.generation = tiers[0].incr (self.generation_key ())
+            else:
+                self.generation = self.generation + 1
+            self.generation_read = time.time ()
+            self.memory.delete_prefix (old_prefix)
+            logger.info (f"cache namespace {self.namespace} is at generation {self.generation}")
         else:
-            self.redis.flushdb()
+            self.purge (self.prefix)
+
+    def purge(self, prefix, keep=(), batch=500):
+        """ Delete keys starting with prefix from every tier, batch keys at a time. Returns the number deleted below memory. """
+        if not prefix:
+            raise ValueError ("Refusing to delete every key in a cache without a prefix.")
+        self.memory.delete_prefix (prefix, keep)
+        return sum ([ tier.delete_prefix (prefix, keep, batch) for tier in self._tiers () ])
+
+    def reclaim(self, batch=500):
+        """ Delete keys left by earlier generations of the namespace. Returns the number deleted. """
+        if not self.namespace:
+            return 0
+        return self.purge (f"{self.prefix}{self.namespace}:",
+                           keep=(self.key_prefix (), self.generation_key ()), batch=batch)
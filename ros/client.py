@@ -9,6 +9,7 @@ from jsonpath_rw import jsonpath, parse
 from ros.router import Router
 from ros.workflow import Workflow
 from ros.csvargs import CSVArgs
+from ros.graph import GraphBuilder
 
 logger = logging.getLogger("client")
 logger.setLevel(logging.WARNING)
@@ -32,8 +33,8 @@ class Client:
         """ Url is the location of the Ros server, eg: http://localhost:5002 """
         self.url = url
     
-    def run (self, workflow, args={}, library_path=["."]):
-        """ Execute the workflow remotely via a web API. """
+    def run (self, workflow, args={}, library_path=["."], pin=False):
+        """ Execute the workflow remotely via a web API. Pinned results are kept indefinitely. """
         logger.debug (f"execute remote: {workflow} libpath: {library_path} args: {args} at {self.url}")
 
         """ Construct a workflow object, parse the workflow, and resolve imports - all locally. """
@@ -50,7 +51,8 @@ class Client:
                 url = f"{self.url}/api/executeWorkflow",
                 json = {
                     "workflow" : workflow.spec,
-                    "args"     : args
+                    "args"     : args,
+                    "pin"      : pin
                 }).json ())
 
 def main ():
@@ -87,7 +89,7 @@ def main2 ():
     libpath = [ 'workflows' ]
 
     """ Build graph. """
-    g = nx.MultiDiGraph ()
+    builder = GraphBuilder ()
     for args in args_list.vals: 
         ros = Client (url="http://localhost:5002")
         response = ros.run (workflow=workflow,
@@ -97,7 +99,8 @@ def main2 ():
         print (json.dumps (response.result, indent=2))
         response_nx = response.to_nx ()
         print (f"read {len(response_nx.nodes())} nodes and {len(response_nx.edges())} edges.")
-        g = nx.compose (g, response.to_nx ())
+        builder.add_graph (response_nx)
+    g = builder.graph
 
     """ Calulate node embeddings. """
     n2v = Node2Vec (g, dimensions=128, walk_length=80,
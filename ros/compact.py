@@ -0,0 +1,253 @@
+import logging
+import networkx as nx
+import numpy as np
+from array import array
+from ros.graph import GraphBuilder
+from ros.graph import TranslatorGraphTools
+from ros.util import kgs_elements
+
+logger = logging.getLogger("compact")
+logger.setLevel(logging.WARNING)
+
+class SymbolTable:
+    """ Intern values, assigning each distinct value a dense integer id in order of first appearance. """
+    def __init__(self):
+        self.values = []
+        self.ids = {}
+
+    def intern (self, value):
+        """ The id of value, adding it if it's new. """
+        index = self.ids.get (value, None)
+        if index is None:
+            index = len(self.values)
+            self.ids[value] = index
+            self.values.append (value)
+        return index
+
+    def lookup (self, value):
+        """ The id of value, or -1 if it's not in the table. """
+        return self.ids.get (value, -1)
+
+    def __getitem__ (self, index):
+        return self.values[index]
+
+    def __len__ (self):
+        return len(self.values)
+
+class CompactGraph:
+    """
+    A knowledge graph held in columns rather than a dict per node and edge.
+
+    Node identifiers and types are interned in tables, and a node's index is the index of its identifier.
+    Node types are an int32 column indexed by node. Edges are int32 subject, predicate, and object columns
+    of node and type indices. Every other attribute lives in a sparse side table keyed by node or edge index.
+    Repeated string values are shared. A type that isn't a string is kept in the side tables, so conversion
+    back to KGS JSON or NetworkX is lossless. Nodes with the same id are merged as dedup_nodes merges them.
+
+    Columns are numpy arrays, so edges can be filtered with vectorized operations.
+    Graphs returned by filter share the tables of the graph they came from.
+    """
+    def __init__(self, curies=None, types=None):
+        self.curies = curies if curies is not None else SymbolTable ()
+        self.types = types if types is not None else SymbolTable ()
+        self.strings = {}
+        self.node_attributes = {}
+        self.edge_attributes = {}
+        self._node_type = np.zeros (0, dtype=np.int32)
+        self._is_node = np.zeros (0, dtype=bool)
+        self._columns = [ np.zeros (0, dtype=np.int32) for i in range (3) ]
+        self._pending_nodes = {}
+        self._pending = [ array ('i'), array ('i'), array ('i') ]
+
+    @staticmethod
+    def from_kgs (graph):
+        """ Build from a KGS answer graph. """
+        compact = CompactGraph ()
+        compact.add_nodes (kgs_elements (graph, "node_list"))
+        compact.add_edges (kgs_elements (graph, "edge_list"))
+        return compact
+
+    @staticmethod
+    def from_nx (graph):
+        """ Build from a NetworkX graph whose nodes and edges carry KGS dicts in attr_dict. """
+        compact = CompactGraph ()
+        compact.add_nodes ([ data['attr_dict'] for n, data in graph.nodes (data=True) if 'attr_dict' in data ])
+        compact.add_edges ([ data['attr_dict'] for u, v, data in graph.edges (data=True) if 'attr_dict' in data ])
+        return compact
+
+    def _value (self, value):
+        """ Share one copy of each distinct string value. """
+        return self.strings.setdefault (value, value) if isinstance(value, str) else value
+
+    def _set_attributes (self, tables, index, element, skip):
+        for name, value in element.items ():
+            if name in skip:
+                continue
+            table = tables.get (name, None)
+            if table is None:
+                table = tables[name] = {}
+            table[index] = self._value (value)
+
+    def add_nodes (self, nodes):
+        for node in nodes:
+            index = self.curies.intern (node['id'])
+            if 'type' in node and isinstance(node['type'], str):
+                self._pending_nodes[index] = self.types.intern (node['type'])
+                self.node_attributes.get ('type', {}).pop (index, None)
+                self._set_attributes (self.node_attributes, index, node, ('id', 'type'))
+            else:
+                self._pending_nodes.setdefault (index, -1)
+                self._set_attributes (self.node_attributes, index, node, ('id',))
+        return self
+
+    def add_edges (self, edges):
+        subjects, predicates, objects = self._pending
+        for edge in edges:
+            index = len(self._columns[0]) + len(subjects)
+            subjects.append (self.curies.intern (edge['source_id']))
+            objects.append (self.curies.intern (edge['target_id']))
+            if 'type' in edge and isinstance(edge['type'], str):
+                predicates.append (self.types.intern (edge['type']))
+                self._set_attributes (self.edge_attributes, index, edge, ('source_id', 'target_id', 'type'))
+            else:
+                predicates.append (-1)
+                self._set_attributes (self.edge_attributes, index, edge, ('source_id', 'target_id'))
+        return self
+
+    def _flush (self):
+        """ Move pending additions into the numpy columns. """
+        size = len(self.curies)
+        if len(self._node_type) < size or len(self._pending_nodes) > 0:
+            node_type = np.full (size, -1, dtype=np.int32)
+            node_type[:len(self._node_type)] = self._node_type
+            is_node = np.zeros (size, dtype=bool)
+            is_node[:len(self._is_node)] = self._is_node
+            if len(self._pending_nodes) > 0:
+                indices = np.fromiter (self._pending_nodes.keys (), dtype=np.int32, count=len(self._pending_nodes))
+                types = np.fromiter (self._pending_nodes.values (), dtype=np.int32, count=len(self._pending_nodes))
+                """ A node added again without a string type keeps the type it had. """
+                known = types >= 0
+                node_type[indices[known]] = types[known]
+                is_node[indices] = True
+                self._pending_nodes = {}
+            self._node_type = node_type
+            self._is_node = is_node
+        if len(self._pending[0]) > 0:
+            self._columns = [
+                np.concatenate ([ column, np.frombuffer (pending, dtype=np.int32) ])
+                for column, pending in zip (self._columns, self._pending)
+            ]
+            self._pending = [ array ('i'), array ('i'), array ('i') ]
+
+    @property
+    def node_type (self):
+        """ Type index of each node, -1 if it has no string type. Indexed like curies. """
+        self._flush ()
+        return self._node_type
+
+    @property
+    def is_node (self):
+        """ Whether each identifier was added as a node rather than only referenced by an edge. """
+        self._flush ()
+        return self._is_node
+
+    @property
+    def subjects (self):
+        self._flush ()
+        return self._columns[0]
+
+    @property
+    def predicates (self):
+        self._flush ()
+        return self._columns[1]
+
+    @property
+    def objects (self):
+        self._flush ()
+        return self._columns[2]
+
+    def number_of_nodes (self):
+        return int(np.count_nonzero (self.is_node))
+
+    def number_of_edges (self):
+        return len(self.subjects)
+
+    def nodes (self):
+        """ Yield each node as a KGS dict. """
+        node_type = self.node_type
+        for index in np.flatnonzero (self.is_node).tolist ():
+            node = { "id" : self.curies[index] }
+            if node_type[index] >= 0:
+                node["type"] = self.types[node_type[index]]
+            for name, table in self.node_attributes.items ():
+                if index in table:
+                    node[name] = table[index]
+            yield node
+
+    def edges (self):
+        """ Yield each edge as a KGS dict. """
+        subjects, predicates, objects = self.subjects.tolist (), self.predicates.tolist (), self.objects.tolist ()
+        for index in range (len(subjects)):
+            edge = { "source_id" : self.curies[subjects[index]], "target_id" : self.curies[objects[index]] }
+            if predicates[index] >= 0:
+                edge["type"] = self.types[predicates[index]]
+            for name, table in self.edge_attributes.items ():
+                if index in table:
+                    edge[name] = table[index]
+            yield edge
+
+    def to_kgs (self, tools=None):
+        """ The graph in KGS standard. """
+        tools = tools if tools else TranslatorGraphTools ()
+        return tools.kgs (nodes = list(self.nodes ()), edges = list(self.edges ()))
+
+    def to_nx (self):
+        """ The graph as a NetworkX MultiDiGraph, as TranslatorGraphTools.to_nx would build it. """
+        return GraphBuilder ().add_nodes (self.nodes ()).add_edges (self.edges ()).graph
+
+    def type_ids (self, names):
+        """ Ids of the named types. Unknown names are dropped so they can't match -1, which means no type. """
+        ids = [ self.types.lookup (n) for n in names ]
+        return np.array ([ i for i in ids if i >= 0 ], dtype=np.int32)
+
+    def edge_mask (self, predicates=None, subject_types=None, object_types=None):
+        """ A boolean mask of edges with one of the predicates whose endpoints have the given node types. """
+        mask = np.ones (self.number_of_edges (), dtype=bool)
+        if predicates is not None:
+            mask &= np.isin (self.predicates, self.type_ids (predicates))
+        if subject_types is not None:
+            mask &= np.isin (self.node_type[self.subjects], self.type_ids (subject_types))
+        if object_types is not None:
+            mask &= np.isin (self.node_type[self.objects], self.type_ids (object_types))
+        return mask
+
+    def filter (self, edge_mask, node_mask=None):
+        """
+        A graph of the edges selected by edge_mask. Nodes are those selected by node_mask,
+        by default the endpoints of the selected edges.
+        """
+        edge_indices = np.flatnonzero (edge_mask)
+        subjects = self.subjects[edge_indices]
+        objects = self.objects[edge_indices]
+        if node_mask is None:
+            node_mask = np.zeros (len(self.curies), dtype=bool)
+            node_mask[subjects] = True
+            node_mask[objects] = True
+        node_mask = node_mask & self.is_node
+
+        result = CompactGraph (curies=self.curies, types=self.types)
+        result.strings = self.strings
+        result._node_type = self.node_type.copy ()
+        result._is_node = node_mask
+        result._columns = [ subjects, self.predicates[edge_indices], objects ]
+        kept = set(np.flatnonzero (node_mask).tolist ())
+        result.node_attributes = {
+            name : { i : v for i, v in table.items () if i in kept }
+            for name, table in self.node_attributes.items ()
+        }
+        positions = { old : new for new, old in enumerate (edge_indices.tolist ()) }
+        result.edge_attributes = {
+            name : { positions[i] : v for i, v in table.items () if i in positions }
+            for name, table in self.edge_attributes.items ()
+        }
+        return result
@@ -11,22 +11,29 @@ from numbers import Number
 logger = logging.getLogger("config")
 logger.setLevel(logging.WARNING)
 
+""" Parsed configuration files keyed by path and modification time. Configuration is read only so it's shared. """
+parsed_configs = {}
+
 class Config(dict):
     def __init__(self, config=None, prefix=''):
         if config == None:
             local_config = os.path.expanduser("~/.ros.yaml")
             default_config = os.path.join(os.path.dirname(__file__), "ros.yaml")
             config = local_config if os.path.exists (local_config) else default_config
+        self.prefix = prefix
         if isinstance(config, str):
             config_path = Resource.get_resource_path (config)
+            parsed_key = (config_path, os.path.getmtime (config_path))
+            if parsed_key in parsed_configs:
+                self.conf = parsed_configs[parsed_key]
+                return
             with open(config_path, 'r') as f:
                 self.conf = yaml.safe_load (f)
         elif isinstance(config, dict):
             self.conf = config
+            parsed_key = None
         else:
             raise ValueError
-        
-        self.prefix = prefix
 
         new_conf = copy.deepcopy (self.conf)
         self.key_dig (base_k = None,
@@ -35,6 +42,8 @@ class Config(dict):
                       root_d = new_conf)
         #print (json.dumps(new_conf, indent=2))
         self.conf.update (new_conf)
+        if parsed_key:
+            parsed_configs[parsed_key] = self.conf
         
     def key_dig (self, base_k, k, d, root_d):
         if base_k:
@@ -0,0 +1,128 @@
+import logging
+import threading
+import time
+import redis
+from neo4j.v1 import GraphDatabase
+
+logger = logging.getLogger("connections")
+logger.setLevel(logging.WARNING)
+
+class ConnectionPools:
+    """
+    Process wide connection pools shared by all workflows and routers.
+
+    Pools are created lazily on first use and creation is guarded by a lock so concurrent
+    requests in an API worker share one Redis connection pool and one Neo4J driver per endpoint.
+    """
+
+    _instance = None
+    _lock = threading.Lock ()
+
+    def __init__(self, redis_max_connections=64, neo4j_max_connections=50, retry_interval=30):
+        """
+        :redis_max_connections: Upper bound on connections in each Redis pool.
+        :neo4j_max_connections: Upper bound on connections in each Neo4J driver's pool.
+        :retry_interval: Seconds to wait before probing an unreachable Redis again.
+        """
+        self.redis_max_connections = redis_max_connections
+        self.neo4j_max_connections = neo4j_max_connections
+        self.retry_interval = retry_interval
+        self.lock = threading.Lock ()
+        self.redis_pools = {}
+        self.redis_failures = {}
+        self.neo4j_drivers = {}
+        self.neo4j_sessions = 0
+
+    @staticmethod
+    def get_instance (config=None):
+        """ Get the process wide pools, sizing them from configuration on first use. """
+        if ConnectionPools._instance is None:
+            with ConnectionPools._lock:
+                if ConnectionPools._instance is None:
+                    redis_config = config.get ('redis', {}) if config is not None else {}
+                    neo4j_config = config.get ('neo4j', {}) if config is not None else {}
+                    ConnectionPools._instance = ConnectionPools (
+                        redis_max_connections = int(redis_config.get ('max_connections', 64)),
+                        neo4j_max_connections = int(neo4j_config.get ('max_connections', 50)))
+        return ConnectionPools._instance
+
+    def redis (self, host="localhost", port=6379, db=0):
+        """
+        Get a Redis client backed by the shared pool for this endpoint.
+        The endpoint is probed once when its pool is created. Returns None if it's unreachable.
+        """
+        key = (host, int(port), int(db))
+        pool = self.redis_pools.get (key)
+        if pool is None:
+            with self.lock:
+                pool = self.redis_pools.get (key)
+                failed_at = self.redis_failures.get (key)
+                if pool is None and failed_at and time.time () - failed_at < self.retry_interval:
+                    return None
+                if pool is None:
+                    pool = redis.ConnectionPool (
+                        host=host, port=int(port), db=int(db),
+                        max_connections=self.redis_max_connections)
+                    try:
+                        redis.StrictRedis (connection_pool=pool).ping ()
+                        logger.info (f"Connected to redis at {host}:{port}/{db}")
+                    except:
+                        logger.error (f"Failed to connect to redis at {host}:{port}/{db}.")
+                        pool.disconnect ()
+                        self.redis_failures[key] = time.time ()
+                        return None
+                    self.redis_failures.pop (key, None)
+                    self.redis_pools[key] = pool
+        return redis.StrictRedis (connection_pool=pool)
+
+    def neo4j (self, uri, auth=None):
+        """ Get the shared Neo4J driver for this endpoint. Drivers pool their own connections. """
+        key = (uri, auth[0] if auth else None)
+        driver = self.neo4j_drivers.get (key)
+        if driver is None:
+            with self.lock:
+                driver = self.neo4j_drivers.get (key)
+                if driver is None:
+                    logger.debug (f"creating neo4j driver for {uri}")
+                    if auth:
+                        driver = GraphDatabase.driver (
+                            uri, auth=auth, max_connection_pool_size=self.neo4j_max_connections)
+                    else:
+                        driver = GraphDatabase.driver (
+                            uri, max_connection_pool_size=self.neo4j_max_connections)
+                    self.neo4j_drivers[key] = driver
+        return driver
+
+    def neo4j_session (self, uri, auth=None):
+        """ Open a session on the shared driver. The caller closes it to return its connection to the pool. """
+        session = self.neo4j (uri, auth).session ()
+        self.neo4j_sessions = self.neo4j_sessions + 1
+        return session
+
+    def stats (self):
+        """ Pool size metrics. """
+        return {
+            "redis" : {
+                f"{host}:{port}/{db}" : {
+                    "max"       : pool.max_connections,
+                    "created"   : pool._created_connections,
+                    "available" : len(pool._available_connections),
+                    "in_use"    : len(pool._in_use_connections)
+                } for (host, port, db), pool in self.redis_pools.items ()
+            },
+            "neo4j" : {
+                "drivers"  : len(self.neo4j_drivers),
+                "sessions" : self.neo4j_sessions,
+                "max"      : self.neo4j_max_connections
+            }
+        }
+
+    def close (self):
+        """ Release all pooled connections. """
+        with self.lock:
+            for pool in self.redis_pools.values ():
+                pool.disconnect ()
+            for driver in self.neo4j_drivers.values ():
+                driver.close ()
+            self.redis_pools = {}
+            self.neo4j_drivers = {}
@@ -19,6 +19,7 @@ from ros.lib.ndex import NDEx
 from ros.dag.tasks import exec_operator
 from ros.dag.tasks import calc_dag
 from ros.celery_tools import CeleryManager
+from ros.util import compile_jsonpath
 
 logger = logging.getLogger("runner")
 logger.setLevel(logging.WARNING)
@@ -161,7 +162,7 @@ def main ():
                                         library_path=args.lib_path))
         response = executor.execute ()
         if args.ndex_id:
-            jsonpath_query = parse ("$.[*].result_list.[*].[*].result_graph")
+            jsonpath_query = compile_jsonpath ("$.[*].result_list.[*].[*].result_graph")
             graph = [ match.value for match in jsonpath_query.find (response) ]
             logger.debug (f"{args.ndex_id} => {json.dumps(graph, indent=2)}")
             ndex = NDEx ()
@@ -0,0 +1,75 @@
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor
+from ros.config import Config
+
+logger = logging.getLogger("executor")
+logger.setLevel(logging.WARNING)
+
+class OperatorExecutor:
+    """
+    Run blocking operator invocations off the event loop.
+
+    I/O bound operators run on a bounded thread pool so a slow knowledge source only occupies one worker.
+    CPU bound operators may run on an optional process pool. Operators declare the pool they need
+    via their pool attribute: thread, process, or inline. Inline operators run on the event loop.
+    """
+
+    THREAD = "thread"
+    PROCESS = "process"
+    INLINE = "inline"
+
+    _instance = None
+    _lock = threading.Lock ()
+
+    def __init__(self, thread_pool_size=16, process_pool_size=0):
+        """ Create the pools. A process pool is only created if its size is positive. """
+        self.thread_pool_size = thread_pool_size
+        self.process_pool_size = process_pool_size
+        self.thread_pool = ThreadPoolExecutor (
+            max_workers=thread_pool_size,
+            thread_name_prefix="ros-operator")
+        self.process_pool = ProcessPoolExecutor (
+            max_workers=process_pool_size) if process_pool_size > 0 else None
+        logger.debug (f"operator executor: threads: {thread_pool_size} processes: {process_pool_size}")
+
+    @staticmethod
+    def get (config=None):
+        """ Get the process wide executor, creating it from the executor configuration on first use. """
+        if OperatorExecutor._instance is None:
+            with OperatorExecutor._lock:
+                if OperatorExecutor._instance is None:
+                    config = config if config is not None else Config ()
+                    executor_config = config.get ('executor', {})
+                    OperatorExecutor._instance = OperatorExecutor (
+                        thread_pool_size = int(executor_config.get ('thread_pool_size', 16)),
+                        process_pool_size = int(executor_config.get ('process_pool_size', 0)))
+        return OperatorExecutor._instance
+
+    async def run (self, pool, fn, *args, **kwargs):
+        """ Await fn in the given pool without blocking the event loop. """
+        call = functools.partial (fn, *args, **kwargs)
+        if pool == self.INLINE:
+            return call ()
+        loop = asyncio.get_event_loop ()
+        if pool == self.PROCESS and self.process_pool:
+            return await loop.run_in_executor (self.process_pool, call)
+        return await loop.run_in_executor (self.thread_pool, call)
+
+    def invoke (self, pool, fn, *args, **kwargs):
+        """
+        Call fn synchronously, dispatching it to the process pool if that's requested and available.
+        Intended for worker threads. Process pool calls require picklable functions and arguments.
+        """
+        if pool == self.PROCESS and self.process_pool:
+            return self.process_pool.submit (fn, *args, **kwargs).result ()
+        return fn (*args, **kwargs)
+
+    def shutdown (self, wait=True):
+        """ Release pool resources. """
+        self.thread_pool.shutdown (wait=wait)
+        if self.process_pool:
+            self.process_pool.shutdown (wait=wait)
@@ -37,7 +37,13 @@ class Operator:
        May have its results referenced by subsequent steps
        Has access to the framework including
           An event object containing the details of a specific invocation         
+
+    The pool attribute tells the engine where to run the operator: a thread pool for I/O bound work,
+    a process pool for CPU bound work, or inline on the event loop for trivial operations.
+    Operators run in the process pool receive events carrying resolved arguments but no workflow context.
     """
+    pool = "thread"
+    
     def __init__(self, name=""):
         self.name = name
 
@@ -1,11 +1,16 @@
+import ijson
 import json
 import logging
 import random
 import networkx as nx
+from decimal import Decimal
+from ijson.common import ObjectBuilder
 import yaml
 from flatdict import FlatDict
 from jsonpath_rw import jsonpath, parse
 from networkx.readwrite import json_graph
+from ros.util import Interner
+from ros.util import kgs_elements
 #from kgx import Transformer, NeoTransformer, PandasTransformer, NeoTransformer
 
 logger = logging.getLogger("graph")
@@ -40,41 +45,29 @@ class TranslatorGraphTools:
         return result
     
     def dedup_nodes(self, nodes):
-        """ Get rid of duplicates. """
-        seen = {}
-        return [
-            nn for nn in [
-                self.coalesce_node (n, nodes, seen) for n in nodes
-            ] if nn is not None
-        ]
+        """
+        Get rid of duplicates in one pass. Nodes keep the order of each id's first occurrence.
+        The first node with an id is updated with each later one in turn, so later attributes win.
+        """
+        merged = {}
+        for n in nodes:
+            first = merged.get (n['id'], None)
+            if first is None:
+                merged[n['id']] = n
+            elif first is not n:
+                first.update (n)
+        return list(merged.values ())
     
     def answer_set_to_nx (self, answers):
-        """ Compose a NetworkX graph from an answer set. """
-        result = nx.MultiDiGraph ()
+        """ Build one NetworkX graph from an answer set. """
+        builder = GraphBuilder ()
         for answer in answers:
-            g = self.to_nx (answer)
-            result = nx.compose(result, g)
-        return result
+            builder.add_kgs (answer)
+        return builder.graph
     
     def to_nx (self, graph):
         """ Convert answer graph to NetworkX. """
-        
-        """ Serialize node and edge python objects. """
-        g = nx.MultiDiGraph()
-        #logger.debug (f"graph: {json.dumps(graph, indent=2)}")
-        jsonpath_query = parse ("$.[*].result_list.[*].[*].result_graph.node_list.[*]") #.nodes.[*]")
-        nodes = [ match.value for match in jsonpath_query.find (graph) ]
-        nodes = self.dedup_nodes (nodes)
-    
-        jsonpath_query = parse ("$.[*].result_list.[*].[*].result_graph.edge_list.[*]")
-        edges = [ match.value for match in jsonpath_query.find (graph) ]
-        for n in nodes:
-            logger.debug (f"  --node> {n}")
-            g.add_node(n['id'], attr_dict=n)
-        for e in edges:
-            logger.debug (f"  --edge> {e}")
-            g.add_edge (e['source_id'], e['target_id'], attr_dict=e)
-        return g
+        return GraphBuilder ().add_kgs (graph).graph
     
     def to_knowledge_graph (self, in_graph, out_graph, graph_label=None):
         """ Write a NetworkX graph to KnowledgeGraph. """
@@ -192,6 +185,136 @@ class TranslatorGraphTools:
             }
         ]
 
+""" Where nodes and edges live in the gamma answers shape and the result_list shape. """
+GRAPH_RECORD_PREFIXES = {
+    "answers.item.nodes.item"                       : "node",
+    "answers.item.edges.item"                       : "edge",
+    "result_list.item.result_graph.node_list.item"  : "node",
+    "result_list.item.result_graph.edge_list.item"  : "edge"
+}
+
+def stream_graph (stream, prefixes=GRAPH_RECORD_PREFIXES):
+    """
+    Incrementally parse a knowledge source response, yielding ("node", node) and ("edge", edge) pairs.
+    Only one record is built at a time, so the whole response is never held in memory.
+    """
+    events = ijson.parse (stream)
+    for prefix, event, value in events:
+        if event != 'start_map' or not prefix in prefixes:
+            continue
+        builder = ObjectBuilder ()
+        builder.event (event, value)
+        for record_prefix, event, value in events:
+            if event == 'number' and isinstance (value, Decimal):
+                value = float (value)
+            builder.event (event, value)
+            if event == 'end_map' and record_prefix == prefix:
+                break
+        yield prefixes[prefix], builder.value
+
+class GraphBuilder:
+    """
+    Fold many KGS results into one NetworkX graph in place.
+
+    Composing graphs pairwise copies the growing graph for every addition. The builder adds to one
+    MultiDiGraph instead. Each node's attributes are held in its attr_dict. On an id collision, the first
+    attr_dict is updated with the later one. Within each addition, parallel edges are keyed 0, 1, ... per
+    node pair. An edge with the same endpoints and key as one already in the graph replaces its attributes,
+    as nx.compose would. Identifiers and types are interned as they're added.
+    """
+    def __init__(self, graph=None):
+        self.graph = graph if graph is not None else nx.MultiDiGraph ()
+        self.interner = Interner.get_instance ()
+
+    def add_nodes (self, nodes):
+        for n in nodes:
+            logger.debug (f"  --node> {n}")
+            self.interner.intern_element (n)
+            data = self.graph.nodes[n['id']] if n['id'] in self.graph else None
+            if data is None:
+                self.graph.add_node (n['id'], attr_dict=n)
+            elif not 'attr_dict' in data:
+                data['attr_dict'] = n
+            elif data['attr_dict'] is not n:
+                data['attr_dict'].update (n)
+        return self
+
+    def add_edges (self, edges):
+        keys = {}
+        for e in edges:
+            logger.debug (f"  --edge> {e}")
+            self.interner.intern_element (e)
+            pair = (e['source_id'], e['target_id'])
+            key = keys.get (pair, 0)
+            keys[pair] = key + 1
+            self.graph.add_edge (e['source_id'], e['target_id'], key=key, attr_dict=e)
+        return self
+
+    def add_kgs (self, graph):
+        """ Add the nodes and edges of a KGS answer graph. """
+        self.add_nodes (kgs_elements (graph, "node_list"))
+        self.add_edges (kgs_elements (graph, "edge_list"))
+        return self
+
+    def add_graph (self, graph):
+        """ Add the nodes and edges of a NetworkX graph built from KGS results. """
+        self.add_nodes ([ data['attr_dict'] for n, data in graph.nodes (data=True) if 'attr_dict' in data ])
+        for u, v, key, data in graph.edges (keys=True, data=True):
+            self.graph.add_edge (u, v, key=key, **data)
+        return self
+
+class GraphAccumulator:
+    """
+    Merge knowledge source responses into one graph as they arrive.
+
+    Nodes are deduplicated by id: the first occurrence keeps its position and is updated with later ones.
+    Edges are appended in place. Handles both the gamma answers shape and the result_list shape.
+    Identifiers and types are interned as they're added.
+    """
+    def __init__(self):
+        self.nodes = {}
+        self.edges = []
+        self.interner = Interner.get_instance ()
+
+    def add_nodes (self, nodes):
+        for node in nodes:
+            self.interner.intern_element (node)
+            existing = self.nodes.get (node['id'], None)
+            if existing is None:
+                self.nodes[node['id']] = node
+            elif existing is not node:
+                existing.update (node)
+
+    def add_edges (self, edges):
+        self.edges.extend ([ self.interner.intern_element (e) for e in edges ])
+
+    def add_response (self, response):
+        """ Add the nodes and edges of a knowledge source response. """
+        # gamma:
+        for answer in response.get ('answers', []):
+            self.add_nodes (answer['nodes'])
+            self.add_edges (answer['edges'])
+        # others
+        for g in response.get ('result_list', []):
+            self.add_nodes (g['result_graph']['node_list'])
+            self.add_edges (g['result_graph']['edge_list'])
+
+    def add_records (self, records):
+        """
+        Add ("node", node) and ("edge", edge) pairs, such as those from stream_graph.
+        Records may be shared with other callers, so nodes are copied before later ones are merged into them.
+        """
+        for kind, record in records:
+            if kind == "node":
+                self.add_nodes ([ dict(record) ])
+            else:
+                self.edges.append (self.interner.intern_element (record))
+
+    def to_kgs (self, tools=None):
+        """ The accumulated graph in KGS standard. """
+        tools = tools if tools else TranslatorGraphTools ()
+        return tools.kgs (nodes = list(self.nodes.values ()), edges = self.edges)
+
 def flattenDict(d, result=None, delim='.'):
     if result is None:
         result = {}
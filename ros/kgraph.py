@@ -40,9 +40,9 @@ class KnowledgeGraph:
 class Neo4JKnowledgeGraph:
     ''' Encapsulates a knowledge graph. '''
 
-    def __init__(self, host='localhost', port=7687):
+    def __init__(self, host='localhost', port=7687, pools=None):
         
-        """ Load configuration. """
+        """ Load configuration. If connection pools are supplied, open a session on their shared driver. """
         self.config = Config ()
 
         """ Connect to Neo4J """
@@ -54,10 +54,16 @@ class Neo4JKnowledgeGraph:
         auth = None
         if isinstance(username,str) and isinstance(password,str):
             auth = (username, password)
-            self._driver = GraphDatabase.driver (uri, auth=auth)
+        if pools:
+            """ The driver is shared; this instance doesn't own it. """
+            self._driver = None
+            self.session = pools.neo4j_session (uri, auth=auth)
         else:
-            self._driver = GraphDatabase.driver (uri)
-        self.session = self._driver.session ()
+            if auth:
+                self._driver = GraphDatabase.driver (uri, auth=auth)
+            else:
+                self._driver = GraphDatabase.driver (uri)
+            self.session = self._driver.session ()
 
     def add_node (self, label, props):
         """ Add a node to the graph. """
@@ -82,11 +88,28 @@ class Neo4JKnowledgeGraph:
         """ Delete the entire graph. """
         self.exec ("match (a) detach delete a")
     
-    def __del__ (self):
-        """ Close the connection. """
-        if self._driver:
+    def close (self):
+        """
+        Close the session, returning its connection to the driver's pool, and the driver unless it
+        belongs to the shared pools.
+        """
+        session = getattr (self, "session", None)
+        if session is not None:
+            self.session = None
+            session.close ()
+        if getattr (self, "_driver", None):
             logger.debug ("Closing neo4j database connection.")
             self._driver.close ()
+            self._driver = None
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, *args):
+        self.close ()
+
+    def __del__ (self):
+        self.close ()
         
     def exec(self, command):
         """ Execute a cypher command returning the result. """
@@ -0,0 +1,105 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import threading
+import traceback
+from lru import LRU
+
+logger = logging.getLogger("plan")
+logger.setLevel(logging.WARNING)
+
+class PlanCache:
+    """
+    Cache compiled workflow plans.
+
+    A plan is everything derived from a workflow specification before execution: the spec with imports,
+    templates and types resolved, the dependency maps, the DAG, and the topological sort.
+    Plans are keyed by a hash of the submitted spec, the library path, and the modification times
+    of the modules it imports and of the type library, so editing any of those yields a new plan.
+    Plans are held in memory as pickled bytes and serialized to disk to survive restarts.
+    """
+
+    _instance = None
+    _lock = threading.Lock ()
+
+    def __init__(self, path=None, max_entries=256):
+        """
+        :path: Directory for serialized plans. If None, plans are only cached in memory.
+        :max_entries: Maximum number of plans held in memory.
+        """
+        self.path = os.path.expanduser (path) if path else None
+        if self.path and not os.path.exists (self.path):
+            os.makedirs (self.path, exist_ok=True)
+        self.plans = LRU (max_entries)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def get_instance (config):
+        """ Get the process wide plan cache. Returns None if plan caching is disabled. """
+        plan_config = config.get ('plans', {})
+        if str(plan_config.get ('enabled', True)).lower () in [ 'false', '0', 'no' ]:
+            return None
+        if PlanCache._instance is None:
+            with PlanCache._lock:
+                if PlanCache._instance is None:
+                    PlanCache._instance = PlanCache (
+                        path = plan_config.get ('path', None),
+                        max_entries = int(plan_config.get ('max_entries', 256)))
+        return PlanCache._instance
+
+    def dependencies (self, spec, libpath, stdlib):
+        """ Files the compiled plan depends on, with their modification times. """
+        files = [ stdlib ]
+        for i in spec.get ("import", []):
+            for path in libpath:
+                file_name = os.path.join (path, f"{i}.ros")
+                if os.path.exists (file_name):
+                    files.append (file_name)
+        return [ [ f, os.path.getmtime (f) if os.path.exists (f) else None ] for f in files ]
+
+    def key (self, spec, libpath, stdlib):
+        """ Key a plan by the submitted spec and the state of the files it depends on. """
+        text = json.dumps ({
+            "spec"    : spec,
+            "libpath" : libpath,
+            "files"   : self.dependencies (spec, libpath, stdlib)
+        }, sort_keys=True, default=str)
+        return hashlib.sha256 (text.encode ("utf-8")).hexdigest ()
+
+    def _path (self, key):
+        return os.path.join (self.path, f"{key}.plan")
+
+    def get (self, key):
+        """ Get a private copy of a compiled plan, or None. """
+        data = self.plans.get (key, None)
+        if data is None and self.path:
+            path = self._path (key)
+            if os.path.exists (path):
+                try:
+                    with open (path, "rb") as stream:
+                        data = stream.read ()
+                    self.plans[key] = data
+                except:
+                    logger.warning (f"Unable to read plan {path}: {traceback.format_exc ()}")
+        if data is None:
+            self.misses = self.misses + 1
+            return None
+        self.hits = self.hits + 1
+        return pickle.loads (data)
+
+    def put (self, key, plan):
+        """ Store a compiled plan in memory and on disk. """
+        data = pickle.dumps (plan, protocol=pickle.HIGHEST_PROTOCOL)
+        self.plans[key] = data
+        if self.path:
+            path = self._path (key)
+            temp_path = f"{path}.{os.getpid ()}.{threading.get_ident ()}"
+            try:
+                with open (temp_path, "wb") as stream:
+                    stream.write (data)
+                os.replace (temp_path, path)
+            except:
+                logger.warning (f"Unable to write plan {path}: {traceback.format_exc ()}")
@@ -0,0 +1,128 @@
+import argparse
+import json
+import logging
+import re
+import threading
+import time
+import traceback
+from ros.cache import Cache
+from ros.config import Config
+
+logger = logging.getLogger("retention")
+logger.setLevel(logging.WARNING)
+
+""" Result keys of one execution begin with its id. Content addressed results begin with a hash. """
+RUN_KEY = re.compile ("[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\\.")
+
+class RetentionPolicy:
+    """
+    How long workflow results are kept.
+
+    Results of one execution are run scoped: nothing reads them once the run's response is sent, so they
+    expire after run_ttl. Incremental results are addressed by content and reused across runs, so they're kept
+    for content_ttl. Pinned results end with .pin and never expire. The shared operator cache has its own
+    policy in the operator_cache section and is never touched here. A ttl of zero keeps results indefinitely.
+    """
+    def __init__(self, run_ttl=86400, content_ttl=604800):
+        self.run_ttl = run_ttl
+        self.content_ttl = content_ttl
+
+    @staticmethod
+    def from_config (config):
+        retention_config = config.get ('retention', {})
+        return RetentionPolicy (
+            run_ttl = int(retention_config.get ('run_ttl', 86400)),
+            content_ttl = int(retention_config.get ('content_ttl', 604800)))
+
+    @staticmethod
+    def is_result (key):
+        return key.endswith (".res")
+
+    def ttl (self, key):
+        """ Seconds to keep the result stored under key, or None to keep it indefinitely. """
+        if not RetentionPolicy.is_result (key):
+            return None
+        ttl = self.run_ttl if RUN_KEY.match (key) else self.content_ttl
+        return ttl if ttl > 0 else None
+
+class Reaper:
+    """
+    Reclaim expired workflow results from every cache tier.
+
+    Redis expires results written with a ttl itself. The reaper deletes those written before retention
+    was configured, gives them a ttl if they're younger than the policy allows, and removes expired results
+    from the disk and memory tiers, which only check age when read. Reports count the keys and bytes reclaimed.
+    """
+    def __init__(self, cache, policy, interval=3600, batch=500):
+        """
+        :cache: The cache holding results.
+        :policy: The RetentionPolicy to enforce.
+        :interval: Seconds between passes when running in the background.
+        :batch: Keys examined per round trip.
+        """
+        self.cache = cache
+        self.policy = policy
+        self.interval = interval
+        self.batch = batch
+        self.totals = { "passes" : 0, "keys" : 0, "bytes" : 0 }
+        self.thread = None
+        self.stopped = threading.Event ()
+
+    @staticmethod
+    def from_config (config, cache=None):
+        return Reaper (
+            cache = cache if cache else Cache.from_config (config),
+            policy = RetentionPolicy.from_config (config),
+            interval = float(config.get ('retention', {}).get ('interval', 3600)))
+
+    def reap (self):
+        """ Make one pass over all tiers. Returns the keys and bytes reclaimed from each. """
+        start = time.time ()
+        prefix = self.cache.key_prefix ()
+        tiers = {
+            "memory" : self.cache.memory.reap (prefix)
+        }
+        if self.cache.redis_tier:
+            tiers["redis"] = self.cache.redis_tier.reap (prefix, self.policy.ttl, self.batch)
+        if self.cache.disk:
+            tiers["disk"] = self.cache.disk.reap (prefix, self.policy.ttl)
+        report = {
+            **tiers,
+            "keys"    : sum ([ t["keys"] for t in tiers.values () ]),
+            "bytes"   : sum ([ t["bytes"] for t in tiers.values () ]),
+            "seconds" : time.time () - start
+        }
+        self.totals["passes"] = self.totals["passes"] + 1
+        self.totals["keys"] = self.totals["keys"] + report["keys"]
+        self.totals["bytes"] = self.totals["bytes"] + report["bytes"]
+        logger.info (f"reclaimed {report['keys']} results, {report['bytes']} bytes in {report['seconds']:.2f}s")
+        return report
+
+    def run (self):
+        while not self.stopped.wait (self.interval):
+            try:
+                self.reap ()
+            except:
+                logger.error (f"reaper pass failed: {traceback.format_exc ()}")
+
+    def start (self):
+        """ Reap in a daemon thread every interval seconds. """
+        if self.thread is None and self.interval > 0:
+            self.thread = threading.Thread (target=self.run, name="result-reaper", daemon=True)
+            self.thread.start ()
+        return self
+
+    def stop (self):
+        self.stopped.set ()
+
+def main ():
+    arg_parser = argparse.ArgumentParser(
+        description='Reclaim expired workflow results.',
+        formatter_class=lambda prog: argparse.HelpFormatter(prog, max_help_position=60))
+    arg_parser.add_argument('-c', '--config', help="Configuration file.", default=None)
+    args = arg_parser.parse_args ()
+    report = Reaper.from_config (Config (args.config)).reap ()
+    print (json.dumps (report, indent=2))
+
+if __name__ == '__main__':
+    main ()
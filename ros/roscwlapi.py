@@ -9,6 +9,7 @@ import sys
 from io import IOBase
 from io import TextIOWrapper
 from jsonpath_rw import parse
+from ros.transport import install_archive
 from ros.util import JSONKit
 
 logger = logging.getLogger (__name__)
@@ -130,6 +131,9 @@ if __name__ == "__main__":
     
     args = arg_parser.parse_args ()
 
+    """ Record or replay service calls if HTTP_ARCHIVE_MODE is set. """
+    install_archive ()
+
     lifecycle = LifeCycle ()
     lifecycle.execute (service = args.service,
                        question_path = args.question,
@@ -1,20 +1,27 @@
 import argparse
 import copy
+import hashlib
+import importlib
 import json
 import logging
 import namedtupled
 import os
 import requests
 import sys
+import threading
 import yaml
 import time
 import traceback
 from jsonpath_rw import jsonpath, parse
 from ros.config import Config
+from ros.executor import OperatorExecutor
 from ros.framework import Event
 from ros.framework import Operator
+from ros.graph import GraphAccumulator
+from ros.graph import stream_graph
 from ros.lib.ndex import NDEx
 from ros.lib.validate import Validate
+from ros.transport import HttpTransport
 from ros.util import MaQ
 from ros.cache import Cache
 
@@ -44,8 +51,74 @@ class Cache:
             json.dump (v, stream, indent=2)
 '''
 
-""" Keep logging to a reasonable level. """
-first_router = True
+def invoke_in_process (libname, node):
+    """
+    Invoke a plugin operator in a worker process.
+    The workflow context can't cross the process boundary so the event carries only the resolved node.
+    """
+    return instantiate (libname).invoke (Event (context=None, node=node))
+
+def instantiate (class_name):
+    """ Given a class name <module>.<classname>, load the module and instantiate the class. """
+    module_name = ".".join (class_name.split(".")[:-1])
+    class_name = class_name.split(".")[-1]
+    module = importlib.import_module(module_name)
+    the_class = getattr(module, class_name)
+    return the_class ()
+
+class OperatorRegistry:
+
+    """
+    Plugin operators, imported, instantiated, and validated once per process.
+    Routers layer each workflow's templates over the registry, so routing a job is a dict lookup.
+    """
+
+    _instances = {}
+    _lock = threading.Lock ()
+
+    def __init__(self, plugin_config):
+        """ Load each configured plugin and the operator libraries it provides. """
+        self.plugins = []
+        self.libraries = {}
+        self.operators = {}
+        self.op_pools = {}
+        logger.debug (f"  --libraries:")
+        for plugin_def in plugin_config:
+            driver = instantiate (plugin_def['driver'])
+            self.plugins.append (driver)
+            logger.debug (f"Connecting {plugin_def['name']}: {driver}")
+            logger.debug (f"  --workflows: {driver.workflows ()}")
+            for libname in driver.libraries ():
+                lib = instantiate (libname)
+                self.validate_operator (libname, lib)
+                self.libraries[lib.name] = libname
+                self.operators[lib.name] = lib
+                self.op_pools[lib.name] = getattr (lib, "pool", OperatorExecutor.THREAD)
+                logger.debug (f"    --lib: {libname}@{driver.name} loaded.")
+
+    @staticmethod
+    def validate_operator (libname, lib):
+        """ Operators must be named and invocable. """
+        if not isinstance (getattr (lib, "name", None), str):
+            raise ValueError (f"Operator {libname} has no name.")
+        if not callable (getattr (lib, "invoke", None)):
+            raise ValueError (f"Operator {libname} has no invoke method.")
+        if not getattr (lib, "pool", OperatorExecutor.THREAD) in [
+                OperatorExecutor.THREAD, OperatorExecutor.PROCESS, OperatorExecutor.INLINE ]:
+            raise ValueError (f"Operator {libname} requests unknown pool {lib.pool}.")
+
+    @staticmethod
+    def get_instance (plugin_config):
+        """ Get the registry for this plugin configuration, building it on first use. """
+        key = json.dumps (plugin_config, sort_keys=True, default=str)
+        registry = OperatorRegistry._instances.get (key)
+        if registry is None:
+            with OperatorRegistry._lock:
+                registry = OperatorRegistry._instances.get (key)
+                if registry is None:
+                    registry = OperatorRegistry (plugin_config)
+                    OperatorRegistry._instances[key] = registry
+        return registry
 
 class Router:
 
@@ -55,7 +128,7 @@ class Router:
     Or operators defined in an extension module.
     """
 
-    def __init__(self, workflow):
+    def __init__(self, workflow, pools=None, registry=None):
         self.workflow = workflow
         self.r = {
             'requests'       : self.requests,
@@ -63,30 +136,43 @@ class Router:
             'union'          : self.union,
             'get'            : self.http_get
         }
+        """ The executor pool each operator runs in. """
+        self.op_pools = {
+            'requests'       : OperatorExecutor.THREAD,
+            'validate'       : OperatorExecutor.THREAD,
+            'union'          : OperatorExecutor.INLINE,
+            'get'            : OperatorExecutor.THREAD
+        }
+        """ Operators that read other steps' results from the context rather than their arguments aren't cached. """
+        self.uncached = { 'union' }
 
-        global first_router
-        if first_router:
-            logger.debug (f"  --libraries:")
-        for plugin in self.workflow.plugins:
-            libraries = plugin.libraries ()
-            for libname in libraries:
-                lib = self.workflow.instantiate (libname)
-                invoker = self.create_plugin_invoker (libname)
-                self.r[lib.name] = invoker
-                if first_router:
-                    logger.debug (f"    --lib: {libname}@{plugin.name} loaded.")
-        first_router = False
+        """ Plugin operators come from the process wide registry. """
+        self.registry = registry if registry else OperatorRegistry.get_instance (self.workflow.config["plugins"])
+        for name, lib in self.registry.operators.items ():
+            pool = self.registry.op_pools[name]
+            self.r[name] = self.create_plugin_invoker (self.registry.libraries[name], pool, lib)
+            self.op_pools[name] = pool
         
         self.create_template_adapters ()
-        self.config = Config ()
-        self.cache = Cache (redis_host=self.config['REDIS_HOST'],
-                            redis_port=self.config['REDIS_PORT'])
+        self.config = self.workflow.config
+        self.pools = pools if pools else self.workflow.pools
+        self.cache = Cache.from_config (self.config, pools=self.pools)
+
+        """ Operator results are cached under a versioned namespace with per operator lifetimes. """
+        cache_config = self.config.get ('operator_cache', {})
+        self.cache_version = cache_config.get ('version', 2)
+        self.cache_ttl = cache_config.get ('ttl', {})
 
-    def create_plugin_invoker (self, libname): #, context, job_name, node, op, args):
+    def create_plugin_invoker (self, libname, pool=OperatorExecutor.THREAD, lib=None): #, context, job_name, node, op, args):
         def invoker (context, job_name, node, op, args):
-            lib = self.workflow.instantiate (libname)
+            if pool == OperatorExecutor.PROCESS:
+                return OperatorExecutor.get ().invoke (pool, invoke_in_process, libname, node)
             return lib.invoke (Event (context=context, node=node))
         return invoker
+
+    def get_pool (self, op):
+        """ The executor pool an operator runs in. Unknown operators default to the thread pool. """
+        return self.op_pools.get (op, OperatorExecutor.THREAD)
     
     def create_template_adapters (self):
         """ Plug in template instances that define new operators. """
@@ -98,7 +184,45 @@ class Router:
                     node['args'].update (template['args'])
                     return method (context, job_name, node, op, args)
                 self.r[name] = invoke_template
+                self.op_pools[name] = self.get_pool (op)
         
+    def operator_key (self, code, op_name, args):
+        """
+        Key an operator result by its code, op, and arguments.
+        Identical calls share a result across jobs, workflows, and users. Bumping the cache version
+        moves every operator to a fresh namespace.
+        """
+        text = json.dumps ({
+            "code" : code,
+            "op"   : op_name,
+            "args" : args
+        }, sort_keys=True, default=str)
+        return f"op.{self.cache_version}.{hashlib.sha256 (text.encode ('utf-8')).hexdigest ()}"
+
+    @staticmethod
+    def digest (value):
+        text = json.dumps (value, sort_keys=True, default=str)
+        return hashlib.sha256 (text.encode ('utf-8')).hexdigest ()
+
+    def job_key (self, context, op_node, results):
+        """
+        Key a job's operator result by its code, op, and resolved arguments. Every variable in the arguments,
+        including those inside MaQ templates and select queries, is replaced by a digest of its value: the input,
+        or the content of the upstream result in results. Identical calls share a key whatever their variables
+        are named, and an upstream result that's recomputed with different data changes the key.
+        """
+        args = op_node['args']
+        values = {
+            name : "#" + Router.digest (context.inputs[name] if name in context.inputs else results.get (name))
+            for name in context.referenced_variables (args, set ())
+        }
+        return self.operator_key (op_node['code'], args.get ('op', ''), context.substitute_variables (args, values))
+
+    def get_ttl (self, code):
+        """ Seconds to cache an operator's results. None caches indefinitely. """
+        ttl = int(self.cache_ttl.get (code, self.cache_ttl.get ('default', 0)) or 0)
+        return ttl if ttl > 0 else None
+
     def short_text(self, text, max_len=85):
         """ Generate a shortened form of text. """
         return (text[:max_len] + '..') if len(text) > max_len else text
@@ -111,7 +235,9 @@ class Router:
             node_copy = copy.deepcopy (op_node)
 
             """ Resolve arguments to values. """
-            node_copy['args'] = { k : context.resolve_arg (v) for k,v in args.items() }
+            names = context.referenced_variables (args, set ()) - set(context.inputs)
+            results = context.get_results (sorted (names)) if names else {}
+            node_copy['args'] = { k : context.resolve_arg (v, results) for k,v in args.items() }
 
             """ Pass all operators context and the operation node. """
             arg_list = {
@@ -122,19 +248,18 @@ class Router:
                 "args"     : node_copy['args']
             }
             """ Call the operator. """
-            op_name=op_node['args'].get('op','')
-            key = f"{job_name}-{op_node['code']}"
-            if op_name and len(op_name) > 0:
-                key = f"{key}_{op_name}"
-
-            result = self.cache.get (key)
-            print (self.cache.cache.keys ())
-            if result:
-                result = json.loads (result)
-            else:
-                logger.debug (f"invoking {op} {self.r[op]}")
+            if op in self.uncached:
                 result = self.r[op](**arg_list)
-                self.cache.set (key, json.dumps(result, indent=2))
+            else:
+                key = self.job_key (context, op_node, results)
+                ttl = self.get_ttl (op_node['code'])
+                result = self.cache.get (key, ttl=ttl)
+                if result is None:
+                    logger.debug (f"invoking {op} {self.r[op]}")
+                    result = self.r[op](**arg_list)
+                    self.cache.set (key, result, ttl=ttl)
+                else:
+                    context.execution.cached.add (job_name)
                 
             text = self.short_text (str(result))
             
@@ -152,11 +277,14 @@ class Router:
         event = Event (context, node)
         url = event.pattern.format (**event.node['args'])
         logger.debug ("http-get: url:{url} rename:{event.rename}")
-        response = nodes=requests.get(
+        response = HttpTransport.get_instance (self.config).get(
                 url = url,
                 headers = {
                     'accept': 'application/json'
-                }).json ()
+                })
+        if not response.ok:
+            raise ValueError (response.text)
+        response = response.json ()
 
         """ generic method for renaming fields. """
         for v in event.rename:
@@ -177,46 +305,46 @@ class Router:
         result = None
         event = Event (context, node)
         url = event.url.format (**event.node['args'])
+        transport = HttpTransport.get_instance (self.config)
         if event.MaQ:
-            responses = []
             maq = MaQ ()
             questions = maq.parse (event.MaQ, self.workflow)
-            for question in questions:
-                logger.debug (f"Requests.POST: {json.dumps(question, indent=2)}")
-                response = requests.post(
+            logger.debug (f"Requests.POST: {len(questions)} questions to {url}")
+
+            """ Answers to questions asked before are fetched from the cache together. """
+            accumulator = GraphAccumulator ()
+            ttl = self.get_ttl (node['code'])
+            answer_key = lambda question: self.operator_key (node['code'], url, question)
+            cached = self.cache.get_many ([ answer_key (q) for q in questions ], ttl=ttl)
+            for records in cached.values ():
+                accumulator.add_records (records)
+            questions = [ q for q in questions if not answer_key (q) in cached ]
+            logger.debug (f"Requests.POST: {len(cached)} cached answers, {len(questions)} to ask")
+
+            """ Post the rest concurrently, streaming nodes and edges into one graph as answers arrive. """
+            answers = {}
+            for question, (response, records) in transport.post_many (
                     url = url,
-                    json = question,
+                    bodies = questions,
+                    handler = self.read_graph,
+                    stream = True,
                     headers = {
                         'accept': 'application/json'
-                    })
+                    }):
                 """ Check status and handle response. """
-                if response.status_code == 200 or response.status_code == 202:
-                    responses.append (response.json ())
+                if records is not None:
+                    accumulator.add_records (records)
+                    answers[answer_key (question)] = records
                 else:
                     logger.warning (f"error {response.status_code} processing MaQ request: {question}")
-                    print (response.text)
+                    logger.debug (response.text)
                     #raise ValueError (response.text)
-
-            edges = []
-            nodes = []
-            for r in responses:
-                # gamma:
-                if 'answers' in r:
-                    for answer in r['answers']:
-                        nodes = nodes + answer['nodes']
-                        edges = edges + answer['edges']
-                # others
-                if not 'result_list' in r:
-                    continue
-                for g in r['result_list']:
-                    print (json.dumps(g, indent=2))
-                    edges = edges + g['result_graph']['edge_list']
-                    nodes = nodes + g['result_graph']['node_list']
-            result = self.workflow.tools.kgs (nodes = nodes, edges = edges)
+            self.cache.set_many (answers, ttl=ttl)
+            result = accumulator.to_kgs (self.workflow.tools)
 
         elif event.body:
             """ Handle POST. May need to tag more explicitly. """
-            response = requests.post(
+            response = transport.post(
                 url = url,
                 json = event.body,
                 headers = {
@@ -229,7 +357,7 @@ class Router:
         else:
     
             """ Handle GET request. """
-            response = requests.get(
+            response = transport.get(
                 url = url,
                 headers = {
                     'accept': 'application/json'
@@ -247,6 +375,20 @@ class Router:
         logger.debug (f"requests.response: {json.dumps(result,indent=2)}")
         return result
     
+    @staticmethod
+    def read_graph (response):
+        """
+        Parse the nodes and edges of a streamed knowledge source response as it downloads.
+        Returns the response and its records, or None for records if the request failed.
+        """
+        if response.status_code == 200 or response.status_code == 202:
+            response.raw.decode_content = True
+            try:
+                return response, list(stream_graph (response.raw))
+            finally:
+                response.close ()
+        return response, None
+
     def validate(self, context, job_name, node, op, args):
         return Validate ().invoke (
             Event (context=context,
@@ -25,10 +25,13 @@ def exec_operator(model, job_name):
     result = None
     wf = json2workflow (model)
     op_node = wf.spec.get("workflow",{}).get(job_name,{})
-    if op_node:
-        router = Router (wf)
-        result = router.route (wf, job_name, op_node, op_node['code'], op_node['args'])
-        wf.set_result (job_name, result)
+    try:
+        if op_node:
+            router = wf.get_router ()
+            result = router.route (wf, job_name, op_node, op_node['code'], op_node['args'])
+            wf.set_result (job_name, result)
+    finally:
+        wf.close ()
     return result
 
 async def exec_async (workflow, job_name):
@@ -36,7 +39,7 @@ async def exec_async (workflow, job_name):
     logger.debug (f"running {job_name}")
     op_node = workflow.get_step (job_name)
     if op_node:        
-        router = Router (workflow)
+        router = workflow.get_router ()
         result = await router.route (workflow, job_name, op_node, op_node['code'], op_node['args'])
         logger.debug (f"completed {job_name}")
         workflow.set_result (job_name, result)
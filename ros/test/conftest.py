@@ -0,0 +1,11 @@
+import logging
+import pytest
+
+@pytest.fixture (autouse=True)
+def no_log_files (monkeypatch):
+    """
+    Importing ros.tranql applies logging.yaml, whose root handlers write info.log and errors.log
+    in the working directory. Tests log only to pytest's capture.
+    """
+    root = logging.getLogger ()
+    monkeypatch.setattr (root, "handlers", [ h for h in root.handlers if not isinstance (h, logging.FileHandler) ])
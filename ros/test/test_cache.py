@@ -0,0 +1,229 @@
+import fnmatch
+import json
+import pickle
+import pytest
+import redis
+from ros.cache import Cache
+from ros.cache import JSONCacheSerializer
+from ros.cache import MemoryTier
+from ros.cache import RedisTier
+from ros.connections import ConnectionPools
+from ros.util import Interner
+
+graph = [ { "result_list" : [ { "result_graph" : {
+    "node_list" : [ { "id" : "DOID:9352", "type" : "disease", "score" : 0.5 } ],
+    "edge_list" : [ { "source_id" : "DOID:9352", "target_id" : "HP:0011628", "weight" : 1 } ]
+} } ] } ]
+
+def test_serializer_round_trip ():
+    serializer = JSONCacheSerializer (codec="json", compression="zlib", threshold=64)
+    data = serializer.dumps (graph)
+    assert data[:2] == b"jz"
+    assert serializer.loads (data) == graph
+    assert serializer.dumps ([ 1 ])[:2] == b"j-"
+    assert serializer.loads (serializer.dumps (None)) is None
+
+    """ Any serializer reads what another wrote, including legacy pickles. """
+    assert JSONCacheSerializer (compression="none").loads (data) == graph
+    assert serializer.loads (pickle.dumps (json.dumps (graph))) == json.dumps (graph)
+
+def test_missing_optional_codec ():
+    try:
+        import msgpack
+    except ImportError:
+        with pytest.raises (ValueError):
+            JSONCacheSerializer (codec="msgpack")
+
+def disk_cache (path, memory, **kwargs):
+    """ A cache without Redis: memory over disk. """
+    return Cache (cache_path=str(path), redis_port=1, pools=ConnectionPools (), memory=memory,
+                  serializer=JSONCacheSerializer (compression="none"), **kwargs)
+
+class StubRedis:
+    """ The Redis commands the cache uses, held in a dict. Expiry times are recorded but not enforced. """
+    def __init__(self, version=5):
+        self.version = version
+        self.values = {}
+        self.expiry = {}
+        self.idle = {}
+    def get (self, key):
+        return self.values.get (key)
+    def set (self, key, data, ex=None):
+        self.values[key] = data
+        self.expiry[key] = ex
+    def mget (self, keys):
+        return [ self.values.get (k) for k in keys ]
+    def delete (self, *keys):
+        keys = [ k.decode ("utf-8") if isinstance (k, bytes) else k for k in keys ]
+        found = [ k for k in keys if k in self.values ]
+        for k in found:
+            del self.values[k]
+        return len(found)
+    def execute_command (self, command, *args):
+        if command == "UNLINK" and self.version >= 4:
+            return self.delete (*args)
+        raise redis.exceptions.ResponseError (f"unknown command '{command}'")
+    def ttl (self, key):
+        key = key.decode ("utf-8")
+        return -2 if not key in self.values else self.expiry.get (key) or -1
+    def object (self, info, key):
+        return self.idle.get (key.decode ("utf-8"), 0)
+    def strlen (self, key):
+        return len(self.values.get (key.decode ("utf-8"), b""))
+    def expire (self, key, seconds):
+        self.expiry[key.decode ("utf-8")] = seconds
+    def scan_iter (self, match="*", count=None):
+        return [ k.encode ("utf-8") for k in list(self.values) if fnmatch.fnmatchcase (k, match) ]
+    def pipeline (self, transaction=True):
+        return StubPipeline (self)
+
+class StubPipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+    def __getattr__ (self, name):
+        return lambda *args, **kwargs: self.commands.append ((name, args, kwargs))
+    def execute (self):
+        replies = [ getattr (self.redis, name) (*args, **kwargs) for name, args, kwargs in self.commands ]
+        self.commands = []
+        return replies
+
+def redis_cache (path, memory, stub, **kwargs):
+    """ A cache over a stub Redis and disk. """
+    cache = disk_cache (path, memory, **{ "disk_write" : "always", **kwargs })
+    cache.redis = stub
+    cache.redis_tier = RedisTier (stub)
+    return cache
+
+def test_cache_values_are_not_shared (tmp_path):
+    memory = MemoryTier (max_bytes=2**20)
+    cache = disk_cache (tmp_path, memory)
+    cache.set ("result", graph)
+    value = cache.get ("result")
+    value[0]["result_list"] = []
+    assert cache.get ("result") == graph
+    memory.delete ("result")
+    assert cache.get ("result") == graph
+    assert cache.stats ()["disk"]["hits"] == 1
+
+def test_memory_tier_is_bounded_by_bytes ():
+    memory = MemoryTier (max_bytes=1000, max_item_bytes=500)
+    for i in range (5):
+        memory.put (f"k{i}", b"x" * 300)
+    assert memory.bytes == 900
+    assert memory.get ("k0") is None and memory.get ("k1") is None
+    assert memory.get ("k2") is not None
+    memory.put ("k5", b"x" * 300)
+    assert memory.get ("k3") is None and memory.get ("k2") is not None
+    memory.put ("huge", b"x" * 501)
+    assert memory.get ("huge") is None
+    report = memory.report ()
+    assert report["evictions"] == 3
+    assert report["rejected"] == 1
+    assert report["bytes"] <= 1000
+
+def test_demote_and_promote (tmp_path):
+    memory = MemoryTier (max_bytes=200, max_item_bytes=200)
+    cache = disk_cache (tmp_path, memory, disk_write="never", demote=True)
+    cache.set ("a", "a" * 120)
+    cache.set ("b", "b" * 120)
+    assert memory.get ("a") is None
+    assert cache.stats ()["disk"]["writes"] == 1
+    assert cache.get ("a") == "a" * 120
+    assert memory.get ("a") is not None
+
+def test_get_many_and_set_many (tmp_path):
+    memory = MemoryTier (max_bytes=2**20)
+    cache = disk_cache (tmp_path, memory)
+    cache.set_many ({ "a" : graph, "b" : [ 1, 2 ], "none" : None })
+    assert cache.stats ()["disk"]["writes"] == 2
+    memory.delete ("a")
+    values = cache.get_many ([ "a", "b", "c", "none" ])
+    assert values == { "a" : graph, "b" : [ 1, 2 ] }
+    assert cache.stats ()["disk"]["hits"] == 1
+    assert memory.get ("a") is not None
+
+def test_flush_increments_generation (tmp_path):
+    memory = MemoryTier (max_bytes=2**20)
+    cache = disk_cache (tmp_path, memory, disk_write="always", namespace="ros", generation_refresh=0)
+    cache.set ("a", graph)
+    other = disk_cache (tmp_path, MemoryTier (max_bytes=2**20), namespace="ros", generation_refresh=0)
+    assert other.get ("a") == graph
+    cache.flush ()
+    assert cache.get ("a") is None
+    assert other.get ("a") is None
+    cache.set ("b", graph)
+    assert cache.reclaim () == 1
+    assert cache.get ("b") == graph
+    assert other.key_prefix () == "ros:1:"
+
+def test_flush_without_prefix (tmp_path):
+    cache = disk_cache (tmp_path, MemoryTier (max_bytes=2**20), disk_write="always")
+    cache.set ("a", graph)
+    with pytest.raises (ValueError):
+        cache.flush ()
+    assert cache.get ("a") == graph
+    cache.prefix = "p."
+    cache.set ("a", graph)
+    cache.flush ()
+    assert cache.get ("a") is None
+    assert (tmp_path / "a").exists ()
+
+def test_loads_interns_identifiers ():
+    serializer = JSONCacheSerializer (compression="none", intern=True)
+    data = serializer.dumps (graph)
+    first, second = serializer.loads (data), serializer.loads (data)
+    assert first == second == graph
+    node = lambda g: g[0]["result_list"][0]["result_graph"]["node_list"][0]
+    assert node (first)["id"] is node (second)["id"]
+    assert node (first)["type"] is node (second)["type"]
+    plain = JSONCacheSerializer (compression="none")
+    assert node (plain.loads (data))["id"] is not node (first)["id"]
+
+def test_interner_is_bounded ():
+    interner = Interner (max_entries=2)
+    a = interner.intern ("".join ([ "MONDO:", "1" ]))
+    assert interner.intern ("".join ([ "MONDO:", "1" ])) is a
+    interner.intern ("b")
+    interner.intern ("c")
+    assert interner.report ()["entries"] == 1
+    assert interner.intern (7) == 7
+
+def test_promoted_values_expire (tmp_path):
+    stub = StubRedis ()
+    cache = redis_cache (tmp_path, MemoryTier (max_bytes=2**20), stub, promote_ttl=600)
+    cache.disk.put ("a", cache.serializer.dumps (graph))
+    cache.disk.put ("b", cache.serializer.dumps (graph))
+    assert cache.get ("a") == graph
+    assert stub.expiry["a"] == 600
+    assert cache.get_many ([ "b" ], ttl=60) == { "b" : graph }
+    assert 0 < stub.expiry["b"] <= 60
+
+def test_disk_writes_are_atomic (tmp_path):
+    cache = disk_cache (tmp_path, MemoryTier (max_bytes=2**20), disk_write="always")
+    cache.set ("a", graph)
+    cache.set ("a", [ 1 ])
+    assert [ p.name for p in tmp_path.iterdir () ] == [ "a" ]
+    assert cache.disk.get ("a") == cache.serializer.dumps ([ 1 ])
+
+def test_redis_purge_unlinks_keys (tmp_path):
+    for version in [ 5, 3 ]:
+        stub = StubRedis (version=version)
+        cache = redis_cache (tmp_path / str(version), MemoryTier (max_bytes=2**20), stub, disk_write="never")
+        cache.set_many ({ f"p.{i}" : [ i ] for i in range (5) })
+        cache.set ("p.keep", [ 1 ])
+        cache.set ("q.0", [ 1 ])
+        assert cache.redis_tier.delete_prefix ("p.", keep=[ "p.keep" ], batch=2) == 5
+        assert sorted (stub.values) == [ "p.keep", "q.0" ]
+        assert cache.redis_tier.lazy_free == (version >= 4)
+
+def test_redis_reap (tmp_path):
+    for version in [ 5, 3 ]:
+        stub = StubRedis (version=version)
+        cache = redis_cache (tmp_path / str(version), MemoryTier (max_bytes=2**20), stub, disk_write="never")
+        cache.set_many ({ "old.res" : [ 1 ], "new.res" : [ 2 ], "kept.pin" : [ 3 ] })
+        stub.idle = { "old.res" : 120, "new.res" : 20, "kept.pin" : 120 }
+        reclaimed = cache.redis_tier.reap ("", lambda key: 60, batch=2)
+        assert reclaimed["keys"] == 1 and reclaimed["expiring"] == 1
+        assert sorted (stub.values) == [ "kept.pin", "new.res" ]
+        assert stub.expiry["new.res"] == 40
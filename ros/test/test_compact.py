@@ -0,0 +1,58 @@
+import json
+import numpy as np
+from ros.compact import CompactGraph
+from ros.graph import TranslatorGraphTools
+from ros.util import JSONKit
+from ros.util import KGS_EDGES
+
+def answer_graph ():
+    tools = TranslatorGraphTools ()
+    with open ("test_graph.json", "r") as stream:
+        graph = json.load (stream)
+    return tools, graph
+
+def test_kgs_round_trip ():
+    tools, graph = answer_graph ()
+    expected = tools.to_nx (graph)
+    compact = CompactGraph.from_kgs (graph)
+    assert compact.number_of_nodes () == expected.number_of_nodes ()
+    assert compact.number_of_edges () == expected.number_of_edges ()
+    assert compact.subjects.dtype == np.int32
+
+    nodes = { n : data['attr_dict'] for n, data in expected.nodes (data=True) }
+    kgs = compact.to_kgs (tools)[0]['result_list'][0]['result_graph']
+    assert { n['id'] : n for n in kgs['node_list'] } == nodes
+    assert kgs['edge_list'] == JSONKit ().find (KGS_EDGES, graph)
+
+    again = CompactGraph.from_nx (compact.to_nx ()).to_nx ()
+    edges = lambda g: sorted ([ (u, v, k, json.dumps (d['attr_dict'], sort_keys=True)) for u, v, k, d in g.edges (keys=True, data=True) ])
+    assert edges (again) == edges (expected)
+    assert { n : data['attr_dict'] for n, data in again.nodes (data=True) } == nodes
+
+def test_unusual_values_survive ():
+    compact = CompactGraph ()
+    compact.add_nodes ([ { "id" : 7, "type" : [ "gene", "protein" ] }, { "id" : "a" }, { "id" : "a", "type" : "gene" } ])
+    compact.add_edges ([ { "source_id" : 7, "target_id" : "b", "weight" : 0.5 } ])
+    assert list(compact.nodes ()) == [ { "id" : 7, "type" : [ "gene", "protein" ] }, { "id" : "a", "type" : "gene" } ]
+    assert list(compact.edges ()) == [ { "source_id" : 7, "target_id" : "b", "weight" : 0.5 } ]
+
+def test_vectorized_filter ():
+    tools, graph = answer_graph ()
+    compact = CompactGraph.from_kgs (graph)
+    mask = compact.edge_mask (predicates=[ "has_phenotype" ], object_types=[ "phenotypic_feature" ])
+    selected = compact.filter (mask)
+    edges = [ e for e in compact.edges () if e['type'] == "has_phenotype" ]
+    types = { n['id'] : n.get ('type') for n in compact.nodes () }
+    edges = [ e for e in edges if types.get (e['target_id']) == "phenotypic_feature" ]
+    assert len(edges) > 0
+    assert list(selected.edges ()) == edges
+    endpoints = set([ e['source_id'] for e in edges ] + [ e['target_id'] for e in edges ])
+    assert set([ n['id'] for n in selected.nodes () ]) == endpoints & set(types)
+
+def test_unknown_types_match_nothing ():
+    compact = CompactGraph ()
+    compact.add_nodes ([ { "id" : "a", "type" : "gene" }, { "id" : "b" } ])
+    compact.add_edges ([ { "source_id" : "a", "target_id" : "b" }, { "source_id" : "a", "target_id" : "b", "type" : "causes" } ])
+    assert not compact.edge_mask (predicates=[ "treats" ]).any ()
+    assert not compact.edge_mask (object_types=[ "disease" ]).any ()
+    assert compact.edge_mask (predicates=[ "causes", "treats" ]).tolist () == [ False, True ]
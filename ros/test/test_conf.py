@@ -10,5 +10,13 @@ def config():
 def test_config (config):
     assert config['USER'] == os.environ['USER']
 
+def test_cache_sections (config):
+    operator_cache = config.get ('operator_cache')
+    assert int(operator_cache.get ('version')) > 0
+    assert operator_cache.get ('ttl').get ('default') is not None
+    retention = config.get ('retention')
+    assert int(retention.get ('run_ttl')) > 0
+    assert retention.get ('version') is None and retention.get ('ttl') is None
+
 #def test_nested(config):
 #    assert config['system.
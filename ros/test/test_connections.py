@@ -0,0 +1,37 @@
+import json
+import pytest
+from ros.config import Config
+from ros.connections import ConnectionPools
+from ros.kgraph import Neo4JKnowledgeGraph
+
+def test_unreachable_redis_is_not_retried_immediately (caplog):
+    pools = ConnectionPools (retry_interval=60)
+    assert pools.redis (host="localhost", port=1) is None
+    assert ("localhost", 1, 0) in pools.redis_failures
+    assert pools.redis (host="localhost", port=1) is None
+    assert len([ r for r in caplog.records if r.name == "connections" ]) == 1
+    assert pools.stats ()["redis"] == {}
+
+def test_process_wide_instance ():
+    config = Config ("ros.yaml")
+    assert ConnectionPools.get_instance (config) is ConnectionPools.get_instance ()
+
+def test_config_is_parsed_once ():
+    assert Config ("ros.yaml").conf is Config ("ros.yaml").conf
+
+class StubSession:
+    closed = 0
+    def close (self):
+        StubSession.closed = StubSession.closed + 1
+
+class StubPools:
+    def neo4j_session (self, uri, auth=None):
+        return StubSession ()
+
+def test_graph_closes_pooled_session ():
+    closed = StubSession.closed
+    with Neo4JKnowledgeGraph (pools=StubPools ()) as graph:
+        assert graph.session is not None
+    assert graph.session is None
+    graph.close ()
+    assert StubSession.closed - closed == 1
@@ -0,0 +1,273 @@
+import asyncio
+import pytest
+import threading
+import time
+from ros.app import AsyncioExecutor
+from ros.app import CeleryDAGExecutor
+from ros.executor import OperatorExecutor
+from ros.workflow import DependencyTracker
+from ros.workflow import Execution
+from ros.workflow import Workflow
+
+class SleepWorkflow:
+    """ A minimal workflow whose jobs sleep for a fixed duration. """
+    def __init__(self, durations, dependencies):
+        self.durations = durations
+        self.dependencies = dependencies
+        self.dependents, self.in_degree = Workflow.reverse_dependencies (dependencies)
+        self.topsort = [ j for j in durations.keys () ]
+        self.execution = Execution ()
+        self.results = {}
+        self.latencies = {}
+        self.reusable = {}
+        self.reuse_threads = set ()
+    def reuse_result (self, job_name):
+        self.reuse_threads.add (threading.current_thread ())
+        if job_name in self.reusable:
+            self.results[job_name] = self.reusable[job_name]
+            return True
+        return False
+    def get_result (self, job_name):
+        return self.results.get (job_name)
+    def estimate_costs (self):
+        return self.durations
+    def record_latency (self, job_name, seconds):
+        self.latencies[job_name] = seconds
+    def save_latencies (self):
+        self.saved = dict(self.latencies)
+
+async def sleep_job (workflow, job_name):
+    await asyncio.sleep (workflow.durations[job_name])
+    workflow.results[job_name] = job_name
+    return job_name
+
+def execute (workflow, max_concurrency=0):
+    executor = AsyncioExecutor (workflow=workflow, run_job=sleep_job, max_concurrency=max_concurrency)
+    loop = asyncio.new_event_loop ()
+    try:
+        result = loop.run_until_complete (executor.execute ())
+    finally:
+        loop.close ()
+    return executor, result
+
+def test_critical_path_sets_latency ():
+    """ Three independent branches overlap; the slowest chain bounds wall time. """
+    workflow = SleepWorkflow (
+        durations = {
+            "a"      : 0.3,
+            "b"      : 0.3,
+            "c"      : 0.3,
+            "d"      : 0.2,
+            "return" : 0.0
+        },
+        dependencies = {
+            "a"      : [],
+            "b"      : [],
+            "c"      : [],
+            "d"      : [ "a", "b" ],
+            "return" : [ "c", "d" ]
+        })
+    executor, result = execute (workflow)
+    assert result == "return"
+    assert len(workflow.execution.done) == 5
+    assert 0.5 <= executor.stats['wall_time'] < 0.75
+    assert executor.stats['max_concurrency'] == 3
+    assert executor.stats['parallelism'] > 1.5
+
+def test_failure_propagates ():
+    async def failing_job (workflow, job_name):
+        raise ValueError (job_name)
+    workflow = SleepWorkflow (
+        durations = { "return" : 0.0 },
+        dependencies = { "return" : [] })
+    executor = AsyncioExecutor (workflow=workflow, run_job=failing_job, max_concurrency=0)
+    loop = asyncio.new_event_loop ()
+    with pytest.raises (ValueError):
+        loop.run_until_complete (executor.execute ())
+    loop.close ()
+    assert "return" in workflow.execution.failed
+
+def test_thread_pool_overlaps_blocking_calls ():
+    """ Blocking operators offloaded to the thread pool don't stall one another. """
+    executor = OperatorExecutor (thread_pool_size=4)
+    async def run_all ():
+        return await asyncio.gather (*[
+            executor.run (OperatorExecutor.THREAD, time.sleep, 0.3) for i in range (4) ])
+    loop = asyncio.new_event_loop ()
+    start = time.time ()
+    loop.run_until_complete (run_all ())
+    elapsed = time.time () - start
+    loop.close ()
+    executor.shutdown ()
+    assert elapsed < 0.6
+
+def test_process_pool_invoke ():
+    executor = OperatorExecutor (thread_pool_size=1, process_pool_size=1)
+    assert executor.invoke (OperatorExecutor.PROCESS, pow, 2, 10) == 1024
+    assert executor.invoke (OperatorExecutor.THREAD, pow, 2, 3) == 8
+    executor.shutdown ()
+
+def test_dependency_tracker ():
+    dependencies = {
+        "a"      : [],
+        "b"      : [ "a" ],
+        "c"      : [ "a" ],
+        "return" : [ "b", "c" ]
+    }
+    dependents, in_degree = Workflow.reverse_dependencies (dependencies)
+    assert dependents["a"] == [ "b", "c" ]
+    assert in_degree["return"] == 2
+    tracker = DependencyTracker (dependents, in_degree, order=[ "a", "b", "c", "return" ])
+    assert tracker.pop_ready () == [ "a" ]
+    assert tracker.pop_ready () == []
+    assert tracker.complete ("a") == [ "b", "c" ]
+    assert tracker.complete ("b") == []
+    assert tracker.complete ("c") == [ "return" ]
+    assert tracker.pop_ready () == [ "b", "c", "return" ]
+
+def test_critical_path ():
+    dependencies = {
+        "fast"   : [],
+        "slow"   : [],
+        "next"   : [ "slow" ],
+        "return" : [ "fast", "next" ]
+    }
+    dependents, in_degree = Workflow.reverse_dependencies (dependencies)
+    remaining = Workflow.critical_path (
+        dependents = dependents,
+        topsort = [ "fast", "slow", "next", "return" ],
+        costs = { "fast" : 1, "slow" : 5, "next" : 2, "return" : 0 })
+    assert remaining == { "return" : 0, "next" : 2, "slow" : 7, "fast" : 1 }
+    tracker = DependencyTracker (dependents, in_degree, order=[ "fast", "slow", "next", "return" ], priority=remaining)
+    assert tracker.pop_ready (limit=1) == [ "slow" ]
+
+def test_capped_concurrency_starts_critical_path_first ():
+    """ With two slots, the long chain starts before the alphabetically earlier short jobs. """
+    workflow = SleepWorkflow (
+        durations = {
+            "a1"     : 0.2,
+            "a2"     : 0.2,
+            "slow"   : 0.4,
+            "slow2"  : 0.4,
+            "return" : 0.0
+        },
+        dependencies = {
+            "a1"     : [],
+            "a2"     : [],
+            "slow"   : [],
+            "slow2"  : [ "slow" ],
+            "return" : [ "a1", "a2", "slow2" ]
+        })
+    executor, result = execute (workflow, max_concurrency=2)
+    assert executor.stats['max_concurrency'] == 2
+    assert executor.stats['wall_time'] < 0.95
+    assert set(workflow.latencies.keys ()) == set(workflow.durations.keys ())
+    assert workflow.saved == workflow.latencies
+
+def test_content_keys_change_only_affected_jobs ():
+    spec = {
+        "workflow" : {
+            "names"  : { "code" : "bionames", "args" : { "type" : "disease", "input" : "$disease_name" } },
+            "drugs"  : { "code" : "bionames", "args" : { "type" : "drug", "input" : "$drug_name" } },
+            "expand" : { "code" : "xray", "args" : { "op" : "expand", "graph" : "$names" } },
+            "return" : { "code" : "union", "args" : { "elements" : [ "expand", "drugs" ] } }
+        }
+    }
+    dependencies = {
+        "names"  : [],
+        "drugs"  : [],
+        "expand" : [ "names" ],
+        "return" : [ "expand", "drugs" ]
+    }
+    topsort = [ "drugs", "names", "expand", "return" ]
+    inputs = { "disease_name" : "asthma", "drug_name" : "imatinib" }
+    keys = Workflow.content_keys (spec, inputs, dependencies, topsort)
+    assert keys == Workflow.content_keys (spec, dict(inputs), dependencies, topsort)
+    changed = Workflow.content_keys (spec, { **inputs, "drug_name" : "aspirin" }, dependencies, topsort)
+    assert [ j for j in topsort if keys[j] != changed[j] ] == [ "drugs", "return" ]
+
+def test_incremental_skips_reusable_jobs ():
+    workflow = SleepWorkflow (
+        durations = { "a" : 0.1, "b" : 0.1, "c" : 0.1, "return" : 0.0 },
+        dependencies = { "a" : [], "b" : [ "a" ], "c" : [], "return" : [ "b", "c" ] })
+    workflow.reusable = { "a" : "a", "b" : "b" }
+    executor, result = execute (workflow)
+    assert result == "return"
+    assert workflow.execution.skipped == [ "a", "b" ]
+    assert executor.stats['skipped'] == 2
+    assert not threading.main_thread () in workflow.reuse_threads
+    assert set(workflow.latencies.keys ()) == { "c", "return" }
+
+class StubSpec:
+    """ A workflow spec whose json model is built from a dependency map. """
+    def __init__(self, dependencies):
+        self.dependencies = dependencies
+    def json (self):
+        dependents, in_degree = Workflow.reverse_dependencies (self.dependencies)
+        return {
+            "uuid"         : "stub",
+            "spec"         : {},
+            "inputs"       : {},
+            "dependencies" : self.dependencies,
+            "dependents"   : dependents,
+            "in_degree"    : in_degree,
+            "topsort"      : list(self.dependencies.keys ()),
+            "running"      : {},
+            "failed"       : {},
+            "done"         : {}
+        }
+
+class StubPromise:
+    """ A Celery result that's ready the second time it's polled. """
+    def __init__(self, value):
+        self.value = value
+        self.polls = 0
+    def ready (self):
+        self.polls = self.polls + 1
+        return self.polls > 1
+    def failed (self):
+        return False
+    def get (self):
+        return self.value
+
+def test_celery_executor_caps_running_jobs ():
+    launched = []
+    peak = [ 0 ]
+    def stub_run_job (j, model):
+        model.topsort.remove (j)
+        launched.append (j)
+        model.running[j] = StubPromise (j)
+        peak[0] = max (peak[0], len(model.running))
+    spec = StubSpec ({
+        "a"      : [],
+        "b"      : [],
+        "c"      : [],
+        "return" : [ "a", "b", "c" ]
+    })
+    executor = CeleryDAGExecutor (spec, run_job=stub_run_job, max_concurrency=2)
+    assert executor.execute () == "return"
+    assert peak[0] == 2
+    assert launched == [ "a", "b", "c", "return" ]
+
+def test_celery_executor_unlimited ():
+    def stub_run_job (j, model):
+        model.topsort.remove (j)
+        model.done[j] = j
+    spec = StubSpec ({ "a" : [], "b" : [ "a" ], "return" : [ "b" ] })
+    executor = CeleryDAGExecutor (spec, run_job=stub_run_job, max_concurrency=0)
+    assert executor.max_concurrency is None
+    assert executor.execute () == "return"
+
+def test_cache_hits_do_not_inform_latency ():
+    async def cached_job (workflow, job_name):
+        workflow.execution.cached.add (job_name)
+        workflow.results[job_name] = job_name
+    workflow = SleepWorkflow (
+        durations = { "a" : 0.0, "return" : 0.0 },
+        dependencies = { "a" : [], "return" : [ "a" ] })
+    executor = AsyncioExecutor (workflow=workflow, run_job=cached_job, max_concurrency=0)
+    loop = asyncio.new_event_loop ()
+    assert loop.run_until_complete (executor.execute ()) == "return"
+    loop.close ()
+    assert workflow.latencies == {}
+    assert executor.stats['cached'] == 2
@@ -2,9 +2,18 @@ import json
 import pytest
 from networkx.readwrite import json_graph
 from jsonpath_rw import jsonpath, parse
+from io import BytesIO
+import networkx as nx
+from ros.graph import GraphAccumulator
+from ros.graph import GraphBuilder
+from ros.graph import stream_graph
 from ros.graph import TranslatorGraphTools
 from ros.kgraph import KnowledgeGraph
 from ros.kgraph import Neo4JKnowledgeGraph
+from ros.util import JSONKit
+from ros.util import KGS_EDGES
+from ros.util import KGS_NODES
+from ros.util import compile_jsonpath
 
 @pytest.fixture(scope='module')
 def graph_tools():
@@ -40,6 +49,66 @@ def test_file_to_d3_json(graph_tools):
     print (f"test_file_to_d3_json: nodes: {len(g['nodes'])}")
     assert g['nodes'][0]['id'] == 'DOID:9352'
 
+def test_dedup_nodes(graph_tools):
+    nodes = [
+        { "id" : "a", "name" : "A" },
+        { "id" : "b", "name" : "B" },
+        { "id" : "a", "name" : "A2", "type" : "gene" },
+        { "id" : "c" },
+        { "id" : "a", "name" : "A3" }
+    ]
+    deduped = graph_tools.dedup_nodes (nodes)
+    assert [ n['id'] for n in deduped ] == [ "a", "b", "c" ]
+    assert deduped[0] == { "id" : "a", "name" : "A3", "type" : "gene" }
+    assert deduped[0] is nodes[0]
+
+    graph = graph_tools.from_file ("test_graph.json")
+    nodes = [ match.value for match in parse ("$.[*].result_list.[*].[*].result_graph.node_list.[*]").find (graph) ]
+    seen = {}
+    expected = [ n for n in [ graph_tools.coalesce_node (dict(n), nodes, seen) for n in nodes ] if n is not None ]
+    assert graph_tools.dedup_nodes ([ dict(n) for n in nodes ]) == expected
+
+def test_kgs_fast_path(graph_tools):
+    graph = graph_tools.from_file ("test_graph.json")
+    odd = [
+        { "result_list" : { "result_graph" : { "node_list" : { "id" : "single" }, "edge_list" : [] } } },
+        { "result_list" : [ [ { "result_graph" : { "node_list" : [ { "id" : "nested" } ] } } ], "text" ] },
+        { "result_list" : [ { "other" : 1 } ] },
+        { "other" : [] },
+        "text"
+    ]
+    jsonkit = JSONKit ()
+    for g in [ graph, odd, odd[0] ]:
+        for query in [ KGS_NODES, KGS_EDGES ]:
+            expected = [ match.value for match in parse (query).find (g) ]
+            assert jsonkit.find (query, g) == expected
+    assert [ n['id'] for n in jsonkit.find (KGS_NODES, odd) ] == [ "single", "nested" ]
+    assert compile_jsonpath (KGS_NODES) is compile_jsonpath (KGS_NODES)
+
+def test_graph_builder(graph_tools):
+    graph = graph_tools.from_file ("test_graph.json")
+    nodes = graph_tools.dedup_nodes (JSONKit ().find (KGS_NODES, graph))
+    edges = JSONKit ().find (KGS_EDGES, graph)
+    answers = [
+        graph_tools.kgs (nodes = nodes[i:i+50], edges = edges[i:i+50])
+        for i in range (0, max (len(nodes), len(edges)), 50)
+    ]
+    composed = nx.MultiDiGraph ()
+    for answer in answers:
+        composed = nx.compose (composed, graph_tools.to_nx (answer))
+    built = graph_tools.answer_set_to_nx (answers)
+    assert sorted (built.nodes ()) == sorted (composed.nodes ())
+    assert sorted (built.edges (keys=True)) == sorted (composed.edges (keys=True))
+
+    builder = GraphBuilder ()
+    builder.add_kgs (graph_tools.kgs (nodes = [ { "id" : "a", "name" : "A" } ], edges = [
+        { "source_id" : "a", "target_id" : "b", "type" : "x" },
+        { "source_id" : "a", "target_id" : "b", "type" : "y" } ]))
+    builder.add_graph (graph_tools.to_nx (graph_tools.kgs (nodes = [ { "id" : "a", "type" : "gene" }, { "id" : "b" } ])))
+    assert builder.graph.nodes["a"]["attr_dict"] == { "id" : "a", "name" : "A", "type" : "gene" }
+    assert builder.graph.nodes["b"]["attr_dict"] == { "id" : "b" }
+    assert builder.graph.number_of_edges ("a", "b") == 2
+
 def test_create_node (graph_tools):
     knowledge = Neo4JKnowledgeGraph ()
     result = knowledge.add_node (
@@ -86,3 +155,47 @@ def test_to_knowledge_graph (graph_tools):
     result = knowledge.query ("""MATCH (a) RETURN a""", nodes = [ "a" ])
     assert any([ r['id'] == 'CHEMBL.COMPOUND:CHEMBL2107774' for r in result ])
 
+def test_graph_accumulator(graph_tools):
+    accumulator = GraphAccumulator ()
+    accumulator.add_response ({
+        "answers" : [
+            { "nodes" : [ { "id" : "a", "type" : "gene" }, { "id" : "b", "type" : "disease" } ],
+              "edges" : [ { "source_id" : "a", "target_id" : "b", "type" : "causes" } ] },
+            { "nodes" : [ { "id" : "a", "name" : "A" } ],
+              "edges" : [] }
+        ]
+    })
+    accumulator.add_response (graph_tools.kgs (
+        nodes = [ { "id" : "c", "type" : "drug" }, { "id" : "b", "name" : "B" } ],
+        edges = [ { "source_id" : "c", "target_id" : "a", "type" : "targets" } ])[0])
+    graph = accumulator.to_kgs (graph_tools)[0]['result_list'][0]['result_graph']
+    assert graph['node_list'] == [
+        { "id" : "a", "type" : "gene", "name" : "A" },
+        { "id" : "b", "type" : "disease", "name" : "B" },
+        { "id" : "c", "type" : "drug" }
+    ]
+    assert [ e['type'] for e in graph['edge_list'] ] == [ "causes", "targets" ]
+
+def test_stream_graph(graph_tools):
+    response = {
+        "answers" : [
+            { "nodes" : [ { "id" : "a", "score" : 0.5, "attributes" : { "synonyms" : [ "x" ] } } ],
+              "edges" : [ { "source_id" : "a", "target_id" : "b", "weight" : 1.25 } ] }
+        ],
+        "result_list" : graph_tools.kgs (nodes = [ { "id" : "b" } ], edges = [])[0]['result_list']
+    }
+    records = list(stream_graph (BytesIO (json.dumps (response).encode ("utf-8"))))
+    assert records == [
+        ("node", { "id" : "a", "score" : 0.5, "attributes" : { "synonyms" : [ "x" ] } }),
+        ("edge", { "source_id" : "a", "target_id" : "b", "weight" : 1.25 }),
+        ("node", { "id" : "b" })
+    ]
+    assert isinstance (records[1][1]['weight'], float)
+
+    accumulator = GraphAccumulator ()
+    accumulator.add_records (stream_graph (open ("test_graph.json", "rb"), prefixes={
+        "item.result_list.item.result_graph.node_list.item" : "node",
+        "item.result_list.item.result_graph.edge_list.item" : "edge"
+    }))
+    assert len(accumulator.edges) == 888
+    assert list(accumulator.nodes.keys ())[0] == 'DOID:9352'
@@ -0,0 +1,55 @@
+import json
+import os
+import pytest
+from ros.plan import PlanCache
+
+@pytest.fixture
+def library(tmp_path):
+    module = tmp_path / "bionames.ros"
+    module.write_text ("templates: {}\n")
+    stdlib = tmp_path / "stdlib.yaml"
+    stdlib.write_text ("types: {}\n")
+    return tmp_path
+
+def spec ():
+    return {
+        "ros"      : 0.1,
+        "import"   : [ "bionames" ],
+        "workflow" : {
+            "return" : { "code" : "union", "args" : { "elements" : [] } }
+        }
+    }
+
+def test_key_tracks_imported_modules (library):
+    plans = PlanCache ()
+    libpath = [ str(library) ]
+    stdlib = str(library / "stdlib.yaml")
+    key = plans.key (spec (), libpath, stdlib)
+    assert key == plans.key (spec (), libpath, stdlib)
+
+    changed = spec ()
+    changed["workflow"]["return"]["args"]["elements"] = [ "x" ]
+    assert key != plans.key (changed, libpath, stdlib)
+
+    module = library / "bionames.ros"
+    mtime = os.path.getmtime (module) + 10
+    os.utime (module, (mtime, mtime))
+    assert key != plans.key (spec (), libpath, stdlib)
+
+def test_plans_persist_to_disk (tmp_path):
+    plan = {
+        "spec"    : spec (),
+        "topsort" : [ "return" ]
+    }
+    plans = PlanCache (path=str(tmp_path / "plans"))
+    assert plans.get ("abc") is None
+    plans.put ("abc", plan)
+
+    copy = plans.get ("abc")
+    assert copy == plan
+    copy["spec"]["workflow"]["return"]["result"] = 1
+    assert not "result" in plans.get ("abc")["spec"]["workflow"]["return"]
+
+    restarted = PlanCache (path=str(tmp_path / "plans"))
+    assert restarted.get ("abc") == plan
+    assert restarted.hits == 1
@@ -0,0 +1,40 @@
+import os
+import time
+import uuid
+from ros.cache import Cache
+from ros.cache import JSONCacheSerializer
+from ros.cache import MemoryTier
+from ros.connections import ConnectionPools
+from ros.retention import Reaper
+from ros.retention import RetentionPolicy
+
+def test_policy_separates_runs_and_content ():
+    policy = RetentionPolicy (run_ttl=60, content_ttl=0)
+    run = uuid.uuid4 ()
+    assert policy.ttl (f"{run}.job.res") == 60
+    assert policy.ttl ("9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08.res") is None
+    assert policy.ttl (f"{run}.job.pin") is None
+    assert policy.ttl ("op.2.9f86d081884c7d659a2feaa0c55ad015") is None
+
+def test_reaper_reclaims_expired_results (tmp_path):
+    memory = MemoryTier (max_bytes=2**20)
+    cache = Cache (cache_path=str(tmp_path), redis_port=1, pools=ConnectionPools (), memory=memory,
+                   serializer=JSONCacheSerializer (compression="none"), disk_write="always")
+    policy = RetentionPolicy (run_ttl=60)
+    run = uuid.uuid4 ()
+    for key in [ f"{run}.a.res", f"{run}.b.res", f"{run}.c.pin", "op.2.abc" ]:
+        cache.set (key, [ "x" * 100 ], ttl=policy.ttl (key))
+    old = time.time () - 120
+    for name in [ f"{run}.a.res", f"{run}.c.pin", "op.2.abc" ]:
+        os.utime (tmp_path / name, (old, old))
+    memory.items[f"{run}.a.res"] = (memory.items[f"{run}.a.res"][0], old)
+
+    report = Reaper (cache, policy).reap ()
+    assert report["disk"]["keys"] == 1
+    assert report["memory"]["keys"] == 1
+    assert report["bytes"] == 2 * os.path.getsize (tmp_path / f"{run}.b.res")
+    assert not (tmp_path / f"{run}.a.res").exists ()
+    for name in [ f"{run}.b.res", f"{run}.c.pin", "op.2.abc" ]:
+        assert (tmp_path / name).exists ()
+    assert cache.get (f"{run}.a.res") is None
+    assert cache.get (f"{run}.b.res") == [ "x" * 100 ]
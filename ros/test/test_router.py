@@ -0,0 +1,130 @@
+import pytest
+from types import SimpleNamespace
+from ros.config import Config
+from ros.connections import ConnectionPools
+from ros.router import OperatorRegistry
+from ros.router import Router
+from ros.workflow import Execution
+from ros.workflow import Workflow
+
+plugin_config = [ { "name" : "benchmark", "driver" : "ros.benchmark.BenchmarkPlugin" } ]
+
+class Nameless:
+    def invoke (self, event):
+        return None
+
+class Slow:
+    name = "slow"
+    pool = "gpu"
+    def invoke (self, event):
+        return None
+
+class Context:
+    referenced_variables = staticmethod (Workflow.referenced_variables)
+    substitute_variables = staticmethod (Workflow.substitute_variables)
+    def __init__(self, inputs={}, results={}):
+        self.inputs = inputs
+        self.results = results
+        self.execution = Execution ()
+        self.lookups = []
+    def get_results (self, job_names):
+        self.lookups.append (job_names)
+        return { k : self.results[k] for k in job_names if k in self.results }
+    def resolve_arg (self, value, results=None):
+        if isinstance(value, str) and value.startswith ("$"):
+            name = value[1:]
+            return self.inputs[name] if name in self.inputs else results[name]
+        return value
+
+def router (version=1):
+    workflow = SimpleNamespace (
+        config = Config ({
+            "plugins"        : plugin_config,
+            "redis"          : { "host" : "localhost", "port" : 6379 },
+            "operator_cache" : { "version" : version, "ttl" : { "default" : 0, "benchmarkoperator1" : 60 } }
+        }),
+        spec = { "templates" : {} },
+        pools = ConnectionPools ())
+    router = Router (workflow)
+    calls = []
+    for name in [ "benchmarkoperator0", "benchmarkoperator1" ]:
+        def counted (context, job_name, node, op, args, invoke=router.r[name]):
+            calls.append (job_name)
+            return invoke (context, job_name, node, op, args)
+        router.r[name] = counted
+    return router, calls
+
+def route (router, job_name, code, args, context=None):
+    context = context if context else Context ()
+    return router.route (context, job_name, { "code" : code, "args" : args }, code, args)
+
+def test_registry_is_shared ():
+    registry = OperatorRegistry.get_instance (plugin_config)
+    assert registry is OperatorRegistry.get_instance ([ dict(c) for c in plugin_config ])
+    assert "benchmarkoperator0" in registry.operators
+    assert registry.op_pools["benchmarkoperator0"] == "thread"
+
+def test_registry_rejects_invalid_operators ():
+    with pytest.raises (ValueError):
+        OperatorRegistry.validate_operator ("test.Nameless", Nameless ())
+    with pytest.raises (ValueError):
+        OperatorRegistry.validate_operator ("test.Slow", Slow ())
+
+def test_operator_cache_keys_on_arguments (tmp_path, monkeypatch):
+    monkeypatch.chdir (tmp_path)
+    r, calls = router ()
+    first = route (r, "names", "benchmarkoperator0", { "op" : "lookup", "input" : "asthma" })
+    context = Context ()
+    assert route (r, "other_names", "benchmarkoperator0", { "input" : "asthma", "op" : "lookup" }, context) == first
+    assert context.execution.cached == { "other_names" }
+    route (r, "names", "benchmarkoperator0", { "op" : "lookup", "input" : "diabetes" })
+    route (r, "names", "benchmarkoperator1", { "op" : "lookup", "input" : "asthma" })
+    assert calls == [ "names", "names", "names" ]
+
+    r2, calls2 = router (version=2)
+    route (r2, "names", "benchmarkoperator0", { "op" : "lookup", "input" : "asthma" })
+    assert calls2 == [ "names" ]
+
+def test_operator_ttl (tmp_path, monkeypatch):
+    monkeypatch.chdir (tmp_path)
+    r, calls = router ()
+    assert r.get_ttl ("benchmarkoperator0") is None
+    assert r.get_ttl ("benchmarkoperator1") == 60
+    key = r.operator_key ("benchmarkoperator0", "lookup", { "input" : "asthma" })
+    assert key.startswith ("op.1.")
+    assert key == r.operator_key ("benchmarkoperator0", "lookup", { "input" : "asthma" })
+
+def test_route_fetches_job_results_together (tmp_path, monkeypatch):
+    monkeypatch.chdir (tmp_path)
+    r, calls = router ()
+    context = Context (inputs={ "disease" : "asthma" }, results={ "genes" : [ "a" ], "drugs" : [ "b" ] })
+    args = { "op" : "lookup", "input" : "$disease", "genes" : "$genes", "drugs" : [ "$drugs" ] }
+    node = { "code" : "benchmarkoperator0", "args" : args }
+    r.route (context, "names", node, "benchmarkoperator0", args)
+    assert context.lookups == [ [ "drugs", "genes" ] ]
+
+def test_operator_cache_keys_on_referenced_content (tmp_path, monkeypatch):
+    """ Runs with the same job arguments but different inputs or upstream results don't share results. """
+    monkeypatch.chdir (tmp_path)
+    r, calls = router ()
+    def run (disease, genes, genes_job="genes"):
+        args = { "op" : "lookup", "input" : "$disease", "query" : f"select $x from ${genes_job}" }
+        node = { "code" : "benchmarkoperator0", "args" : args }
+        context = Context (inputs={ "disease" : disease, "x" : "id" }, results={ genes_job : genes })
+        r.route (context, "names", node, "benchmarkoperator0", args)
+    run ("asthma", [ "a" ])
+    run ("asthma", [ "a" ])
+    run ("asthma", [ "a" ], genes_job="other_genes")
+    run ("diabetes", [ "a" ])
+    run ("asthma", [ "b" ])
+    assert calls == [ "names", "names", "names" ]
+
+def test_union_is_not_cached (tmp_path, monkeypatch):
+    monkeypatch.chdir (tmp_path)
+    r, calls = router ()
+    results = iter ([ [ "a" ], [ "b" ] ])
+    r.r["union"] = lambda context, job_name, node, op, args: next (results)
+    args = { "elements" : [ "x", "y" ] }
+    node = { "code" : "union", "args" : args }
+    assert r.route (Context (), "return", node, "union", args) == [ "a" ]
+    assert r.route (Context (), "return", node, "union", args) == [ "b" ]
@@ -0,0 +1,248 @@
+import json
+import threading
+import time
+import pytest
+import requests
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+from ros.transport import HttpArchive
+from ros.transport import HttpTransport
+from ros.transport import install_archive
+from ros.transport import ServicePolicy
+from ros.transport import ServiceUnavailable
+
+class SlowHandler(BaseHTTPRequestHandler):
+    """ Answer each POST after a delay, echoing the question and tracking requests in flight. """
+    delay = 0.2
+    lock = threading.Lock ()
+    in_flight = 0
+    max_in_flight = 0
+    posts = 0
+    def do_POST (self):
+        cls = type(self)
+        with cls.lock:
+            cls.posts = cls.posts + 1
+            cls.in_flight = cls.in_flight + 1
+            cls.max_in_flight = max (cls.max_in_flight, cls.in_flight)
+        body = self.rfile.read (int(self.headers['Content-Length']))
+        time.sleep (cls.delay)
+        with cls.lock:
+            cls.in_flight = cls.in_flight - 1
+        self.send_response (200)
+        self.send_header ("Content-Type", "application/json")
+        self.end_headers ()
+        self.wfile.write (body)
+    def log_message (self, format, *args):
+        pass
+
+class ScriptedHandler(BaseHTTPRequestHandler):
+    """ /flaky fails twice then succeeds, /down always fails, /slow stalls on its first request. """
+    lock = threading.Lock ()
+    hits = {}
+    def do_GET (self):
+        cls = type(self)
+        with cls.lock:
+            count = cls.hits.get (self.path, 0) + 1
+            cls.hits[self.path] = count
+        status = 200
+        if self.path == "/flaky" and count <= 2 or self.path == "/down":
+            status = 503
+        if self.path == "/slow" and count == 1:
+            time.sleep (1)
+        self.send_response (status)
+        self.send_header ("Content-Type", "application/json")
+        self.end_headers ()
+        self.wfile.write (json.dumps ({ "count" : count }).encode ("utf-8"))
+    def log_message (self, format, *args):
+        pass
+
+def serve (handler):
+    server = ThreadingHTTPServer (("127.0.0.1", 0), handler)
+    thread = threading.Thread (target=server.serve_forever, daemon=True)
+    thread.start ()
+    return server
+
+@pytest.fixture
+def server ():
+    server = serve (SlowHandler)
+    yield f"http://127.0.0.1:{server.server_address[1]}/query"
+    server.shutdown ()
+
+@pytest.fixture
+def scripted ():
+    ScriptedHandler.hits = {}
+    server = serve (ScriptedHandler)
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown ()
+
+def resilient_transport (**settings):
+    return HttpTransport (coalesce=False, services={ "defaults" : settings })
+
+def test_post_many_bounds_concurrency (server):
+    transport = HttpTransport (pool_size=16, concurrency=8, host_concurrency={ "127.0.0.1" : 4 })
+    questions = [ { "question" : i } for i in range (8) ]
+    start = time.time ()
+    answers = [ response.json () for question, response in transport.post_many (server, questions) ]
+    elapsed = time.time () - start
+    transport.close ()
+    assert sorted (answers, key=lambda a: a["question"]) == questions
+    assert SlowHandler.max_in_flight == 4
+    assert 0.4 <= elapsed < 0.7
+
+def test_identical_requests_coalesce (server):
+    transport = HttpTransport (pool_size=8)
+    posts = SlowHandler.posts
+    def ask (question):
+        return transport.post (server, json=question).json ()
+    with ThreadPoolExecutor (max_workers=5) as executor:
+        answers = list(executor.map (ask, [ { "a" : 1, "b" : 2 } ] * 4 + [ { "b" : 2, "a" : 1 } ]))
+    transport.close ()
+    assert answers == [ { "a" : 1, "b" : 2 } ] * 5
+    assert SlowHandler.posts - posts == 1
+    stats = transport.flights.stats ()
+    assert [ s["avoided"] for s in stats.values () ] == [ 4 ]
+
+def test_request_key_includes_headers ():
+    key = lambda **kwargs: HttpTransport.request_key ("POST", "http://host/q", json={ "a" : 1 }, **kwargs)
+    assert key (headers={ "Accept" : "application/json" }) == key (headers={ "accept" : "application/json" })
+    assert key (headers={ "Authorization" : "a" }) != key (headers={ "Authorization" : "b" })
+    assert key () == key (headers=None) != key (headers={ "Accept" : "text/plain" })
+
+def test_retry_with_backoff (scripted):
+    transport = resilient_transport (retries=2, backoff=0.01)
+    response = transport.get (f"{scripted}/flaky")
+    assert response.status_code == 200
+    assert response.json ()["count"] == 3
+    assert transport.stats ()["127.0.0.1"]["retried"] == 2
+    transport.close ()
+
+def test_circuit_breaker_fails_fast (scripted):
+    transport = resilient_transport (retries=0, failure_threshold=2, reset_timeout=60)
+    assert transport.get (f"{scripted}/down").status_code == 503
+    assert transport.get (f"{scripted}/down").status_code == 503
+    with pytest.raises (ServiceUnavailable):
+        transport.get (f"{scripted}/down")
+    assert ScriptedHandler.hits["/down"] == 2
+    assert transport.stats ()["127.0.0.1"]["circuit"] == "open"
+    transport.close ()
+
+def test_circuit_reopens_after_failed_probe (scripted):
+    transport = resilient_transport (retries=0, failure_threshold=1, reset_timeout=0)
+    policy = transport.policy (scripted)
+    policy.breaker.failure ()
+    def broken (policy, method, url, handler=None, **kwargs):
+        raise ValueError ("malformed response")
+    transport._attempt = broken
+    with pytest.raises (ValueError):
+        transport.get (f"{scripted}/flaky")
+    assert policy.breaker.state == "open"
+    transport.close ()
+
+def test_timeout (scripted):
+    transport = resilient_transport (retries=0, read_timeout=0.2)
+    with pytest.raises (requests.Timeout):
+        transport.get (f"{scripted}/slow")
+    transport.close ()
+
+def test_hedged_request (scripted):
+    transport = resilient_transport (retries=0, hedge_percentile=95, hedge_min_samples=5)
+    policy = transport.policy (scripted)
+    for i in range (5):
+        policy.record (0.05)
+    start = time.time ()
+    response = transport.get (f"{scripted}/slow")
+    assert time.time () - start < 0.5
+    assert response.json ()["count"] == 2
+    assert policy.hedged == 1
+    transport.close ()
+
+def test_policy_overrides ():
+    policy = ServicePolicy.from_config ({ "read_timeout" : 60, "retries" : 3 }, { "read_timeout" : "300" })
+    assert policy.timeout == (5, 300)
+    assert policy.retries == 3
+    assert all ([ 0 <= policy.delay (a) <= min (policy.max_backoff, 0.5 * 2 ** a) for a in range (6) ])
+
+def test_post_many_streams_responses (server):
+    from ros.router import Router
+    transport = HttpTransport (pool_size=4)
+    questions = [ { "answers" : [ { "nodes" : [ { "id" : f"n{i}" } ], "edges" : [] } ] } for i in range (3) ]
+    records = sorted ([
+        records[0][1]["id"] for question, (response, records) in transport.post_many (
+            server, questions, handler=Router.read_graph, stream=True)
+    ])
+    transport.close ()
+    assert records == [ "n0", "n1", "n2" ]
+
+def test_streamed_questions_coalesce (server):
+    from ros.router import Router
+    transport = HttpTransport (pool_size=8)
+    posts = SlowHandler.posts
+    question = { "answers" : [ { "nodes" : [ { "id" : "n0" } ], "edges" : [] } ] }
+    answers = [
+        records for q, (response, records) in transport.post_many (
+            server, [ question ] * 4, handler=Router.read_graph, stream=True)
+    ]
+    transport.close ()
+    assert all ([ a == [ ( "node", { "id" : "n0" } ) ] for a in answers ])
+    assert SlowHandler.posts - posts == 1
+
+def test_streamed_request_is_hedged (scripted):
+    transport = resilient_transport (retries=0, hedge_percentile=95, hedge_min_samples=5)
+    policy = transport.policy (scripted)
+    for i in range (5):
+        policy.record (0.05)
+    start = time.time ()
+    count = transport.get (f"{scripted}/slow", stream=True, handler=lambda response: response.json ()["count"])
+    assert time.time () - start < 0.5
+    assert count == 2
+    assert policy.hedged == 1
+    transport.close ()
+
+def archived_transport (path, mode, latency=None):
+    return HttpTransport (
+        coalesce = False,
+        services = { "defaults" : { "retries" : 0 } },
+        archive = { "mode" : mode, "path" : str(path), "latency" : latency })
+
+def test_record_and_replay (tmp_path):
+    from ros.router import Router
+    path = tmp_path / "archive.jsonl.gz"
+    server = serve (SlowHandler)
+    url = f"http://127.0.0.1:{server.server_address[1]}/query"
+    question = { "answers" : [ { "nodes" : [ { "id" : "a" } ], "edges" : [] } ] }
+    recorder = archived_transport (path, "record")
+    assert recorder.post (url, json=question).json () == question
+    response, records = Router.read_graph (recorder.post (url, json={ "q" : 1, **question }, stream=True))
+    assert records == [ ("node", { "id" : "a" }) ]
+    recorder.close ()
+    server.shutdown ()
+
+    assert len(HttpArchive (str(path)).entries) == 2
+    player = archived_transport (path, "replay", latency="0.1")
+    start = time.time ()
+    response = player.post (url, json=dict(reversed (list(question.items ()))))
+    assert time.time () - start >= 0.1
+    assert response.status_code == 200
+    assert response.json () == question
+    response, records = Router.read_graph (player.post (url, json={ **question, "q" : 1 }, stream=True))
+    assert records == [ ("node", { "id" : "a" }) ]
+    with pytest.raises (requests.ConnectionError):
+        player.post (url, json={ "unrecorded" : True })
+    player.close ()
+
+def test_install_archive (tmp_path, monkeypatch):
+    path = tmp_path / "archive.jsonl.gz"
+    monkeypatch.setattr (requests.sessions.Session, "__init__", requests.sessions.Session.__init__)
+    ScriptedHandler.hits = {}
+    server = serve (ScriptedHandler)
+    url = f"http://127.0.0.1:{server.server_address[1]}/flaky"
+    install_archive ({ "mode" : "record", "path" : str(path), "latency" : None })
+    assert requests.get (url).status_code == 503
+    server.shutdown ()
+    monkeypatch.undo ()
+
+    monkeypatch.setattr (requests.sessions.Session, "__init__", requests.sessions.Session.__init__)
+    install_archive ({ "mode" : "replay", "path" : str(path), "latency" : None })
+    assert requests.get (url).status_code == 503
+    assert ScriptedHandler.hits[ "/flaky" ] == 1
@@ -0,0 +1,636 @@
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import logging
+import os
+import random
+import runpy
+import sys
+import threading
+import time
+import requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+from concurrent.futures import wait
+from io import BytesIO
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib.parse import urlparse
+
+logger = logging.getLogger("transport")
+logger.setLevel(logging.WARNING)
+
+def body_digest (body):
+    """ Hash a request body. JSON bodies are canonicalized so key order doesn't matter. """
+    if body is None:
+        body = b""
+    if isinstance (body, str):
+        body = body.encode ("utf-8")
+    try:
+        body = json.dumps (json.loads (body), sort_keys=True).encode ("utf-8")
+    except ValueError:
+        pass
+    return hashlib.sha256 (body).hexdigest ()[:16]
+
+class HttpArchive:
+    """
+    Recorded request/response pairs in a gzipped JSON lines file.
+    Each record is written as its own gzip member so an interrupted recording keeps everything before it.
+    """
+
+    _instances = {}
+    _lock = threading.Lock ()
+
+    def __init__(self, path):
+        self.path = os.path.expanduser (path)
+        self.lock = threading.Lock ()
+        self.entries = {}
+        if os.path.exists (self.path):
+            with gzip.open (self.path, "rt", encoding="utf-8") as stream:
+                for line in stream:
+                    entry = json.loads (line)
+                    self.entries[entry['key']] = entry
+        else:
+            directory = os.path.dirname (self.path)
+            if directory:
+                os.makedirs (directory, exist_ok=True)
+
+    @staticmethod
+    def get_instance (path):
+        """ Share one archive per path so concurrent recorders don't interleave writes. """
+        path = os.path.expanduser (path)
+        with HttpArchive._lock:
+            if not path in HttpArchive._instances:
+                HttpArchive._instances[path] = HttpArchive (path)
+            return HttpArchive._instances[path]
+
+    @staticmethod
+    def key (method, url, body):
+        return f"{method} {url} {body_digest (body)}"
+
+    def get (self, key):
+        return self.entries.get (key)
+
+    def put (self, key, method, url, response, elapsed):
+        """ Record a response whose content has been read. """
+        content = response.content
+        try:
+            body, encoding = content.decode ("utf-8"), "text"
+        except UnicodeDecodeError:
+            body, encoding = base64.b64encode (content).decode ("ascii"), "base64"
+        entry = {
+            "key"      : key,
+            "method"   : method,
+            "url"      : url,
+            "status"   : response.status_code,
+            "reason"   : response.reason,
+            "headers"  : {
+                k : v for k, v in response.headers.items ()
+                if not k.lower () in [ "content-encoding", "content-length", "transfer-encoding" ]
+            },
+            "encoding" : encoding,
+            "body"     : body,
+            "elapsed"  : round (elapsed, 4)
+        }
+        with self.lock:
+            self.entries[key] = entry
+            with gzip.open (self.path, "at", encoding="utf-8") as stream:
+                stream.write (json.dumps (entry) + "\n")
+
+class ArchiveAdapter(HTTPAdapter):
+    """
+    A requests transport adapter that records the responses passing through it to an HttpArchive,
+    or replays recorded responses without touching the network.
+    In replay mode, latency is None for none, "recorded" to reproduce recorded response times, or seconds.
+    """
+    RECORD = "record"
+    REPLAY = "replay"
+
+    def __init__(self, archive, mode, latency=None, **kwargs):
+        super ().__init__ (**kwargs)
+        self.archive = archive
+        self.mode = mode
+        self.latency = latency
+
+    def delay (self, entry):
+        if self.latency == "recorded":
+            return entry.get ("elapsed", 0)
+        return float (self.latency) if self.latency else 0
+
+    def send (self, request, **kwargs):
+        key = HttpArchive.key (request.method, request.url, request.body)
+        if self.mode == ArchiveAdapter.REPLAY:
+            entry = self.archive.get (key)
+            if entry is None:
+                raise requests.ConnectionError (f"No recorded response for {request.method} {request.url}", request=request)
+            delay = self.delay (entry)
+            if delay > 0:
+                time.sleep (delay)
+            return self.replay (request, entry)
+        start = time.time ()
+        response = super ().send (request, **kwargs)
+        self.archive.put (key, request.method, request.url, response, time.time () - start)
+        """ Recording read the body. Serve streamed readers from the copy. """
+        response.raw = BytesIO (response.content)
+        return response
+
+    def replay (self, request, entry):
+        """ Build a response from a recorded entry. """
+        content = entry['body'].encode ("utf-8") if entry['encoding'] == "text" else base64.b64decode (entry['body'])
+        response = requests.Response ()
+        response.status_code = entry['status']
+        response.reason = entry.get ('reason')
+        response.headers = CaseInsensitiveDict (entry['headers'])
+        response.encoding = requests.utils.get_encoding_from_headers (response.headers)
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        response.raw = BytesIO (content)
+        response._content = content
+        return response
+
+def archive_settings (config=None):
+    """ Archive mode, path, and latency from the environment or the http.archive configuration. """
+    archive_config = {}
+    if config is not None:
+        archive_config = config.get ('http', {}).get ('archive', {})
+    settings = {
+        "mode"    : archive_config.get ('mode', None),
+        "path"    : archive_config.get ('path', "~/.ros/http_archive.jsonl.gz"),
+        "latency" : archive_config.get ('latency', None)
+    }
+    for name in settings:
+        settings[name] = os.environ.get (f"HTTP_ARCHIVE_{name.upper ()}", settings[name])
+    if not settings['mode'] in [ ArchiveAdapter.RECORD, ArchiveAdapter.REPLAY ]:
+        settings['mode'] = None
+    return settings
+
+def archive_adapter (settings, **kwargs):
+    """ An ArchiveAdapter for these settings, or None if archiving is off. """
+    if not settings['mode']:
+        return None
+    logger.info (f"HTTP {settings['mode']} with archive {settings['path']}")
+    return ArchiveAdapter (
+        archive = HttpArchive.get_instance (settings['path']),
+        mode = settings['mode'],
+        latency = settings['latency'],
+        **kwargs)
+
+def install_archive (settings=None):
+    """
+    Record or replay every requests session in this process, including module level requests.get and post.
+    For code outside the engine: the knowledge source API servers and roscwlapi.
+    Returns the adapter, or None if archiving is off.
+    """
+    settings = settings if settings else archive_settings ()
+    adapter = archive_adapter (settings)
+    if adapter is None:
+        return None
+    session_init = requests.sessions.Session.__init__
+    def init (session, *args, **kwargs):
+        session_init (session, *args, **kwargs)
+        session.mount ("http://", adapter)
+        session.mount ("https://", adapter)
+    requests.sessions.Session.__init__ = init
+    return adapter
+
+class ServiceUnavailable(Exception):
+    """ A service's circuit is open, so requests to it fail fast. """
+    pass
+
+class CircuitBreaker:
+    """
+    Stop calling a service after consecutive failures.
+    Once reset_timeout passes, one probe request is let through. Success closes the circuit; failure reopens it.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock ()
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.rejected = 0
+
+    def allow (self):
+        """ Whether a request may be sent now. """
+        with self.lock:
+            if self.state == CircuitBreaker.CLOSED:
+                return True
+            if self.state == CircuitBreaker.OPEN and time.time () - self.opened_at >= self.reset_timeout:
+                self.state = CircuitBreaker.HALF_OPEN
+                return True
+            self.rejected = self.rejected + 1
+            return False
+
+    def success (self):
+        with self.lock:
+            self.state = CircuitBreaker.CLOSED
+            self.failures = 0
+
+    def failure (self):
+        with self.lock:
+            self.failures = self.failures + 1
+            if self.state == CircuitBreaker.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != CircuitBreaker.OPEN:
+                    logger.warning (f"circuit opened after {self.failures} failures")
+                self.state = CircuitBreaker.OPEN
+                self.opened_at = time.time ()
+
+class ServicePolicy:
+    """ Timeouts, retries, circuit breaking, and hedging for one service. """
+
+    """ Settings configurable in ros.yaml, with their types. """
+    SETTINGS = {
+        "connect_timeout"   : float,
+        "read_timeout"      : float,
+        "retries"           : int,
+        "backoff"           : float,
+        "max_backoff"       : float,
+        "failure_threshold" : int,
+        "reset_timeout"     : float,
+        "hedge_percentile"  : float,
+        "hedge_min_samples" : int
+    }
+
+    def __init__(self, connect_timeout=5, read_timeout=120, retries=2, backoff=0.5, max_backoff=10,
+                 failure_threshold=5, reset_timeout=30, hedge_percentile=0, hedge_min_samples=20):
+        """
+        :connect_timeout: Seconds to wait for a connection.
+        :read_timeout: Seconds to wait between bytes of the response.
+        :retries: Attempts after the first for connection errors, timeouts, 429 and 5xx responses.
+        :backoff: Base of the exponential retry delay. Each delay is drawn uniformly below the bound.
+        :max_backoff: Upper bound on a retry delay.
+        :failure_threshold: Consecutive failures that open the circuit.
+        :reset_timeout: Seconds the circuit stays open before a probe request.
+        :hedge_percentile: Send a duplicate request once the first has taken longer than this latency percentile. Zero disables hedging.
+        :hedge_min_samples: Latency samples needed before hedging.
+        """
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = CircuitBreaker (failure_threshold, reset_timeout)
+        self.latencies = deque (maxlen=200)
+        self.retried = 0
+        self.hedged = 0
+
+    @staticmethod
+    def from_config (*sources):
+        """ Build a policy from configuration sections, later sections overriding earlier ones. """
+        settings = {}
+        for source in sources:
+            if not hasattr (source, 'get'):
+                continue
+            for name, kind in ServicePolicy.SETTINGS.items ():
+                value = source.get (name, None)
+                if value is not None:
+                    settings[name] = kind (float (value))
+        return ServicePolicy (**settings)
+
+    def delay (self, attempt):
+        """ Exponential backoff with full jitter. """
+        return random.uniform (0, min (self.max_backoff, self.backoff * 2 ** attempt))
+
+    def record (self, seconds):
+        self.latencies.append (seconds)
+
+    def hedge_after (self):
+        """ Seconds after which to send a hedged request, or None. """
+        if not self.hedge_percentile or len(self.latencies) < self.hedge_min_samples:
+            return None
+        ordered = sorted (self.latencies)
+        index = min (len(ordered) - 1, int (len(ordered) * self.hedge_percentile / 100))
+        return ordered[index]
+
+class Flight:
+    """ A call in progress and the callers waiting on it. """
+    def __init__(self):
+        self.done = threading.Event ()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """
+    Share one call among concurrent callers with the same key.
+    The first caller makes the call. Callers arriving while it's in flight wait for and share its outcome.
+    """
+    def __init__(self):
+        self.lock = threading.Lock ()
+        self.flights = {}
+        self.calls = {}
+        self.shared = {}
+
+    def do (self, key, f, *args, **kwargs):
+        """ Call f, or wait on the identical call already in flight. """
+        with self.lock:
+            flight = self.flights.get (key)
+            leader = flight is None
+            if leader:
+                flight = Flight ()
+                self.flights[key] = flight
+                self.calls[key] = self.calls.get (key, 0) + 1
+            else:
+                self.shared[key] = self.shared.get (key, 0) + 1
+        if not leader:
+            flight.done.wait ()
+            if flight.error:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = f (*args, **kwargs)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set ()
+
+    def stats (self):
+        """ Upstream calls and duplicate calls avoided, by key. """
+        with self.lock:
+            return {
+                key : {
+                    "calls"   : self.calls[key],
+                    "avoided" : self.shared.get (key, 0)
+                } for key in self.calls
+            }
+
+class HttpTransport:
+    """
+    Pooled HTTP client shared by all operators in a process.
+
+    One requests session keeps connections to each knowledge source alive. Concurrent requests
+    to a service are bounded by a per host limit, so fanning out many questions doesn't swamp it.
+    Each host has a ServicePolicy for timeouts, retries, circuit breaking, and hedging.
+    """
+
+    _instance = None
+    _lock = threading.Lock ()
+
+    def __init__(self, pool_size=32, concurrency=8, host_concurrency={}, coalesce=True, services={}, archive=None):
+        """
+        :pool_size: Connections kept alive per host, and threads available for concurrent requests.
+        :concurrency: Default maximum concurrent requests to one host.
+        :host_concurrency: Maximum concurrent requests by host name, overriding the default.
+        :coalesce: Share one upstream call among concurrent identical requests.
+        :services: Resilience settings: defaults, overridden by host name.
+        :archive: Record or replay settings from archive_settings. Requests are sent live if None.
+        """
+        self.services = services
+        self.policies = {}
+        self.pool_size = pool_size
+        self.concurrency = concurrency
+        self.host_concurrency = host_concurrency
+        self.coalesce = coalesce
+        self.flights = SingleFlight ()
+        self.session = requests.Session ()
+        adapter = archive_adapter (archive, pool_connections=pool_size, pool_maxsize=pool_size) if archive else None
+        if adapter is None:
+            adapter = HTTPAdapter (pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount ("http://", adapter)
+        self.session.mount ("https://", adapter)
+        self.executor = ThreadPoolExecutor (max_workers=pool_size)
+        """ Hedged requests run in their own pool so callers on the main pool can't starve them. """
+        self.hedge_executor = ThreadPoolExecutor (max_workers=pool_size)
+        self.lock = threading.Lock ()
+        self.limits = {}
+
+    @staticmethod
+    def get_instance (config=None):
+        """ Get the process wide transport, sizing it from configuration on first use. """
+        if HttpTransport._instance is None:
+            with HttpTransport._lock:
+                if HttpTransport._instance is None:
+                    http_config = config.get ('http', {}) if config is not None else {}
+                    concurrency = http_config.get ('concurrency', {})
+                    HttpTransport._instance = HttpTransport (
+                        pool_size = int(http_config.get ('pool_size', 32)),
+                        concurrency = int(concurrency.get ('default', 8)),
+                        host_concurrency = concurrency,
+                        coalesce = str(http_config.get ('coalesce', True)).lower () not in [ 'false', '0', 'no' ],
+                        services = config.get ('services', {}) if config is not None else {},
+                        archive = archive_settings (config))
+        return HttpTransport._instance
+
+    def limit (self, url):
+        """ The semaphore bounding concurrent requests to this url's host. """
+        host = urlparse (url).hostname
+        semaphore = self.limits.get (host)
+        if semaphore is None:
+            with self.lock:
+                semaphore = self.limits.get (host)
+                if semaphore is None:
+                    limit = int(self.host_concurrency.get (host, self.concurrency) or self.concurrency)
+                    semaphore = threading.BoundedSemaphore (limit)
+                    self.limits[host] = semaphore
+        return semaphore
+
+    @staticmethod
+    def request_key (method, url, **kwargs):
+        """
+        Identify a request by method, url, and a hash of its canonical headers, parameters and body.
+        Header names are case insensitive, so requests differing only in auth or accept headers aren't shared.
+        """
+        headers = kwargs.get ("headers") or {}
+        text = json.dumps ({
+            "headers" : sorted ([ (str(k).lower (), str(v)) for k, v in headers.items () ]),
+            "params"  : kwargs.get ("params"),
+            "json"    : kwargs.get ("json"),
+            "data"    : kwargs.get ("data")
+        }, sort_keys=True, default=str)
+        return f"{method} {url} {hashlib.sha256 (text.encode ('utf-8')).hexdigest ()[:16]}"
+
+    def policy (self, url):
+        """ The resilience policy for this url's host. """
+        host = urlparse (url).hostname
+        policy = self.policies.get (host)
+        if policy is None:
+            with self.lock:
+                policy = self.policies.get (host)
+                if policy is None:
+                    policy = ServicePolicy.from_config (
+                        self.services.get ('defaults', {}),
+                        self.services.get (host, {}))
+                    self.policies[host] = policy
+        return policy
+
+    @staticmethod
+    def retryable (response):
+        return response.status_code == 429 or response.status_code >= 500
+
+    def _timed (self, policy, method, url, handler=None, **kwargs):
+        """
+        Send one request, waiting for a slot at the host, and record its latency. Returns the response and
+        the handler's result. A response that won't be retried is handled within the timing and the host slot,
+        so reading a streamed body counts toward latency and is covered by hedging.
+        """
+        with self.limit (url):
+            start = time.time ()
+            response = self.session.request (method, url, **kwargs)
+            value = handler (response) if handler and not HttpTransport.retryable (response) else None
+            policy.record (time.time () - start)
+            return response, value
+
+    @staticmethod
+    def _discard (future):
+        """ Close the response of a hedged request that lost the race. """
+        if not future.cancelled () and future.exception () is None:
+            future.result ()[0].close ()
+
+    def _attempt (self, policy, method, url, handler=None, **kwargs):
+        """
+        Send a request and handle its response. If that's slower than the policy's hedge threshold,
+        race it against a duplicate.
+        """
+        hedge_after = policy.hedge_after ()
+        if hedge_after is None:
+            return self._timed (policy, method, url, handler, **kwargs)
+        primary = self.hedge_executor.submit (self._timed, policy, method, url, handler, **kwargs)
+        done, pending = wait ([ primary ], timeout=hedge_after)
+        if primary in done:
+            return primary.result ()
+        policy.hedged = policy.hedged + 1
+        logger.debug (f"hedging {method} {url} after {hedge_after:.3f}s")
+        backup = self.hedge_executor.submit (self._timed, policy, method, url, handler, **kwargs)
+        error = None
+        for future in as_completed ([ primary, backup ]):
+            try:
+                result = future.result ()
+            except requests.RequestException as e:
+                error = e
+                continue
+            other = backup if future is primary else primary
+            other.add_done_callback (HttpTransport._discard)
+            return result
+        raise error
+
+    def _send (self, method, url, handler=None, **kwargs):
+        """
+        Send a request under the host's policy. Connection errors, timeouts, 429 and 5xx responses are
+        retried with jittered exponential backoff and count against the circuit breaker.
+        Raises ServiceUnavailable while the circuit is open. Returns the last response if retries run out.
+        If a handler is given, its result for the final response is returned instead of the response.
+        """
+        policy = self.policy (url)
+        kwargs.setdefault ('timeout', policy.timeout)
+        response = None
+        for attempt in range (policy.retries + 1):
+            if attempt > 0:
+                policy.retried = policy.retried + 1
+                time.sleep (policy.delay (attempt - 1))
+            if not policy.breaker.allow ():
+                raise ServiceUnavailable (f"Circuit open for {urlparse (url).hostname}")
+            settled = False
+            try:
+                response, value = self._attempt (policy, method, url, handler, **kwargs)
+                settled = True
+            except requests.RequestException as e:
+                logger.warning (f"{method} {url} failed on attempt {attempt + 1}: {e}")
+                policy.breaker.failure ()
+                settled = True
+                if attempt == policy.retries:
+                    raise
+                continue
+            finally:
+                """ Any other error still counts, so a half open circuit's probe can't leave it stuck. """
+                if not settled:
+                    policy.breaker.failure ()
+            if HttpTransport.retryable (response):
+                logger.warning (f"{method} {url} returned {response.status_code} on attempt {attempt + 1}")
+                policy.breaker.failure ()
+                if attempt < policy.retries:
+                    """ Return the connection to the pool; only the last response is handed back. """
+                    response.close ()
+                continue
+            policy.breaker.success ()
+            return value if handler else response
+        return handler (response) if handler else response
+
+    def request (self, method, url, handler=None, **kwargs):
+        """
+        Issue a request over the pooled session, waiting for a slot at the host.
+        Concurrent identical requests share one upstream call and its response. If a handler is given,
+        it's called on the response and its result is returned and shared instead.
+        """
+        if not self.coalesce or (kwargs.get ('stream', False) and handler is None):
+            """ A streamed body can only be read once, so an unhandled streamed response can't be shared. """
+            return self._send (method, url, handler, **kwargs)
+        key = HttpTransport.request_key (method, url, **kwargs)
+        if handler:
+            key = f"{key} {getattr (handler, '__qualname__', repr (handler))}"
+        return self.flights.do (key, self._send, method, url, handler, **kwargs)
+
+    def get (self, url, **kwargs):
+        return self.request ("GET", url, **kwargs)
+
+    def post (self, url, **kwargs):
+        return self.request ("POST", url, **kwargs)
+
+    def post_many (self, url, bodies, handler=None, **kwargs):
+        """
+        POST each body to url concurrently, yielding (body, response) pairs as responses arrive.
+        Latency is about one round trip per batch of the host's concurrency limit.
+        If a handler is given, it's called on each response in the worker thread and its result is yielded
+        in place of the response. Handlers can read streamed responses concurrently this way, while identical
+        questions still share one call and slow ones are still hedged. Shared results mustn't be modified.
+        """
+        futures = {
+            self.executor.submit (self.post, url, json=body, handler=handler, **kwargs) : body
+            for body in bodies
+        }
+        for future in as_completed (futures):
+            yield futures[future], future.result ()
+
+    def stats (self):
+        """ Resilience metrics by host. """
+        return {
+            host : {
+                "circuit"  : policy.breaker.state,
+                "failures" : policy.breaker.failures,
+                "rejected" : policy.breaker.rejected,
+                "retried"  : policy.retried,
+                "hedged"   : policy.hedged,
+                "samples"  : len(policy.latencies)
+            } for host, policy in self.policies.items ()
+        }
+
+    def close (self):
+        """ Release pooled connections and worker threads. """
+        self.executor.shutdown (wait=False)
+        self.hedge_executor.shutdown (wait=False)
+        self.session.close ()
+
+def main ():
+    """ Run a Python program with its HTTP requests recorded to or replayed from an archive. """
+    arg_parser = argparse.ArgumentParser(
+        description='Record or replay HTTP traffic of a Python program.',
+        formatter_class=lambda prog: argparse.ArgumentDefaultsHelpFormatter(prog, max_help_position=60))
+    arg_parser.add_argument('mode', help="record or replay", choices=[ ArchiveAdapter.RECORD, ArchiveAdapter.REPLAY ])
+    arg_parser.add_argument('--archive', help="Archive path.", default="~/.ros/http_archive.jsonl.gz")
+    arg_parser.add_argument('--latency', help="Replay delay: seconds, or 'recorded'.", default=None)
+    arg_parser.add_argument('program', help="Python program and its arguments.", nargs=argparse.REMAINDER)
+    args = arg_parser.parse_args ()
+
+    """ Programs run under this launcher, including engine transports they create, use the archive. """
+    os.environ['HTTP_ARCHIVE_MODE'] = args.mode
+    os.environ['HTTP_ARCHIVE_PATH'] = args.archive
+    if args.latency:
+        os.environ['HTTP_ARCHIVE_LATENCY'] = args.latency
+    install_archive ()
+    sys.argv = args.program
+    runpy.run_path (args.program[0], run_name="__main__")
+
+if __name__ == '__main__':
+    main ()
@@ -7,6 +7,7 @@ import unittest
 import datetime
 import os
 import re
+import threading
 from collections import namedtuple
 import copy
 import yaml
@@ -144,12 +145,136 @@ class Resource:
                 else:
                     target.append( src_elements[name] )
 
+class Interner:
+    """
+    Share one string object for each distinct identifier and type name.
+
+    The same CURIEs and type names recur in every node, edge, and cached result a workflow touches,
+    and each decoded copy is a separate object. Interning the fields that hold them makes every copy the
+    same object. The table is process wide and is cleared when it reaches max_entries so it stays bounded.
+    """
+
+    """ Fields holding CURIEs and type names. """
+    FIELDS = ( "id", "type", "source_id", "target_id" )
+
+    _instance = None
+    _lock = threading.Lock ()
+
+    def __init__(self, max_entries=1000000, enabled=True):
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.strings = {}
+
+    @staticmethod
+    def get_instance ():
+        if Interner._instance is None:
+            with Interner._lock:
+                if Interner._instance is None:
+                    Interner._instance = Interner ()
+        return Interner._instance
+
+    def intern (self, value):
+        """ The shared copy of a string. Other values are returned as they are. """
+        if not isinstance(value, str) or not self.enabled:
+            return value
+        shared = self.strings.get (value, None)
+        if shared is None:
+            if len(self.strings) >= self.max_entries:
+                self.strings = {}
+            self.strings[value] = value
+            shared = value
+        return shared
+
+    def intern_element (self, element):
+        """ Intern the identifier and type fields of a node or edge in place. """
+        if self.enabled:
+            for field in Interner.FIELDS:
+                value = element.get (field, None)
+                if isinstance(value, str):
+                    element[field] = self.intern (value)
+                elif isinstance(value, list):
+                    element[field] = [ self.intern (v) for v in value ]
+        return element
+
+    def intern_json (self, value):
+        """ Intern the identifier and type fields of every dict in a decoded JSON value, in place. """
+        if not self.enabled:
+            return value
+        fields = set(Interner.FIELDS)
+        stack = [ value ]
+        while len(stack) > 0:
+            item = stack.pop ()
+            if type(item) is dict:
+                for name, v in item.items ():
+                    if type(v) is str:
+                        if name in fields:
+                            item[name] = self.intern (v)
+                    elif type(v) is dict or type(v) is list:
+                        stack.append (v)
+            elif type(item) is list:
+                for v in item:
+                    if type(v) is dict or type(v) is list:
+                        stack.append (v)
+        return value
+
+    def report (self):
+        return { "entries" : len(self.strings), "max_entries" : self.max_entries, "enabled" : self.enabled }
+
+""" Compiled jsonpath expressions by query text. Queries come from code and workflows, so there are few. """
+jsonpath_queries = {}
+
+def compile_jsonpath (query):
+    """ Parse a jsonpath query once per process. """
+    compiled = jsonpath_queries.get (query, None)
+    if compiled is None:
+        compiled = parse (query)
+        jsonpath_queries[query] = compiled
+    return compiled
+
+def jsonpath_all (value):
+    """ The values [*] matches: the items of a list, or a dict, integer or string as if it were a one item list. """
+    if isinstance(value, (dict, int, str)):
+        yield value
+    elif isinstance(value, list):
+        yield from value
+
+def kgs_elements (graph, list_name):
+    """
+    Yield each element of the named list in every result graph, without jsonpath's generic tree walk.
+    Equivalent to $.[*].result_list.[*].[*].result_graph.<list_name>.[*] for node_list and edge_list.
+    """
+    for answer_set in jsonpath_all (graph):
+        if not isinstance(answer_set, dict) or not 'result_list' in answer_set:
+            continue
+        for results in jsonpath_all (answer_set['result_list']):
+            for result in jsonpath_all (results):
+                if not isinstance(result, dict) or not 'result_graph' in result:
+                    continue
+                result_graph = result['result_graph']
+                if not isinstance(result_graph, dict) or not list_name in result_graph:
+                    continue
+                yield from jsonpath_all (result_graph[list_name])
+
+""" Hand written equivalents of the queries run on every answer set. """
+KGS_NODES = "$.[*].result_list.[*].[*].result_graph.node_list.[*]"
+KGS_EDGES = "$.[*].result_list.[*].[*].result_graph.edge_list.[*]"
+jsonpath_fast_paths = {
+    KGS_NODES : lambda graph: kgs_elements (graph, "node_list"),
+    KGS_EDGES : lambda graph: kgs_elements (graph, "edge_list")
+}
+
 class JSONKit:
     """ Generic kit for sql like selects on JSON object hierarchies. """
+    def find (self, query, graph):
+        """ Values matching a jsonpath query. """
+        fast_path = jsonpath_fast_paths.get (query, None)
+        if fast_path:
+            return list(fast_path (graph))
+        return [ match.value for match in compile_jsonpath (query).find (graph) ]
+
     def select (self, query, graph, field="type", target=None):
         """ Query nodes by some field, matching a list of target values """
-        jsonpath_query = parse (query)
-        values = [ match.value for match in jsonpath_query.find (graph) ]
+        values = self.find (query, graph)
         return [ val for val in values if target is None or val[field] in target ]
 
 class Syfur:
@@ -1,4 +1,5 @@
 import argparse
+import hashlib
 import importlib
 import json
 import logging
@@ -6,20 +7,27 @@ import requests
 import os
 import re
 import sys
+import threading
 import yaml
 import time
 import traceback
+import heapq
 from jsonpath_rw import jsonpath, parse
 import networkx as nx
 import uuid
 from networkx.algorithms import lexicographical_topological_sort
+from ros.router import OperatorRegistry
 from ros.router import Router
 from ros.util import Resource
 from ros.config import Config
+from ros.connections import ConnectionPools
 from ros.graph import TranslatorGraphTools
 from ros.kgraph import Neo4JKnowledgeGraph
 from ros.util import JSONKit
 from ros.cache import Cache
+from ros.cache import JSONCacheSerializer
+from ros.plan import PlanCache
+from ros.retention import RetentionPolicy
 
 logger = logging.getLogger("ros")
 logger.setLevel(logging.WARNING)
@@ -29,6 +37,53 @@ class Execution:
         self.done = {}
         self.running = {}
         self.failed = {}
+        self.skipped = []
+        """ Jobs whose operator result came from the operator cache. """
+        self.cached = set ()
+
+class DependencyTracker:
+    """
+    Event driven dependency tracking.
+    Each job counts its unfinished dependencies. Completing a job decrements the counts of its
+    dependents and queues those reaching zero, so scheduling a workflow costs O(jobs + dependencies).
+    Ready jobs are released highest priority first, ties broken by their position in order.
+    """
+    def __init__(self, dependents, in_degree, order, priority={}):
+        """
+        :dependents: Map of job name to the jobs depending on it.
+        :in_degree: Map of job name to its number of dependencies.
+        :order: All job names, usually topologically sorted.
+        :priority: Optional map of job name to priority. Higher values run first.
+        """
+        self.dependents = dependents
+        self.priority = priority
+        self.position = { job : index for index, job in enumerate (order) }
+        self.remaining = { job : in_degree.get (job, 0) for job in order }
+        self.ready = []
+        for job in order:
+            if self.remaining[job] == 0:
+                self.push (job)
+
+    def push (self, job_name):
+        heapq.heappush (self.ready, (
+            -self.priority.get (job_name, 0),
+            self.position.get (job_name, len(self.position)),
+            job_name))
+
+    def pop_ready (self, limit=None):
+        """ Remove and return ready jobs, at most limit of them if a limit is given. """
+        count = len(self.ready) if limit is None else min (limit, len(self.ready))
+        return [ heapq.heappop (self.ready)[-1] for i in range (count) ]
+
+    def complete (self, job_name):
+        """ Record completion of a job. Returns the jobs it made ready. """
+        newly_ready = []
+        for dependent in self.dependents.get (job_name, []):
+            self.remaining[dependent] = self.remaining[dependent] - 1
+            if self.remaining[dependent] == 0:
+                newly_ready.append (dependent)
+                self.push (dependent)
+        return newly_ready
         
 class Workflow:
     
@@ -41,7 +96,7 @@ class Workflow:
     """
     
     def __init__(self, spec, inputs={}, config=None, libpath=["."],
-                 local_db_connection=True, enable_cache=True):
+                 local_db_connection=True, enable_cache=True, incremental=False, pools=None, pin=False):
 
         """
         Creates a workflow definition with enough context to execute it.
@@ -54,6 +109,9 @@ class Workflow:
         :libpath: An array of strings where each is a directory in which workflow modules may be found.
         :local_connection: Attempt to connect to a local graph database. Disabled when used from a workflow service client.
         :enable_cache: Enable persistent caching.
+        :incremental: Key results by content rather than by execution so unchanged jobs are reused across runs.
+        :pools: Connection pools to use. Defaults to the process wide pools.
+        :pin: Keep this run's results indefinitely instead of expiring them under the retention policy.
         """
         
         assert spec, "Workflow specification is required."
@@ -70,35 +128,59 @@ class Workflow:
             
         """ Set inputs, specification, generate a GUID, load configuration, and connect to the graph. """
         self.enable_cache=enable_cache
+        self.incremental = incremental
+        self.pin = pin
         self.inputs = inputs
         self.spec = spec
         self.uuid = uuid.uuid4 ()
         self.config = Config (config)
+        self.pools = pools if pools else ConnectionPools.get_instance (self.config)
         self.tools = TranslatorGraphTools ()
+        self.serializer = JSONCacheSerializer.from_config (self.config)
+        self.retention = RetentionPolicy.from_config (self.config)
+        self.latencies = {}
+        self.latency_updates = set ()
         if local_db_connection:
             if self.enable_cache:
-                self.cache = Cache (redis_host=self.config['REDIS_HOST'],
-                                    redis_port=self.config['REDIS_PORT'])
+                self.cache = Cache.from_config (self.config, serializer=self.serializer, pools=self.pools)
             else:
                 self.mem_cache = {}
             db_host = self.config.get('NEO4J_HOST', "localhost")
-            self.graph = Neo4JKnowledgeGraph (host=db_host)
+            self.graph = Neo4JKnowledgeGraph (host=db_host, pools=self.pools)
+
+        """ Jobs run in executor threads; the graph session must not be used concurrently. """
+        self.graph_lock = threading.Lock ()
         self.errors = []
         self.json = JSONKit ()
 
         """ Prepare to manage execution state. """
         self.execution = Execution ()
 
-        """ Load plugins. """
-        self.plugins = []
-        plugin_config = self.config["plugins"]
-        for plugin_def in plugin_config:
-            name = plugin_def['name']
-            driver = self.instantiate (plugin_def['driver'])
-            self.plugins.append (driver)
-            workflows = driver.workflows ()
-            logger.debug (f"Connecting {name}: {driver}")
-            logger.debug (f"  --workflows: {workflows}")
+        """ Load plugins. Plugins and their operators are loaded once per process. """
+        self.plugins = OperatorRegistry.get_instance (self.config["plugins"]).plugins
+        self.router = None
+
+        """ Reuse the compiled plan for this spec if we've seen it, otherwise compile and cache it. """
+        plan_cache = PlanCache.get_instance (self.config)
+        plan_key = plan_cache.key (self.spec, self.libpath, self.stdlib_path ()) if plan_cache else None
+        plan = plan_cache.get (plan_key) if plan_cache else None
+        if plan:
+            self.load_plan (plan)
+        else:
+            self.compile ()
+            if plan_cache:
+                plan_cache.put (plan_key, self.compiled_plan ())
+
+        """ Address results by content in incremental mode. """
+        if self.incremental:
+            self.job_keys = Workflow.content_keys (
+                spec = self.spec,
+                inputs = self.inputs,
+                dependencies = self.dependencies,
+                topsort = self.topsort)
+        
+    def compile (self):
+        """ Resolve, validate, and plan the workflow specification. """
 
         """ Resolve imports. """
         self.resolve_imports ()
@@ -114,6 +196,43 @@ class Workflow:
 
         """ Validate the workflow with respect to the schema. """
         self.enforce_specification ()
+
+    def compiled_plan (self):
+        """ The products of compilation that can be reused by later workflows with the same spec. """
+        return {
+            "spec"         : self.spec,
+            "types"        : self.types,
+            "dag"          : self.dag,
+            "dependencies" : self.dependencies,
+            "dependents"   : self.dependents,
+            "in_degree"    : self.in_degree,
+            "topsort"      : self.topsort
+        }
+
+    def load_plan (self, plan):
+        """ Adopt a previously compiled plan. """
+        self.spec = plan['spec']
+        self.types = plan['types']
+        self.dag = plan['dag']
+        self.dependencies = plan['dependencies']
+        self.dependents = plan['dependents']
+        self.in_degree = plan['in_degree']
+        self.topsort = plan['topsort']
+
+    def get_router (self):
+        """ The router for this workflow, created on first use and shared by its jobs. """
+        if self.router is None:
+            self.router = Router (self)
+        return self.router
+
+    def close (self):
+        """ Release this workflow's graph store session. Pooled connections are shared and stay open. """
+        graph = getattr (self, "graph", None)
+        if graph is not None:
+            graph.close ()
+
+    def stdlib_path (self):
+        return os.path.join(os.path.dirname(__file__), 'stdlib.yaml')
         
     def instantiate (self, class_name):
         """ Given a class name <module>.<classname>, load the module and instantiate the class. """
@@ -163,12 +282,86 @@ class Workflow:
             dependencies = self.get_dependent_job_names (op_node)
             for d in dependencies:
                 self.dag.add_edge (operator, d, attr_dict={})
-        for job_name, op_node in self.spec.get("workflow",{}).items ():
-            self.dependencies[job_name] = self.generate_dependent_jobs (self.spec, job_name, self.dag)
+        """ Edges point from a job to its dependencies. Read them in one pass over the adjacency. """
+        for job_name, adjacent in self.dag.adjacency ():
+            self.dependencies[job_name] = [ d for d in adjacent.keys () ]
+        self.dependents, self.in_degree = Workflow.reverse_dependencies (self.dependencies)
         self.topsort = [ t for t in reversed([
             t for t in lexicographical_topological_sort (self.dag) ])
         ]
 
+    @staticmethod
+    def reverse_dependencies (dependencies):
+        """ Given a map of job to dependencies, compute each job's dependents and its dependency count. """
+        dependents = { job_name : [] for job_name in dependencies }
+        in_degree = {}
+        for job_name, job_dependencies in dependencies.items ():
+            in_degree[job_name] = len(job_dependencies)
+            for d in job_dependencies:
+                dependents.setdefault (d, []).append (job_name)
+        return dependents, in_degree
+
+    @staticmethod
+    def critical_path (dependents, topsort, costs):
+        """
+        Estimate each job's remaining critical path: its own cost plus the longest path through its dependents.
+        topsort lists dependencies before the jobs that need them, so walking it backwards visits dependents first.
+        """
+        remaining = {}
+        for job_name in reversed (topsort):
+            downstream = [ remaining.get (d, 0) for d in dependents.get (job_name, []) ]
+            remaining[job_name] = costs.get (job_name, 0) + (max (downstream) if len(downstream) > 0 else 0)
+        return remaining
+
+    """ Operator latency history. """
+    def latency_key (self, op_node):
+        """ Latency history is kept per operator, identified by code and op. """
+        return f"latency.{op_node.get('code')}.{op_node.get('args',{}).get('op','')}"
+
+    def get_latency (self, job_name):
+        """ Historical latency of the job's operator in seconds, or None if it has not been observed. """
+        op_node = self.get_step (job_name)
+        if not op_node:
+            return None
+        return self.latencies.get (self.latency_key (op_node))
+
+    def load_latencies (self):
+        """ Read the latency history of every operator in the workflow from the cache in one batch. """
+        if not self.enable_cache:
+            return
+        keys = { self.latency_key (op_node) for op_node in map (self.get_step, self.topsort) if op_node }
+        self.latencies.update (self.cache.get_many (list(keys)))
+
+    def record_latency (self, job_name, seconds, weight=0.3):
+        """
+        Fold an observed latency into the operator's exponentially weighted moving average.
+        Observations are held in memory until save_latencies writes them.
+        """
+        op_node = self.get_step (job_name)
+        if not op_node:
+            return
+        previous = self.get_latency (job_name)
+        value = seconds if previous is None else weight * seconds + (1 - weight) * previous
+        key = self.latency_key (op_node)
+        self.latencies[key] = value
+        self.latency_updates.add (key)
+
+    def save_latencies (self):
+        """ Write latencies observed during this run to the cache in one batch. """
+        if self.enable_cache and len(self.latency_updates) > 0:
+            self.cache.set_many ({ key : self.latencies[key] for key in self.latency_updates })
+        self.latency_updates = set ()
+
+    def estimate_costs (self):
+        """ Estimated cost of each job from operator history. Unobserved operators get the configured default. """
+        self.load_latencies ()
+        default = float(self.config.get ('executor', {}).get ('default_job_latency', 1))
+        costs = {}
+        for job_name in self.topsort:
+            latency = self.get_latency (job_name)
+            costs[job_name] = default if latency is None else latency
+        return costs
+
     def resolve_imports (self):
         """ Import separately developed workflow modules into this workflow. """
         if 'import' in self.spec:
@@ -203,8 +396,7 @@ class Workflow:
         Validate the existence of implementations for each module/operator.
         """
         logger.debug ("validate")
-        types_config = os.path.join(os.path.dirname(__file__), 'stdlib.yaml')
-        with open (types_config, 'r') as stream:
+        with open (self.stdlib_path (), 'r') as stream:
             self.types = yaml.load (stream)['types']
             self.spec['types'] = self.types
             
@@ -231,11 +423,11 @@ class Workflow:
         logger.debug ("valid.")
         
     @staticmethod
-    def get_workflow(workflow="mq2.ros", inputs={}, library_path=["."]):
+    def get_workflow(workflow="mq2.ros", inputs={}, library_path=["."], incremental=False):
         workflow_spec = None
         with open(workflow, "r") as stream:
             workflow_spec = yaml.load (stream.read ())
-        return Workflow (workflow_spec, inputs=inputs, libpath=library_path)
+        return Workflow (workflow_spec, inputs=inputs, libpath=library_path, incremental=incremental)
     
     '''
     def set_result(self, job_name, value):
@@ -267,21 +459,23 @@ class Workflow:
             result = name.replace("$","") if isinstance(name,str) and name.startswith ("$") else None
         return result
     
-    def resolve_arg (self, name):
-        return [ self.resolve_arg_inner (v) for v in name ] if isinstance(name, list) else self.resolve_arg_inner (name)
+    def resolve_arg (self, name, results=None):
+        """ Resolve an argument. Job results already fetched with get_results are used instead of the cache. """
+        return [ self.resolve_arg_inner (v, results) for v in name ] if isinstance(name, list) else self.resolve_arg_inner (name, results)
     
-    def resolve_arg_inner (self, name):
+    def resolve_arg_inner (self, name, results=None):
         ''' Find the value of an argument passed to the workflow. '''
         value = name
         if isinstance(name,str) and name.startswith ("$"):
             var = name.replace ("$","")
-            ''' Is this a job result? '''
-            job_result = self.get_result (var)
             if var in self.inputs:
                 value = self.inputs[var]
                 if "," in value:
                     value = value.split (",")
-            elif job_result or isinstance(job_result, dict):
+                return value
+            ''' Is this a job result? '''
+            job_result = results[var] if results is not None and var in results else self.get_result (var)
+            if job_result or isinstance(job_result, dict):
                 value = job_result
             else:
                 raise ValueError (f"Referenced undefined variable: {var}")
@@ -333,8 +527,86 @@ class Workflow:
     
     """ Result management. """
     def form_key (self, job_name):
-        """ Form the key name. """
-        return f"{self.uuid}.{job_name}.res"
+        """
+        Form the key name. Incremental workflows use the job's content address instead of the execution id.
+        Pinned results end with .pin rather than .res so retention never expires them. The suffix is part
+        of the key because Redis keys carry their own expiry; reuse_result looks under both.
+        """
+        return self.result_key (job_name, "pin" if self.pin else "res")
+
+    def result_key (self, job_name, suffix):
+        if self.incremental and job_name in self.job_keys:
+            return f"{self.job_keys[job_name]}.{suffix}"
+        return f"{self.uuid}.{job_name}.{suffix}"
+
+    @staticmethod
+    def referenced_variables (value, names):
+        """ Collect the names of variables referenced anywhere in a job's arguments. """
+        if isinstance(value, dict):
+            for v in value.values ():
+                Workflow.referenced_variables (v, names)
+        elif isinstance(value, list):
+            for v in value:
+                Workflow.referenced_variables (v, names)
+        elif isinstance(value, str):
+            names.update (re.findall ("\\$([A-Za-z_][A-Za-z0-9_]*)", value))
+        return names
+
+    @staticmethod
+    def substitute_variables (value, values):
+        """ Replace each variable referenced in a job's arguments whose name is in values, wherever it appears. """
+        if isinstance(value, dict):
+            return { k : Workflow.substitute_variables (v, values) for k, v in value.items () }
+        elif isinstance(value, list):
+            return [ Workflow.substitute_variables (v, values) for v in value ]
+        elif isinstance(value, str):
+            return re.sub ("\\$([A-Za-z_][A-Za-z0-9_]*)", lambda m: values.get (m.group (1), m.group (0)), value)
+        return value
+    
+    @staticmethod
+    def content_keys (spec, inputs, dependencies, topsort):
+        """
+        Compute a content address for each job: a hash of its operator code and op, its arguments,
+        the values of the inputs it references, and the content addresses of its upstream jobs.
+        A change to one input or one step changes only the keys of the affected sub-DAG.
+        """
+        keys = {}
+        jobs = spec.get ("workflow", {})
+        for job_name in topsort:
+            op_node = jobs.get (job_name, {})
+            args = op_node.get ("args", {})
+            content = {
+                "code"     : op_node.get ("code"),
+                "op"       : args.get ("op"),
+                "args"     : args,
+                "inputs"   : {
+                    name : inputs[name]
+                    for name in sorted (Workflow.referenced_variables (args, set ())) if name in inputs
+                },
+                "upstream" : sorted ([ keys[d] for d in dependencies.get (job_name, []) ])
+            }
+            text = json.dumps (content, sort_keys=True, default=str)
+            keys[job_name] = hashlib.sha256 (text.encode ("utf-8")).hexdigest ()
+        return keys
+
+    def reuse_result (self, job_name):
+        """
+        In incremental mode, adopt a result stored by a previous run with the same content address.
+        Storing it again refreshes its retention, and pins it if this run is pinned.
+        """
+        if not (self.incremental and self.enable_cache):
+            return False
+        """ Pinned and unpinned runs reuse each other's results, preferring a result stored under this run's own key. """
+        keys = [ self.form_key (job_name), self.result_key (job_name, "res" if self.pin else "pin") ]
+        values = self.cache.get_many (keys)
+        value = next ((values[key] for key in keys if values.get (key) is not None), None)
+        if value is None:
+            return False
+        if isinstance (value, str):
+            value = json.loads (value)
+        """ Store the reused result as a computed one would be: in the graph store and under this run's key. """
+        self.set_result (job_name, value)
+        return True
     
     def set_result (self, job_name, value):
         """ Set the result value. """
@@ -345,28 +617,49 @@ class Workflow:
 
         """ Update the graph store. """
         if value:
-            self.tools.to_knowledge_graph (
-                in_graph = self.tools.to_nx (value),
-                out_graph = self.graph)
+            in_graph = self.tools.to_nx (value)
+            with self.graph_lock:
+                self.tools.to_knowledge_graph (
+                    in_graph = in_graph,
+                    out_graph = self.graph)
 
         """ Cache. """
+        key = self.form_key (job_name)
         if self.enable_cache:
-            key = self.form_key (job_name)
-            self.cache.set (key, json.dumps(value, indent=2))
+            self.cache.set (key, value, ttl=self.retention.ttl (key))
         else:
-            self.mem_cache[key] = json.dumps(value, indent=2)
+            self.mem_cache[key] = self.serializer.dumps (value)
             
     def get_result (self, job_name):
         """ Get the result graph. We pass the whole graph for every graph. """
         result = None
         
         """ Cache. """
+        key = self.form_key (job_name)
         if self.enable_cache:
-            key = self.form_key (job_name)
             val = self.cache.get (key)
         else:
-            val = self.mem_cache[key]
-        return json.loads (val) if val else None
+            val = self.mem_cache.get (key)
+            val = self.serializer.loads (val) if val is not None else None
+        if isinstance (val, str):
+            """ Results cached before values were stored natively are JSON text. """
+            val = json.loads (val)
+        return val
+
+    def get_results (self, job_names):
+        """ Get the results of several jobs at once, with one cache round trip. Jobs without results are omitted. """
+        keys = { self.form_key (job_name) : job_name for job_name in job_names }
+        if self.enable_cache:
+            values = self.cache.get_many (list(keys.keys ()))
+        else:
+            values = {
+                key : self.serializer.loads (self.mem_cache[key])
+                for key in keys if key in self.mem_cache
+            }
+        return {
+            keys[key] : json.loads (value) if isinstance (value, str) else value
+            for key, value in values.items ()
+        }
 
     """ Manage variable and query resolution generically. """
     